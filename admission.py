@@ -0,0 +1,284 @@
+"""Admission control for upstream (DeepSeek) calls.
+
+At most `max_concurrent` calls run at once; up to `max_queue` more wait in
+line for at most `queue_timeout` seconds. When the line is full, or a waiter
+runs out of time, the call is shed immediately with Overloaded so the route
+can answer with fallback_response or HTTP 503 instead of piling up threads.
+Both blocking threads and asyncio tasks can wait on the same controller.
+
+Free slots are handed out by weighted fair queuing between clients: every
+waiter gets a virtual finish tag (start + 1/weight, where start continues
+from the client's previous tag), and the smallest tag goes next. A client
+flooding the queue only pushes its own tags further out, so light users keep
+getting slots quickly. Each client may also hold at most `max_queue_per_client`
+places in line.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+from rate_limit import api_key_id
+
+# Identity used for calls that don't say who they are for
+ANONYMOUS_CLIENT = 'anonymous'
+
+
+class Overloaded(Exception):
+    """The call was shed by admission control"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Upstream overloaded ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('client', 'enqueued_at', 'start_tag', 'granted', 'abandoned',
+                 'event', 'future', 'loop')
+
+    def __init__(self, client: str, start_tag: float,
+                 event: Optional[threading.Event] = None,
+                 future: Optional['asyncio.Future'] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.client = client
+        self.enqueued_at = time.monotonic()
+        self.start_tag = start_tag
+        self.granted = False
+        self.abandoned = False
+        self.event = event
+        self.future = future
+        self.loop = loop
+
+    def wake(self) -> None:
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded, weighted-fair wait queue and a queue-time deadline"""
+
+    def __init__(self, max_concurrent: int = 64, max_queue: int = 256,
+                 queue_timeout: float = 10.0, retry_after: float = 5.0,
+                 max_queue_per_client: Optional[int] = None,
+                 weights: Optional[Dict[str, float]] = None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.max_queue_per_client = max_queue_per_client or max_queue
+        self.weights = weights or {}
+        self._active = 0
+        # Heap of (finish_tag, sequence, waiter); abandoned waiters are skipped lazily
+        self._heap: List[Tuple[float, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._queued = 0
+        self._queued_by_client: Dict[str, int] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+        self._counters = {
+            "admitted": 0,
+            "queued": 0,
+            "shedQueueFull": 0,
+            "shedClientQueueFull": 0,
+            "shedQueueTimeout": 0,
+        }
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        # Recent queue wait times (seconds) for percentiles
+        self._recent_waits: Deque[float] = deque(maxlen=1024)
+
+    def _try_admit(self) -> bool:
+        # Caller holds self._lock
+        if self._active < self.max_concurrent and not self._queued:
+            self._active += 1
+            self._record_admission(0.0)
+            return True
+        return False
+
+    def _enqueue(self, client: str, **wake_args) -> _Waiter:
+        # Caller holds self._lock
+        if self._queued >= self.max_queue:
+            self._counters["shedQueueFull"] += 1
+            raise Overloaded('queue_full', self.retry_after)
+        if self._queued_by_client.get(client, 0) >= self.max_queue_per_client:
+            self._counters["shedClientQueueFull"] += 1
+            raise Overloaded('client_queue_full', self.retry_after)
+
+        start = max(self._virtual_time, self._last_finish.get(client, 0.0))
+        finish = start + 1.0 / self.weights.get(client, 1.0)
+        self._last_finish[client] = finish
+        waiter = _Waiter(client, start, **wake_args)
+        heapq.heappush(self._heap, (finish, next(self._sequence), waiter))
+        self._queued += 1
+        self._queued_by_client[client] = self._queued_by_client.get(client, 0) + 1
+        self._counters["queued"] += 1
+        return waiter
+
+    def _dequeued(self, waiter: _Waiter) -> None:
+        # Caller holds self._lock
+        self._queued -= 1
+        remaining = self._queued_by_client[waiter.client] - 1
+        if remaining:
+            self._queued_by_client[waiter.client] = remaining
+        else:
+            del self._queued_by_client[waiter.client]
+
+    def _record_admission(self, waited: float) -> None:
+        # Caller holds self._lock
+        self._counters["admitted"] += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self._recent_waits.append(waited)
+
+    def _give_up(self, waiter: _Waiter) -> None:
+        # Caller holds self._lock; the waiter was not granted a slot
+        waiter.abandoned = True
+        self._dequeued(waiter)
+        self._counters["shedQueueTimeout"] += 1
+
+    def acquire(self, client: str = ANONYMOUS_CLIENT) -> None:
+        """Take a slot, waiting in line if needed; raises Overloaded when shed"""
+        with self._lock:
+            if self._try_admit():
+                return
+            waiter = self._enqueue(client, event=threading.Event())
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.granted:
+                self._record_admission(time.monotonic() - waiter.enqueued_at)
+                return
+            self._give_up(waiter)
+        raise Overloaded('queue_timeout', self.retry_after)
+
+    async def acquire_async(self, client: str = ANONYMOUS_CLIENT) -> None:
+        """asyncio version of acquire"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_admit():
+                return
+            waiter = self._enqueue(client, future=loop.create_future(), loop=loop)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    waiter.abandoned = True
+                    self._dequeued(waiter)
+            if granted:
+                self.release()
+            raise
+
+        with self._lock:
+            if waiter.granted:
+                self._record_admission(time.monotonic() - waiter.enqueued_at)
+                return
+            self._give_up(waiter)
+        raise Overloaded('queue_timeout', self.retry_after)
+
+    def release(self) -> None:
+        """Free a slot, handing it straight to the waiter with the smallest finish tag"""
+        with self._lock:
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.abandoned:
+                    continue
+                self._virtual_time = max(self._virtual_time, waiter.start_tag)
+                self._dequeued(waiter)
+                waiter.granted = True
+                waiter.wake()
+                self._forget_idle_clients()
+                return
+            self._active -= 1
+            self._forget_idle_clients()
+
+    def _forget_idle_clients(self) -> None:
+        # Caller holds self._lock. Finish tags at or behind the virtual clock
+        # no longer affect scheduling, so keep the per-client map small.
+        if len(self._last_finish) > 4 * (self.max_queue + self.max_concurrent):
+            self._last_finish = {
+                client: finish for client, finish in self._last_finish.items()
+                if finish > self._virtual_time
+            }
+
+    @contextmanager
+    def slot(self, client: str = ANONYMOUS_CLIENT):
+        self.acquire(client)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, client: str = ANONYMOUS_CLIENT):
+        await self.acquire_async(client)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["active"] = self._active
+            stats["queueDepth"] = self._queued
+            stats["queuedClients"] = len(self._queued_by_client)
+            admitted = self._counters["admitted"]
+            recent = sorted(self._recent_waits)
+            wait_total = self._wait_total
+            wait_max = self._wait_max
+        stats["maxConcurrent"] = self.max_concurrent
+        stats["maxQueue"] = self.max_queue
+        stats["maxQueuePerClient"] = self.max_queue_per_client
+        stats["queueTimeoutSeconds"] = self.queue_timeout
+        stats["waitMs"] = {
+            "avg": round(wait_total / admitted * 1000, 3) if admitted else 0.0,
+            "max": round(wait_max * 1000, 3),
+            "p50": round(recent[len(recent) // 2] * 1000, 3) if recent else 0.0,
+            "p95": round(recent[int(len(recent) * 0.95)] * 1000, 3) if recent else 0.0,
+        }
+        return stats
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """Parse "key:abc=4,ip:10.0.0.1=0.5" into a client -> weight map (API keys
+    are given as is and stored under their client id)"""
+    weights = {}
+    for item in value.split(','):
+        client, sep, weight = item.strip().rpartition('=')
+        if sep and client:
+            if client.startswith('key:'):
+                client = api_key_id(client[len('key:'):])
+            weights[client] = float(weight)
+    return weights
+
+
+def admission_from_env() -> AdmissionController:
+    """Build the upstream admission controller from LAYZA_UPSTREAM_* variables"""
+    max_queue = int(os.environ.get('LAYZA_UPSTREAM_MAX_QUEUE', 256))
+    return AdmissionController(
+        max_concurrent=int(os.environ.get('LAYZA_UPSTREAM_MAX_CONCURRENT', 64)),
+        max_queue=max_queue,
+        queue_timeout=float(os.environ.get('LAYZA_UPSTREAM_QUEUE_TIMEOUT', 10)),
+        retry_after=float(os.environ.get('LAYZA_SHED_RETRY_AFTER', 5)),
+        max_queue_per_client=int(os.environ.get('LAYZA_UPSTREAM_MAX_QUEUE_PER_CLIENT',
+                                                max(1, max_queue // 4))),
+        weights=parse_weights(os.environ.get('LAYZA_CLIENT_WEIGHTS', '')),
+    )
@@ -0,0 +1,518 @@
+"""Async serving mode for the Layza backend.
+
+The chat, upload and feedback routes run on an asyncio event loop (Quart) and
+talk to DeepSeek through a non-blocking aiohttp client, so a single process can
+keep thousands of upstream calls pending instead of one per worker thread.
+Every other route is still answered by the Flask app from server.py, which
+remains the default way to run the backend. The response cache and the rate
+limiter are shared with it and blocking (SQLite, Redis, fcntl-locked mmap), so
+they are called through asyncio.to_thread rather than on the loop.
+
+    python async_server.py
+    hypercorn async_server:app --bind 127.0.0.1:5000
+
+Requires the optional packages quart, aiohttp, hypercorn and asgiref.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import AsyncIterator, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, jsonify, request
+
+import server
+from server import (
+    SHED_MODE,
+    SINGLEFLIGHT_WAIT_TIMEOUT,
+    TEST_API_KEYS,
+    _cache_allowed,
+    _conversation_id,
+    _feedback_rating,
+    _split_for_streaming,
+    _sse_event,
+    build_payload,
+    context_cache_key,
+    chat_rate_limiter,
+    client_identity,
+    fallback_response,
+    generate_simulated_response,
+    math_fast_path,
+    RESPONSES_BY_SOURCE,
+    _subject_label,
+    observe_request,
+    record_event,
+    record_upstream,
+    remember_exchange,
+    resolve_subject,
+    response_cache,
+    start_upload,
+    upload_error_body,
+    upload_job_body,
+    upstream_admission,
+)
+from admission import ANONYMOUS_CLIENT, Overloaded
+from singleflight import AsyncSingleFlight, SingleFlightTimeout
+from metrics import REGISTRY, server_timing, span, start_spans
+from structured_logging import new_request_id, request_id_var
+from upload_store import UploadError
+from upstream_client import AsyncDeepSeekClient, CircuitOpenError, UpstreamError, async_client_from_env
+
+logger = logging.getLogger(__name__)
+
+quart_app = Quart(__name__)
+# Upload routes enforce their own, per-kind limits while streaming
+quart_app.config['MAX_CONTENT_LENGTH'] = max(server.IMAGE_MAX_BYTES, server.AUDIO_MAX_BYTES) + server.UPLOAD_OVERHEAD_BYTES
+
+# Paths handled on the event loop; everything else goes to the Flask app
+ASYNC_PATHS = {
+    '/api/chat',
+    '/api/chat/stream',
+    '/api/upload-image',
+    '/api/upload-audio',
+    '/api/feedback',
+}
+
+# Created when serving starts so the client binds to the running loop. It
+# shares the circuit breaker of the blocking client: one view of upstream health.
+deepseek_async_client: Optional[AsyncDeepSeekClient] = None
+inflight_requests = AsyncSingleFlight()
+
+
+@quart_app.before_serving
+async def _open_upstream_client():
+    global deepseek_async_client
+    deepseek_async_client = async_client_from_env(server.DEEPSEEK_API_URL,
+                                                  breaker=server.deepseek_client.breaker)
+    server.cpu_pool.warm_up()
+
+
+def _async_upstream_status_samples():
+    if deepseek_async_client is None:
+        return
+    for status, count in deepseek_async_client.stats()["statusCodes"].items():
+        yield 'layza_upstream_responses_total', {"status": status, "client": "async"}, count
+
+
+REGISTRY.collector('DeepSeek HTTP attempts by status code ("timeout"/"error" without a response)', 'counter',
+                   _async_upstream_status_samples)
+
+
+@quart_app.after_serving
+async def _close_upstream_client():
+    if deepseek_async_client is not None:
+        await deepseek_async_client.aclose()
+    server.cpu_pool.close()
+
+
+@quart_app.before_request
+async def _start_request():
+    new_request_id(request.headers.get('X-Request-ID'))
+    request.scope['layza.started'] = time.perf_counter()
+    start_spans()
+
+
+@quart_app.after_request
+async def _add_cors_headers(response):
+    # Same permissive policy as flask_cors' CORS(app) in server.py
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+    response.headers.setdefault('Access-Control-Allow-Headers', 'Content-Type, Cache-Control, X-API-Key, X-Request-ID')
+    response.headers.setdefault('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+    response.headers.setdefault('X-Request-ID', request_id_var.get() or '')
+    observe_request(request.url_rule.rule if request.url_rule is not None else None, request.method,
+                    response.status_code, request.scope.get('layza.started'),
+                    request.content_length, response.content_length)
+    timing = server_timing()
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+
+async def _math_fast_path_async(message: str, subject: str) -> Optional[str]:
+    """Non-blocking counterpart of server._math_fast_path"""
+    if subject != 'math' or math_fast_path is None:
+        return None
+    try:
+        with span('math'):
+            answer = await math_fast_path.answer_async(message)
+    except Exception as e:
+        logger.exception(f"Math fast path failed: {e}")
+        return None
+    if answer is not None:
+        RESPONSES_BY_SOURCE.inc('math', 'math')
+    return answer
+
+
+async def deepseek_ai_response_async(message: str, subject: str, use_cache: bool = True,
+                                     client: str = ANONYMOUS_CLIENT,
+                                     conversation_id: Optional[str] = None) -> str:
+    """Non-blocking counterpart of server.deepseek_ai_response"""
+    local_answer = await _math_fast_path_async(message, subject)
+    if local_answer is not None:
+        remember_exchange(conversation_id, message, local_answer)
+        return local_answer
+
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+
+    if not api_key:
+        logger.warning("Warning: DEEPSEEK_API_KEY not found in environment variables")
+        return fallback_response(subject)
+
+    if api_key in TEST_API_KEYS:
+        logger.info("Using temporary mock response due to test API key")
+        simulated = generate_simulated_response(message, subject)
+        remember_exchange(conversation_id, message, simulated)
+        return simulated
+
+    with span('payload'):
+        payload = build_payload(message, subject, conversation_id=conversation_id)
+    cache_key = context_cache_key(message, subject, payload)
+    if use_cache and response_cache is not None:
+        with span('cache'):
+            cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            RESPONSES_BY_SOURCE.inc('cache', _subject_label(subject))
+            logger.info("Serving DeepSeek response from cache")
+            remember_exchange(conversation_id, message, cached)
+            return cached
+
+    async def fetch() -> Optional[str]:
+        with span('admission'):
+            await upstream_admission.acquire_async(client)
+        started = time.perf_counter()
+        try:
+            with span('upstream'):
+                ai_response = await deepseek_async_client.complete(payload, api_key)
+        except CircuitOpenError:
+            logger.warning("DeepSeek circuit breaker is open, skipping upstream call")
+            record_upstream('circuit_open', started)
+            return None
+        except UpstreamError as e:
+            logger.error(f"DeepSeek API call failed: {e}")
+            record_upstream('error', started, status=e.status_code)
+            return None
+        finally:
+            upstream_admission.release()
+        record_upstream('ok', started)
+        if response_cache is not None:
+            await asyncio.to_thread(response_cache.set, cache_key, ai_response)
+        return ai_response
+
+    try:
+        ai_response, _ = await inflight_requests.do(cache_key, fetch, timeout=SINGLEFLIGHT_WAIT_TIMEOUT)
+    except SingleFlightTimeout:
+        logger.warning("Timed out waiting for an identical in-flight DeepSeek request")
+        return fallback_response(subject)
+    except Overloaded as e:
+        logger.warning(f"Shedding DeepSeek request: {e}")
+        if SHED_MODE == '503':
+            raise
+        return fallback_response(subject)
+
+    if ai_response is None:
+        return fallback_response(subject)
+    remember_exchange(conversation_id, message, ai_response)
+    return ai_response
+
+
+async def deepseek_ai_stream_async(message: str, subject: str, use_cache: bool = True,
+                                   client: str = ANONYMOUS_CLIENT,
+                                   conversation_id: Optional[str] = None) -> AsyncIterator[Tuple[str, bool]]:
+    """Non-blocking counterpart of server.deepseek_ai_stream"""
+    local_answer = await _math_fast_path_async(message, subject)
+    if local_answer is not None:
+        remember_exchange(conversation_id, message, local_answer)
+        for token in _split_for_streaming(local_answer):
+            yield token, False
+        return
+
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+
+    if not api_key or api_key in TEST_API_KEYS:
+        if api_key:
+            text = generate_simulated_response(message, subject)
+            remember_exchange(conversation_id, message, text)
+        else:
+            text = fallback_response(subject)
+        for token in _split_for_streaming(text):
+            yield token, not api_key
+        return
+
+    payload = build_payload(message, subject, stream=True, conversation_id=conversation_id)
+    cache_key = context_cache_key(message, subject, payload)
+    if use_cache and response_cache is not None:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            RESPONSES_BY_SOURCE.inc('cache', _subject_label(subject))
+            remember_exchange(conversation_id, message, cached)
+            for token in _split_for_streaming(cached):
+                yield token, False
+            return
+
+    streamed = []
+    started = time.perf_counter()
+    try:
+        async with upstream_admission.slot_async(client):
+            async for token in deepseek_async_client.stream(payload, api_key):
+                streamed.append(token)
+                yield token, False
+        if streamed:
+            answer = ''.join(streamed)
+            if response_cache is not None:
+                await asyncio.to_thread(response_cache.set, cache_key, answer)
+            remember_exchange(conversation_id, message, answer)
+        record_upstream('ok', started, stream=True)
+    except (UpstreamError, Overloaded) as e:
+        logger.error(f"Error streaming from DeepSeek API: {e}")
+        if isinstance(e, UpstreamError):
+            record_upstream('circuit_open' if isinstance(e, CircuitOpenError) else 'error', started,
+                            status=e.status_code, stream=True)
+        for token in _split_for_streaming(fallback_response(subject)):
+            yield token, True
+
+
+async def _rate_limit_check(client: str):
+    """Quart counterpart of server._rate_limit_check"""
+    if chat_rate_limiter is None:
+        return None
+    allowed, retry_after = await asyncio.to_thread(chat_rate_limiter.allow, client)
+    if allowed:
+        return None
+    logger.warning(f"Rate limiting chat client {client}")
+    body = {
+        "response": "Calma! 😊 Você enviou muitas perguntas seguidas. Espere um pouquinho e tente de novo.",
+        "error": True
+    }
+    return jsonify(body), 429, {"Retry-After": str(max(1, int(math.ceil(retry_after))))}
+
+
+# API Routes
+@quart_app.route('/api/chat', methods=['POST'])
+async def chat():
+    try:
+        data = await request.get_json(silent=True)
+        if not data:
+            logger.error("No JSON data received in request")
+            return jsonify({
+                "response": "Ops, não recebi nenhuma mensagem. Pode tentar novamente?",
+                "error": True
+            }), 400
+
+        message = data.get('message', '')
+        subject = data.get('subject', '')
+        use_cache = _cache_allowed(data, request.headers)
+
+        if not message:
+            logger.warning("Empty message received")
+            return jsonify({
+                "response": "Olá! Parece que você não enviou nenhuma mensagem. Como posso te ajudar hoje?",
+                "error": False
+            })
+
+        client = client_identity(request.headers, data, request.remote_addr)
+        limited = await _rate_limit_check(client)
+        if limited is not None:
+            return limited
+
+        subject, subject_guess = resolve_subject(message, subject)
+        started = time.perf_counter()
+        conversation_id = _conversation_id(data)
+        response = await deepseek_ai_response_async(message, subject, use_cache=use_cache, client=client,
+                                                     conversation_id=conversation_id)
+        record_event('chat', conversation_id=conversation_id, subject=subject, outcome='ok',
+                     latency_ms=(time.perf_counter() - started) * 1000,
+                     messageChars=len(message), responseChars=len(response))
+
+        body = {
+            "response": response,
+            "error": False
+        }
+        if subject_guess is not None:
+            body["detectedSubject"] = subject_guess
+        return jsonify(body)
+    except Overloaded as e:
+        body = {
+            "response": "Estou recebendo muitas perguntas agora! 😅 Pode tentar de novo em alguns segundos?",
+            "error": True
+        }
+        return jsonify(body), 503, {"Retry-After": str(int(math.ceil(e.retry_after)))}
+    except Exception as e:
+        logger.exception(f"Error in chat endpoint: {e}")
+        return jsonify({
+            "response": "Ops, ocorreu um erro interno. Por favor, tente novamente.",
+            "error": True
+        })
+
+
+@quart_app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    data = await request.get_json(silent=True)
+    if not data:
+        logger.error("No JSON data received in stream request")
+        return jsonify({
+            "response": "Ops, não recebi nenhuma mensagem. Pode tentar novamente?",
+            "error": True
+        }), 400
+
+    message = data.get('message', '')
+    subject = data.get('subject', '')
+    use_cache = _cache_allowed(data, request.headers)
+
+    if not message:
+        logger.warning("Empty message received")
+        return jsonify({
+            "response": "Olá! Parece que você não enviou nenhuma mensagem. Como posso te ajudar hoje?",
+            "error": False
+        })
+
+    client = client_identity(request.headers, data, request.remote_addr)
+    limited = await _rate_limit_check(client)
+    if limited is not None:
+        return limited
+
+    subject, subject_guess = resolve_subject(message, subject)
+    conversation_id = _conversation_id(data)
+
+    async def generate():
+        fallback = False
+        started = time.perf_counter()
+        response_chars = 0
+        try:
+            async for token, is_fallback in deepseek_ai_stream_async(message, subject, use_cache=use_cache, client=client,
+                                                                conversation_id=conversation_id):
+                fallback = fallback or is_fallback
+                response_chars += len(token)
+                yield _sse_event({"token": token, "fallback": is_fallback})
+            done = {"error": False, "fallback": fallback}
+            if subject_guess is not None:
+                done["detectedSubject"] = subject_guess
+            yield _sse_event(done, event='done')
+            record_event('chat', conversation_id=conversation_id, subject=subject,
+                         outcome='fallback' if fallback else 'ok',
+                         latency_ms=(time.perf_counter() - started) * 1000, stream=True,
+                         messageChars=len(message), responseChars=response_chars)
+        except Exception as e:
+            logger.exception(f"Error in chat stream: {e}")
+            yield _sse_event({
+                "response": "Ops, ocorreu um erro interno. Por favor, tente novamente.",
+                "error": True
+            }, event='error')
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.timeout = None
+    return response
+
+
+@quart_app.route('/api/upload-image', methods=['POST'])
+async def upload_image():
+    """Stream the image to the content store as it arrives and queue OCR for it"""
+    if server.upload_store is None:
+        return jsonify({"error": True, "message": "Envio de imagens indisponível"}), 503
+    try:
+        with span('upload'):
+            upload = start_upload('image', request.content_type, request.content_length)
+            try:
+                # Body chunks are small and land in the page cache, so writing
+                # them inline costs less than a thread hop per chunk
+                async for chunk in request.body:
+                    upload.feed(chunk)
+                stored = upload.finish()
+            finally:
+                # Drops the temp file of a dropped connection; a no-op once finished
+                upload.abort()
+        body, status = upload_job_body('image', stored, request.host_url)
+        return jsonify(body), status
+    except UploadError as e:
+        body, status = upload_error_body(e)
+        return jsonify(body), status
+    except Exception as e:
+        logger.exception(f"Error in upload_image endpoint: {e}")
+        return jsonify({
+            "error": True,
+            "message": "Erro ao processar a imagem"
+        }), 500
+
+
+@quart_app.route('/api/upload-audio', methods=['POST'])
+async def upload_audio():
+    """Stream the audio to the content store as it arrives and queue its transcription"""
+    if server.upload_store is None:
+        return jsonify({"error": True, "message": "Envio de áudio indisponível"}), 503
+    try:
+        with span('upload'):
+            upload = start_upload('audio', request.content_type, request.content_length)
+            try:
+                async for chunk in request.body:
+                    upload.feed(chunk)
+                stored = upload.finish()
+            finally:
+                upload.abort()
+        body, status = upload_job_body('audio', stored, request.host_url)
+        return jsonify(body), status
+    except UploadError as e:
+        body, status = upload_error_body(e, 'audio')
+        return jsonify(body), status
+    except Exception as e:
+        logger.exception(f"Error in upload_audio endpoint: {e}")
+        return jsonify({
+            "error": True,
+            "message": "Erro ao processar o áudio"
+        }), 500
+
+
+@quart_app.route('/api/feedback', methods=['POST'])
+async def feedback():
+    try:
+        data = await request.get_json(silent=True)
+        if not data or not isinstance(data, dict):
+            logger.error("No JSON data received in feedback request")
+            return jsonify({
+                "success": False,
+                "message": "Dados de feedback não recebidos"
+            }), 400
+
+        rating = data.get('rating', 0)
+        conversation_id = _conversation_id(data)
+
+        if not conversation_id:
+            logger.warning("No conversation ID in feedback")
+
+        logger.info(f"Received feedback: rating={rating}, conversation_id={conversation_id}")
+        record_event('feedback', conversation_id=conversation_id,
+                     subject=data['subject'] if isinstance(data.get('subject'), str) else None,
+                     rating=_feedback_rating(rating))
+
+        return jsonify({
+            "success": True,
+            "message": "Feedback recebido com sucesso!"
+        })
+    except Exception as e:
+        logger.exception(f"Error in feedback endpoint: {e}")
+        return jsonify({
+            "success": False,
+            "message": "Erro ao processar feedback"
+        }), 500
+
+
+flask_app = WsgiToAsgi(server.app)
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: async routes on Quart, the rest on the Flask app"""
+    if scope['type'] == 'http' and scope['path'] not in ASYNC_PATHS:
+        await flask_app(scope, receive, send)
+        return
+    await quart_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [os.environ.get('LAYZA_ASYNC_BIND', '127.0.0.1:5000')]
+    asyncio.run(serve(app, config))
@@ -4,11 +4,20 @@ import json
 import os
 import random
 import time
+import sys
 from typing import Dict, List, Optional, Union
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from video_index import video_index_from_env  # noqa: E402
+
 app = Flask(__name__)
 CORS(app)
 
+# The video catalog is real data (data/videos.json), so it is searched here too
+video_index = video_index_from_env()
+
 # Mock API responses since we can't connect to real APIs
 def mock_ai_response(message: str, subject: str) -> str:
     """Generate a mock AI response simulating Layza's feminine and socratic style"""
@@ -51,33 +60,11 @@ def mock_ai_response(message: str, subject: str) -> str:
     
     return response
 
-def mock_youtube_recommendations(query: str) -> List[Dict]:
-    """Generate mock YouTube video recommendations"""
-    # Sample video recommendations
-    recommendations = [
-        {
-            "id": "1",
-            "title": "Função Exponencial - Aula Completa para o ENEM",
-            "url": "https://www.youtube.com/watch?v=example1",
-            "thumbnailUrl": "https://via.placeholder.com/320x180.png?text=Funcao+Exponencial"
-        },
-        {
-            "id": "2",
-            "title": "Equações do 2° Grau - Professor Ferretto",
-            "url": "https://www.youtube.com/watch?v=example2",
-            "thumbnailUrl": "https://via.placeholder.com/320x180.png?text=Equacoes+2+Grau"
-        },
-        {
-            "id": "3",
-            "title": "5 Dicas Incríveis para Redação ENEM 2024",
-            "url": "https://www.youtube.com/watch?v=example3",
-            "thumbnailUrl": "https://via.placeholder.com/320x180.png?text=Dicas+Redacao"
-        }
-    ]
-    
-    # Return 1-3 random recommendations
-    num_recommendations = random.randint(1, 3)
-    return random.sample(recommendations, num_recommendations)
+def youtube_recommendations_for(query: str, subject: Optional[str] = None) -> List[Dict]:
+    """Lesson videos matching the query, from the same BM25 index as the main server"""
+    if video_index is None:
+        return []
+    return video_index.search(query, subject, 3)
 
 def mock_exam_papers() -> List[Dict]:
     """Generate mock ENEM exam paper data"""
@@ -147,7 +134,7 @@ def upload_audio():
 @app.route('/api/youtube-recommendations', methods=['GET'])
 def youtube_recommendations():
     query = request.args.get('query', '')
-    recommendations = mock_youtube_recommendations(query)
+    recommendations = youtube_recommendations_for(query, request.args.get('subject') or None)
     return jsonify(recommendations)
 
 @app.route('/api/exam-papers', methods=['GET'])
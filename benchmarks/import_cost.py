@@ -0,0 +1,80 @@
+"""Startup benchmark: import cost of each library and of server.py itself.
+
+Every measurement runs in a fresh interpreter so nothing is cached between
+libraries. Run from the repository root:
+
+    python benchmarks/import_cost.py [--repeat 3] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from library_registry import LIBRARIES  # noqa: E402
+
+TIMER = """
+import time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+"""
+
+
+def time_statement(statement: str, repeat: int) -> dict:
+    """Run `statement` in `repeat` fresh interpreters and collect timings"""
+    samples = []
+    error = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-c', TIMER.format(statement=statement)],
+            cwd=ROOT, capture_output=True, text=True,
+            env={**os.environ, 'LAYZA_WARMUP_LIBRARIES': '0', 'LAYZA_CPU_PREWARM': '0'},
+        )
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'
+            break
+        samples.append(float(proc.stdout.strip().splitlines()[-1]) * 1000)
+
+    if not samples:
+        return {"error": error}
+    return {
+        "medianMs": round(statistics.median(samples), 2),
+        "minMs": round(min(samples), 2),
+        "maxMs": round(max(samples), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print machine readable output')
+    args = parser.parse_args()
+
+    results = {}
+    for name, library in LIBRARIES.items():
+        statement = f"import {library.module}"
+        if library.attribute:
+            statement = f"from {library.module} import {library.attribute}"
+        results[name] = time_statement(statement, args.repeat)
+
+    results['server.py'] = time_statement('import server', args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'library':<14} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<14} error: {result['error']}")
+        else:
+            print(f"{name:<14} {result['medianMs']:>10} {result['minMs']:>10} {result['maxMs']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""Load test: drive the backend at a target concurrency against a mock DeepSeek.
+
+Starts mock_deepseek.py in this process and server.py (or async_server.py)
+in a subprocess pointed at it, then keeps `--concurrency`
+clients busy with a weighted mix of routes for `--duration` seconds. Reports
+throughput, p50/p95/p99 latency and error rate per route. Run from the
+repository root:
+
+    python benchmarks/load_test.py --concurrency 32 --duration 20 \\
+        --latency lognormal:0.8,0.6 --error-rate 0.02 --save results/HEAD.json
+    python benchmarks/load_test.py --compare results/HEAD.json    # same options, new commit
+
+--target http://host:port skips the subprocess and loads an already running
+server (which must then be configured to use the mock upstream itself).
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_deepseek import Latency, MockDeepSeekServer  # noqa: E402
+
+DEFAULT_MIX = 'chat=6,chat-stream=2,exam-papers=2,upload-image=1,upload-audio=1'
+
+SUBJECTS = ('math', 'science', 'portuguese')
+QUESTIONS = (
+    "Como funciona a fotossíntese?",
+    "Me explica o que é uma função do segundo grau",
+    "Qual a diferença entre mitose e meiose?",
+    "Como identifico uma oração subordinada?",
+    "O que é a primeira lei de Newton?",
+    "Como faço uma boa conclusão na redação do ENEM?",
+)
+
+# 1x1 transparent PNG
+PNG_BYTES = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f9d0000000049454e44ae426082'
+)
+
+
+def _wav_bytes(seconds: float = 1.0, rate: int = 8000) -> bytes:
+    """Silent 8-bit mono WAV"""
+    frames = int(seconds * rate)
+    header = b'RIFF' + struct.pack('<I', 36 + frames) + b'WAVEfmt ' + struct.pack(
+        '<IHHIIHH', 16, 1, 1, rate, rate, 1, 8) + b'data' + struct.pack('<I', frames)
+    return header + b'\x80' * frames
+
+
+WAV_BYTES = _wav_bytes()
+
+
+def _chat(session: requests.Session, base: str, counter) -> bool:
+    # Unique questions, so every request really reaches the (mock) upstream
+    message = f"{random.choice(QUESTIONS)} ({next(counter)})"
+    response = session.post(f"{base}/api/chat", json={"message": message, "subject": random.choice(SUBJECTS)},
+                            timeout=60)
+    return response.status_code == 200 and not response.json().get("error")
+
+
+def _chat_stream(session: requests.Session, base: str, counter) -> bool:
+    message = f"{random.choice(QUESTIONS)} ({next(counter)})"
+    with session.post(f"{base}/api/chat/stream", json={"message": message, "subject": random.choice(SUBJECTS)},
+                      stream=True, timeout=60) as response:
+        if response.status_code != 200:
+            return False
+        body = b''.join(response.iter_content(chunk_size=None))
+    return b'event: done' in body
+
+
+# Last ETag seen per year, shared by the workers like a browser cache
+_EXAM_ETAGS: Dict[int, str] = {}
+
+
+def _exam_papers(session: requests.Session, base: str, counter) -> bool:
+    # Like a returning visitor: one year at a time, revalidated with the ETag it already has
+    year = 2024 - next(counter) % 8
+    etag = _EXAM_ETAGS.get(year)
+    response = session.get(f"{base}/api/exam-papers", params={"year": year},
+                           headers={"If-None-Match": etag} if etag else {}, timeout=60)
+    if response.status_code == 200 and 'ETag' in response.headers:
+        _EXAM_ETAGS[year] = response.headers['ETag']
+    return response.status_code in (200, 304)
+
+
+def _upload_image(session: requests.Session, base: str, counter) -> bool:
+    # One upload in four is a new photo (and OCR job); the rest are resubmissions
+    number = next(counter)
+    image = PNG_BYTES if number % 4 else PNG_BYTES + number.to_bytes(8, 'big')
+    response = session.post(f"{base}/api/upload-image",
+                            files={"image": ("questao.png", image, "image/png")}, timeout=60)
+    return response.status_code < 400 and not response.json().get("error")
+
+
+def _upload_audio(session: requests.Session, base: str, counter) -> bool:
+    response = session.post(f"{base}/api/upload-audio",
+                            files={"audio": ("pergunta.wav", WAV_BYTES, "audio/wav")}, timeout=60)
+    return response.status_code < 400 and not response.json().get("error")
+
+
+def _upload_audio_resumable(session: requests.Session, base: str, counter) -> bool:
+    # A new recording each time, sent in two chunks through an upload session
+    audio = WAV_BYTES + next(counter).to_bytes(8, 'big')
+    created = session.post(f"{base}/api/upload-audio/sessions", json={"size": len(audio)}, timeout=60)
+    if created.status_code != 201:
+        return False
+    url = f"{base}/api/upload-audio/sessions/{created.json()['uploadId']}"
+    half = len(audio) // 2
+    for offset, chunk in ((0, audio[:half]), (half, audio[half:])):
+        response = session.patch(url, data=chunk, headers={"Upload-Offset": str(offset)}, timeout=60)
+        if response.status_code >= 400:
+            return False
+    return not response.json().get("error")
+
+
+SCENARIOS = {
+    'chat': _chat,
+    'chat-stream': _chat_stream,
+    'exam-papers': _exam_papers,
+    'upload-image': _upload_image,
+    'upload-audio': _upload_audio,
+    'upload-audio-resumable': _upload_audio_resumable,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown route {name!r} (expected one of {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def fallback_count(session: requests.Session, base: str) -> Optional[float]:
+    """Answers served by fallback_response so far, from the server's /metrics"""
+    try:
+        text = session.get(f"{base}/metrics", timeout=10).text
+    except requests.RequestException:
+        return None
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('layza_responses_total{') and 'source="fallback"' in line)
+
+
+def run_load(base: str, mix: Dict[str, float], concurrency: int, duration: float, warmup: float) -> Dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    counter = itertools.count()
+    samples: Dict[str, List] = {name: [] for name in names}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            name = random.choices(names, weights)[0]
+            try:
+                ok = SCENARIOS[name](session, base, counter)
+            except (requests.RequestException, ValueError):
+                ok = False
+            finished = time.perf_counter()
+            if now >= measure_from:
+                local.append((name, finished - now, ok))
+        with lock:
+            for name, elapsed, ok in local:
+                samples[name].append((elapsed, ok))
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    session = requests.Session()
+    time.sleep(max(0.0, measure_from - time.perf_counter()))
+    fallbacks_before = fallback_count(session, base)
+    for thread in threads:
+        thread.join()
+    fallbacks_after = fallback_count(session, base)
+
+    results = {}
+    every = []
+    for name in names:
+        latencies = sorted(elapsed for elapsed, _ in samples[name])
+        errors = sum(1 for _, ok in samples[name] if not ok)
+        every.extend(samples[name])
+        results[name] = _summary(latencies, errors, duration)
+    results['total'] = _summary(sorted(elapsed for elapsed, _ in every),
+                                sum(1 for _, ok in every if not ok), duration)
+    # Fallback answers are HTTP 200s, so they don't show up as errors
+    chats = sum(results[name]["requests"] for name in ('chat', 'chat-stream') if name in results)
+    if fallbacks_before is not None and fallbacks_after is not None and chats:
+        results['total']["fallbackRate"] = round((fallbacks_after - fallbacks_before) / chats, 4)
+    return results
+
+
+def _summary(latencies: List[float], errors: int, duration: float) -> Dict:
+    count = len(latencies)
+    return {
+        "requests": count,
+        "throughput": round(count / duration, 2),
+        "p50Ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95Ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99Ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "errorRate": round(errors / count, 4) if count else 0.0,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, upstream_url: str, extra_env: Dict[str, str], log_path: str):
+    port = _free_port()
+    env = {
+        **os.environ,
+        'DEEPSEEK_API_URL': upstream_url,
+        'DEEPSEEK_API_KEY': 'mock',
+        'LAYZA_RATE_LIMIT_ENABLED': '0',
+        'LAYZA_LOG_LEVEL': 'WARNING',
+        'LAYZA_LOG_LEVELS': 'werkzeug=WARNING',
+        'LAYZA_EVENT_LOG_PATH': os.path.join(os.path.dirname(log_path), 'events.db'),
+        'LAYZA_UPLOAD_DIR': os.path.join(os.path.dirname(log_path), 'uploads'),
+        **extra_env,
+    }
+    if mode == 'async':
+        env['LAYZA_ASYNC_BIND'] = f'127.0.0.1:{port}'
+        command = [sys.executable, 'async_server.py']
+    else:
+        command = [sys.executable, '-c',
+                   f"import server; server.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(log_path, 'wb')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}, see {log_path}")
+        try:
+            if requests.get(f"{base}/api/exam-papers", timeout=1).status_code == 200:
+                return process, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server did not start within 60s, see {log_path}")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: Dict, baseline: Optional[Dict] = None) -> None:
+    print(f"{'route':<22} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    for name, result in results.items():
+        print(f"{name:<22} {result['requests']:>9} {result['throughput']:>8} {result['p50Ms']:>9} "
+              f"{result['p95Ms']:>9} {result['p99Ms']:>9} {result['errorRate'] * 100:>7.2f}%")
+        if baseline and name in baseline:
+            before = baseline[name]
+            deltas = []
+            for key in ('throughput', 'p50Ms', 'p95Ms', 'p99Ms'):
+                if before[key]:
+                    deltas.append(f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%")
+            deltas.append(f"errors {(result['errorRate'] - before['errorRate']) * 100:+.2f}pp")
+            print(f"{'':<22} vs baseline: {', '.join(deltas)}")
+    if 'fallbackRate' in results.get('total', {}):
+        print(f"chat answers from fallback_response: {results['total']['fallbackRate'] * 100:.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('flask', 'async'), default='flask')
+    parser.add_argument('--target', help='base URL of an already running server')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of load before measuring')
+    parser.add_argument('--latency', type=Latency, default=Latency('lognormal:0.5,0.5'),
+                        help='mock upstream latency (seconds or distribution, see mock_deepseek.py)')
+    parser.add_argument('--token-delay', type=Latency, default=Latency('0.01'))
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of failing upstream calls')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the server subprocess (repeatable)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results (and settings) to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier --save to compare against')
+    parser.add_argument('--json', action='store_true', help='print machine readable output')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    mock = MockDeepSeekServer(latency=args.latency, token_delay=args.token_delay,
+                              error_rate=args.error_rate, error_status=args.error_status).start()
+    process = None
+    workdir = tempfile.mkdtemp(prefix='layza-load-')
+    try:
+        if args.target:
+            base = args.target.rstrip('/')
+        else:
+            extra_env = dict(item.split('=', 1) for item in args.env)
+            process, base = start_server(args.mode, mock.url, extra_env, os.path.join(workdir, 'server.log'))
+        results = run_load(base, mix, args.concurrency, args.duration, args.warmup)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mock.stop()
+
+    report = {
+        "revision": git_revision(),
+        "settings": {
+            "mode": 'external' if args.target else args.mode,
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "latency": args.latency.spec,
+            "tokenDelay": args.token_delay.spec,
+            "errorRate": args.error_rate,
+            "env": args.env,
+        },
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        baseline = previous["results"]
+        if previous.get("settings") != report["settings"]:
+            print("warning: baseline was recorded with different settings")
+        print(f"baseline: {previous.get('revision')}  current: {report['revision']}")
+    print(f"{report['settings']['mode']} server, {args.concurrency} clients, {args.duration:.0f}s, "
+          f"upstream latency {args.latency.spec}, error rate {args.error_rate}")
+    print_table(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
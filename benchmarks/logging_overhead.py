@@ -0,0 +1,110 @@
+"""Logging overhead benchmark: /api/chat throughput under different log setups.
+
+Each configuration runs in a fresh interpreter that imports server.py and
+sends requests through the Flask test client from several threads. The test
+API key makes the server answer with the simulator, so the numbers are the
+request path plus logging, without network. Log output goes to a temporary
+file. "legacy" approximates the old setup (synchronous text lines at DEBUG
+with full message bodies). Run from the repository root:
+
+    python benchmarks/logging_overhead.py [--requests 2000] [--threads 8] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    "off": {"LAYZA_LOG_LEVEL": "CRITICAL"},
+    "legacy": {"LAYZA_LOG_ASYNC": "0", "LAYZA_LOG_FORMAT": "text", "LAYZA_LOG_LEVEL": "DEBUG",
+               "LAYZA_LOG_BODIES": "1"},
+    "sync-json": {"LAYZA_LOG_ASYNC": "0"},
+    "async-json": {},
+    "async-sampled": {"LAYZA_LOG_SAMPLE_RATE": "0.1"},
+}
+
+WORKLOAD = """
+import json, statistics, sys, threading, time
+import server
+
+client = server.app.test_client()
+requests, threads = int(sys.argv[1]), int(sys.argv[2])
+latencies = []
+lock = threading.Lock()
+
+def worker(count):
+    local = []
+    for i in range(count):
+        start = time.perf_counter()
+        client.post('/api/chat', json={"message": f"Explique a fotossíntese em detalhes, parte {i}", "subject": "biology"})
+        local.append(time.perf_counter() - start)
+    with lock:
+        latencies.extend(local)
+
+started = time.perf_counter()
+pool = [threading.Thread(target=worker, args=(requests // threads,)) for _ in range(threads)]
+for thread in pool:
+    thread.start()
+for thread in pool:
+    thread.join()
+elapsed = time.perf_counter() - started
+latencies.sort()
+print(json.dumps({
+    "requestsPerSecond": round(len(latencies) / elapsed, 1),
+    "p50Ms": round(latencies[len(latencies) // 2] * 1000, 3),
+    "p99Ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+}))
+"""
+
+
+def run_config(name: str, overrides: dict, requests: int, threads: int) -> dict:
+    with tempfile.NamedTemporaryFile(suffix='.log') as log_file:
+        env = {
+            **os.environ,
+            'DEEPSEEK_API_KEY': 'sua_chave_api_aqui',
+            'LAYZA_CPU_PREWARM': '0',
+            'LAYZA_RATE_LIMIT_ENABLED': '0',
+            'LAYZA_EVENT_LOG_ENABLED': '0',
+            'LAYZA_LOG_FILE': log_file.name,
+            **overrides,
+        }
+        proc = subprocess.run(
+            [sys.executable, '-c', WORKLOAD, str(requests), str(threads)],
+            cwd=ROOT, capture_output=True, text=True, env=env,
+        )
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result["logBytes"] = os.path.getsize(log_file.name)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--json', action='store_true', help='print machine readable output')
+    args = parser.parse_args()
+
+    results = {name: run_config(name, overrides, args.requests, args.threads)
+               for name, overrides in CONFIGS.items()}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'config':<14} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'log bytes':>11}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<14} error: {result['error']}")
+        else:
+            print(f"{name:<14} {result['requestsPerSecond']:>9} {result['p50Ms']:>9} "
+                  f"{result['p99Ms']:>9} {result['logBytes']:>11}")
+
+
+if __name__ == '__main__':
+    main()
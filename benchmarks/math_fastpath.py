@@ -0,0 +1,128 @@
+"""Hit-rate benchmark for the local SymPy math fast path.
+
+Runs every question in a corpus (default: benchmarks/math_questions.txt, one
+question per line, # for comments) through MathFastPath and reports how many
+were answered without DeepSeek and how long that took. A line can end in
+" | <text>" (the local answer must contain it) or " | -" (it must go to
+DeepSeek); the run exits with status 1 if any of those checks fails. Run from
+the repository root:
+
+    python benchmarks/math_fastpath.py [--corpus FILE] [--timeout 1.0] [--verbose] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cpu_pool import CpuPool  # noqa: E402
+from math_fastpath import MathFastPath, extract_math  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(ROOT, 'benchmarks', 'math_questions.txt')
+
+
+def load_corpus(path: str) -> list:
+    """(question, expected) pairs; expected is None (unchecked), '-' or a piece of the answer"""
+    with open(path, encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    corpus = []
+    for line in lines:
+        question, separator, expected = line.partition(' | ')
+        corpus.append((question.strip(), expected.strip() if separator else None))
+    return corpus
+
+
+def check(answer, expected) -> bool:
+    if expected is None:
+        return True
+    if expected == '-':
+        return answer is None
+    return answer is not None and expected in answer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--timeout', type=float, default=1.0, help='SymPy timeout per question (seconds)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--verbose', action='store_true', help='print every question and its answer')
+    parser.add_argument('--json', action='store_true', help='print machine readable output')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    questions = [question for question, _ in corpus]
+    pool = CpuPool(workers=args.workers, preload=['sympy'])
+    pool.warm_up()
+    fast_path = MathFastPath(pool, timeout=args.timeout)
+    # Wait for the workers to finish importing SymPy before timing anything
+    while pool.stats()["idle"] < args.workers:
+        time.sleep(0.05)
+
+    hit_ms = []
+    rows = []
+    try:
+        for question, expected in corpus:
+            started = time.perf_counter()
+            answer = fast_path.answer(question)
+            elapsed = (time.perf_counter() - started) * 1000
+            if answer is not None:
+                hit_ms.append(elapsed)
+            rows.append({"question": question, "extracted": extract_math(question), "answer": answer,
+                         "expected": expected, "ok": check(answer, expected), "ms": round(elapsed, 2)})
+    finally:
+        pool.close()
+
+    stats = fast_path.stats()
+    results = {
+        "questions": len(questions),
+        "hits": stats["hits"],
+        "hitRate": stats["hitRate"],
+        "noMath": stats["noMath"],
+        "unsolved": stats["unsolved"],
+        "timeouts": stats["timeouts"],
+        "checked": sum(1 for row in rows if row["expected"] is not None),
+        # Answered with the wrong value, or answered when it should have gone to DeepSeek
+        "wrong": sum(1 for row in rows if not row["ok"] and row["answer"] is not None),
+        # Should have been answered locally but went to DeepSeek
+        "missed": sum(1 for row in rows if not row["ok"] and row["answer"] is None),
+        "failures": [row["question"] for row in rows if not row["ok"]],
+        "hitLatencyMs": {
+            "p50": round(statistics.median(hit_ms), 2) if hit_ms else None,
+            "p95": round(sorted(hit_ms)[int(len(hit_ms) * 0.95)], 2) if hit_ms else None,
+            "max": round(max(hit_ms), 2) if hit_ms else None,
+        },
+    }
+    if args.verbose:
+        results["rows"] = rows
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        sys.exit(1 if results["failures"] else 0)
+
+    if args.verbose:
+        for row in rows:
+            status = ('HIT ' if row["answer"] else 'MISS') if row["ok"] else 'FAIL'
+            print(f"{status} {row['ms']:>8.1f}ms  {row['question']}")
+            if row["answer"]:
+                print(f"       {row['answer']}")
+        print()
+
+    print(f"questions   {results['questions']}")
+    print(f"hits        {results['hits']} ({results['hitRate']:.0%})")
+    print(f"no math     {results['noMath']}")
+    print(f"unsolved    {results['unsolved']}")
+    print(f"timeouts    {results['timeouts']}")
+    print(f"checked     {results['checked']}  wrong {results['wrong']}  missed {results['missed']}")
+    latency = results["hitLatencyMs"]
+    print(f"hit latency p50 {latency['p50']}ms  p95 {latency['p95']}ms  max {latency['max']}ms")
+    for question in results["failures"]:
+        print(f"FAIL {question}")
+    sys.exit(1 if results["failures"] else 0)
+
+
+if __name__ == '__main__':
+    main()
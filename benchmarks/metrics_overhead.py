@@ -0,0 +1,77 @@
+"""Recording cost of the /metrics counters and histograms, in nanoseconds per call.
+
+Also times a full /metrics render with a few hundred label combinations.
+Run from the repository root:
+
+    python benchmarks/metrics_overhead.py [--calls 500000] [--threads 4]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import Registry, span  # noqa: E402
+
+
+def per_call_ns(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def threaded_ns(fn, calls: int, threads: int) -> float:
+    """Wall time per call with `threads` threads recording at once"""
+    def worker():
+        for _ in range(calls // threads):
+            fn()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = registry.counter('bench_total', 'Benchmark counter', ('source', 'subject'))
+    histogram = registry.histogram('bench_seconds', 'Benchmark histogram', ('route', 'method', 'status'))
+
+    baseline = per_call_ns(lambda: None, args.calls)
+    cases = {
+        "counter.inc": lambda: counter.inc('fallback', 'math'),
+        "histogram.observe": lambda: histogram.observe(0.042, '/api/chat', 'POST', '200'),
+    }
+    print(f"{'operation':<26} {'ns/call':>9} {'threaded ns/call':>17}")
+    for name, fn in cases.items():
+        single = per_call_ns(fn, args.calls) - baseline
+        threaded = threaded_ns(fn, args.calls, args.threads) - baseline
+        print(f"{name:<26} {single:>9.0f} {threaded:>17.0f}")
+
+    def timed_span():
+        with span('bench'):
+            pass
+    print(f"{'span (context manager)':<26} {per_call_ns(timed_span, args.calls // 10) - baseline:>9.0f}")
+    print(f"{'empty call (subtracted)':<26} {baseline:>9.0f}")
+
+    for route in range(50):
+        for status in ('200', '400', '429', '500'):
+            histogram.observe(0.1, f'/route/{route}', 'GET', status)
+    started = time.perf_counter()
+    text = registry.render()
+    print(f"render: {len(text.splitlines())} lines in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
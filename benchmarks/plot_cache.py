@@ -0,0 +1,66 @@
+"""Latency of /api/plot renders: first draw, other spellings and cache hits.
+
+Plots a handful of ENEM-style functions (quadratics, exponentials, trig)
+through FunctionPlotter on a real CPU pool, then asks for each again as typed
+and with a different spelling of the same function, and reports the time of
+each kind of request. Run from the repository root:
+
+    python benchmarks/plot_cache.py [--repeat 200] [--format png]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cpu_pool import CpuPool  # noqa: E402
+from function_plot import FunctionPlotter  # noqa: E402
+
+# (as typed, another spelling of the same function)
+FUNCTIONS = [
+    ("x^2 - 5x + 6", "6 - 5*x + x**2"),
+    ("-x² + 4x", "4x - x^2"),
+    ("2^x", "2**x"),
+    ("(1/2)^x", "(1/2)**x"),
+    ("3·2^x", "3*2^x"),
+    ("sen(x)", "sin(x)"),
+    ("raiz(x)", "sqrt(x)"),
+    ("1/x", "x^(-1)"),
+]
+
+
+def timed_ms(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='cached requests per function')
+    parser.add_argument('--format', choices=('png', 'svg'), default='png')
+    args = parser.parse_args()
+
+    pool = CpuPool(workers=2, preload=('sympy', 'numpy', 'matplotlib'))
+    pool.warm_up()
+    plotter = FunctionPlotter(pool)
+    try:
+        first = [timed_ms(lambda: plotter.plot(typed, fmt=args.format)) for typed, _ in FUNCTIONS]
+        respelled = [timed_ms(lambda: plotter.plot(other, fmt=args.format)) for _, other in FUNCTIONS]
+        cached = [timed_ms(lambda: plotter.plot(typed, fmt=args.format))
+                  for typed, _ in FUNCTIONS for _ in range(args.repeat)]
+        print(f"{'request':<28} {'median ms':>10} {'max ms':>9}")
+        for name, timings in (("first render", first), ("same function, respelled", respelled),
+                              ("cached", cached)):
+            print(f"{name:<28} {statistics.median(timings):>10.3f} {max(timings):>9.3f}")
+        stats = plotter.stats()
+        print(f"\nhit rate {stats['hitRate']:.1%}, {stats['cachedImages']} images, {stats['cachedBytes']} bytes cached")
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
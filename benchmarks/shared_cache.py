@@ -0,0 +1,99 @@
+"""Response cache hit rate with N worker processes, with and without the shared tier.
+
+Each worker process gets a random share of a skewed stream of repeated
+questions (as behind a load balancer) and its own ResponseCache; with
+--shared they also read and write one memory-mapped table. Also reports the
+cost of the mmap store's operations in microseconds. Run from the repository
+root:
+
+    python benchmarks/shared_cache.py [--workers 4] [--requests 20000] [--questions 2000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from response_cache import ResponseCache  # noqa: E402
+from shared_cache import MmapCacheStore  # noqa: E402
+
+ANSWER = '{"response": "' + 'Resposta de exemplo. ' * 40 + '"}'
+
+
+def question_stream(requests: int, questions: int, seed: int):
+    """Zipf-like popularity: a few questions are asked far more often than the rest"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(questions)]
+    return rng.choices(range(questions), weights=weights, k=requests)
+
+
+def worker(path, stream, results) -> None:
+    shared = MmapCacheStore(path) if path else None
+    cache = ResponseCache(max_entries=512, shared=shared)
+    for question in stream:
+        key = f"question-{question}"
+        if cache.get(key) is None:
+            cache.set(key, ANSWER)
+    stats = cache.stats()
+    results.put((stats["hits"], stats["misses"]))
+
+
+def hit_rate(workers: int, stream, path) -> float:
+    results = multiprocessing.Queue()
+    shares = [stream[index::workers] for index in range(workers)]
+    processes = [multiprocessing.Process(target=worker, args=(path, share, results)) for share in shares]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    hits = sum(h for h, _ in counts)
+    return hits / max(1, hits + sum(m for _, m in counts))
+
+
+def per_op_us(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for index in range(calls):
+        fn(index)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--calls', type=int, default=50000)
+    args = parser.parse_args()
+
+    stream = question_stream(args.requests, args.questions, seed=7)
+    with tempfile.TemporaryDirectory() as directory:
+        single = hit_rate(1, stream, None)
+        per_worker = hit_rate(args.workers, stream, None)
+        shared = hit_rate(args.workers, stream, os.path.join(directory, 'bench-responses'))
+        print(f"{'setup':<34} {'hit rate':>9}")
+        print(f"{'1 worker':<34} {single:>9.1%}")
+        print(f"{f'{args.workers} workers, per-process caches':<34} {per_worker:>9.1%}")
+        print(f"{f'{args.workers} workers, shared mmap tier':<34} {shared:>9.1%}")
+
+        store = MmapCacheStore(os.path.join(directory, 'bench-ops'))
+        expires_at = time.time() + 3600
+        keys = [f"key-{index}" for index in range(1000)]
+        cases = {
+            "set": lambda i: store.set(keys[i % 1000], ANSWER, expires_at),
+            "get (hit)": lambda i: store.get(keys[i % 1000]),
+            "get (miss)": lambda i: store.get(f"absent-{i}"),
+            "update (rate-limit bucket)": lambda i: store.update(keys[i % 1000], lambda _: ("9.5,0", expires_at)),
+        }
+        print(f"\n{'mmap operation':<34} {'us/op':>9}")
+        for name, fn in cases.items():
+            print(f"{name:<34} {per_op_us(fn, args.calls):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
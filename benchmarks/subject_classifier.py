@@ -0,0 +1,78 @@
+"""Accuracy and latency of the local subject classifier.
+
+Classifies every labelled question in a file (default:
+benchmarks/subject_questions.txt, "subject<TAB>question" per line, # for
+comments, "none" for messages that should get no subject) and reports
+accuracy among confident guesses, how many were left unclassified and the
+time per classification. Run from the repository root:
+
+    python benchmarks/subject_classifier.py [--questions FILE] [--min-confidence 0.6] [--verbose]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from subject_classifier import DEFAULT_CORPUS_PATH, SubjectClassifier  # noqa: E402
+
+DEFAULT_QUESTIONS = os.path.join(ROOT, 'benchmarks', 'subject_questions.txt')
+
+
+def load_questions(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        rows = [line.rstrip('\n').split('\t', 1) for line in f if line.strip() and not line.startswith('#')]
+    return [(subject, question) for subject, question in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', default=DEFAULT_QUESTIONS)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH)
+    parser.add_argument('--min-confidence', type=float, default=0.6)
+    parser.add_argument('--repeat', type=int, default=200, help='timed passes over the questions')
+    parser.add_argument('--verbose', action='store_true', help='print every question and its guess')
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        classifier = SubjectClassifier(json.load(f), min_confidence=args.min_confidence)
+    started = time.perf_counter()
+    classifier.train()
+    print(f"training    {(time.perf_counter() - started) * 1000:.1f} ms (includes importing NumPy)")
+
+    questions = load_questions(args.questions)
+    correct = wrong = unsure = 0
+    for expected, question in questions:
+        guess = classifier.classify(question)
+        predicted = guess["subject"] or 'none'
+        if predicted == expected:
+            correct += 1
+        elif guess["subject"] is None:
+            unsure += 1
+        else:
+            wrong += 1
+        if args.verbose:
+            mark = 'ok ' if predicted == expected else 'BAD'
+            print(f"{mark} {expected:<10} -> {predicted:<10} {guess['confidence']:.2f}  {question}")
+
+    timings = []
+    for _ in range(args.repeat):
+        for _, question in questions:
+            started = time.perf_counter()
+            classifier.classify(question)
+            timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+
+    print(f"questions   {len(questions)}")
+    print(f"correct     {correct} ({correct / len(questions):.0%})")
+    print(f"wrong       {wrong}")
+    print(f"unsure      {unsure} (left on the generic prompt)")
+    print(f"latency p50 {statistics.median(timings):.0f}us  p99 {timings[int(len(timings) * 0.99)]:.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Throughput of /api/text-analysis, in essays per second, by batching mode.
+
+Builds synthetic essays (paragraphs of sentences drawn from
+data/subject_corpus.json) and analyzes them through TextAnalyzer on a real
+CPU pool: one pool call per essay, one call per batch (nlp.pipe) and a batch
+split across all the workers (parallel=True). Run from the repository root:
+
+    python benchmarks/text_analysis.py [--essays 400] [--batch 50] [--workers 2]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cpu_pool import CpuPool  # noqa: E402
+from text_analysis import TextAnalyzer  # noqa: E402
+
+CORPUS_PATH = os.path.join(ROOT, 'data', 'subject_corpus.json')
+
+
+def synthetic_essays(count: int, rng: random.Random) -> list:
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        sentences = [sentence for examples in json.load(f).values() for sentence in examples]
+    # About 30 lines, as in an ENEM essay: 4-5 paragraphs of 5-8 sentences
+    return ['\n\n'.join(' '.join(rng.choices(sentences, k=rng.randint(5, 8)))
+                        for _ in range(rng.randint(4, 5)))
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--essays', type=int, default=400)
+    parser.add_argument('--batch', type=int, default=50, help='essays per request')
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    essays = synthetic_essays(args.essays, random.Random(7))
+    batches = [essays[start:start + args.batch] for start in range(0, len(essays), args.batch)]
+    pool = CpuPool(workers=args.workers, preload=('spacy',))
+    pool.warm_up()
+    analyzer = TextAnalyzer(pool, timeout=60.0)
+    try:
+        analyzer.analyze(essays[:args.workers], parallel=True)  # builds the pipeline in every worker
+        modes = (
+            ("one call per essay", lambda: [analyzer.analyze([essay]) for essay in essays]),
+            ("one call per batch", lambda: [analyzer.analyze(batch) for batch in batches]),
+            ("batch over all workers", lambda: [analyzer.analyze(batch, parallel=True) for batch in batches]),
+        )
+        print(f"{len(essays)} essays, {sum(map(len, essays)) // len(essays)} characters on average, "
+              f"batches of {args.batch}, {args.workers} workers\n")
+        print(f"{'mode':<24} {'seconds':>8} {'essays/s':>9}")
+        for name, run in modes:
+            started = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - started
+            print(f"{name:<24} {seconds:>8.2f} {len(essays) / seconds:>9.0f}")
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Build time, size, load time and lookup latency of the video index at scale.
+
+Grows the bundled catalog (data/videos.json) into --videos synthetic entries
+(the real titles and tags plus words from a large Zipf-distributed
+vocabulary, so common and rare terms both exist), builds the index file in a
+temporary directory and times searches with and without a subject filter.
+Run from the repository root:
+
+    python benchmarks/video_search.py [--videos 200000] [--queries 2000]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from video_index import DEFAULT_CATALOG_PATH, SUBJECTS, VideoIndex, build_index  # noqa: E402
+
+
+def synthetic_catalog(videos: list, count: int, vocabulary: int, rng: random.Random) -> list:
+    words = [f"termo{index}" for index in range(vocabulary)]
+    # Cumulative, so each draw is a bisect rather than a pass over the vocabulary
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    catalog = []
+    for number in range(count):
+        base = videos[number % len(videos)]
+        extra = rng.choices(words, cum_weights=cum_weights, k=6)
+        catalog.append({**base, "id": f"s{number:07d}", "title": f"{base['title']} {' '.join(extra[:2])}",
+                        "tags": base["tags"] + extra[2:]})
+    return catalog
+
+
+def percentile(values: list, fraction: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--videos', type=int, default=200000)
+    parser.add_argument('--vocabulary', type=int, default=50000, help='synthetic words mixed into the titles')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    with open(DEFAULT_CATALOG_PATH, encoding='utf-8') as f:
+        videos = json.load(f)
+    catalog = synthetic_catalog(videos, args.videos, args.vocabulary, rng)
+    queries = [' '.join(rng.sample(video["title"].split(), 2)) for video in rng.choices(videos, k=args.queries)]
+    queries += [f"{rng.choice(videos)['tags'][0]} termo{rng.randrange(args.vocabulary)}" for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'video-index.bin')
+        started = time.perf_counter()
+        build_index(catalog, path)
+        build_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        index = VideoIndex(path)
+        load_ms = (time.perf_counter() - started) * 1000
+        print(f"videos      {index.doc_count}  terms {index.term_count}  postings {index.posting_count}")
+        print(f"build       {build_seconds:.1f} s  size {os.path.getsize(path) / 1e6:.1f} MB  load {load_ms:.2f} ms")
+
+        for label, subject in (("no filter", None), ("by subject", 'cycle')):
+            timings = []
+            for number, query in enumerate(queries):
+                started = time.perf_counter()
+                index.search(query, SUBJECTS[number % 3] if subject else None, args.limit)
+                timings.append((time.perf_counter() - started) * 1e6)
+            print(f"{label:<11} p50 {statistics.median(timings):.0f}us  p95 {percentile(timings, 0.95):.0f}us  "
+                  f"p99 {percentile(timings, 0.99):.0f}us  max {max(timings):.0f}us")
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Local chemistry answers for /api/chem: formulas, molar masses, balanced reactions.
+
+Formulas are parsed with ChemPy and reactions balanced with its
+balance_stoichiometry, in the cpu_pool.py workers (ChemPy imports SymPy, and
+a strange reaction must not pin a server thread). Results are memoized in
+the server process, keyed by the canonical (Hill) formula: "CH3COOH" and
+"C2H4O2" share one entry, and each spelling seen before maps straight to it,
+so a repeated formula costs a dictionary lookup. A whole batch of formulas
+costs at most one pool call, for the ones never seen before.
+
+The common ENEM compounds in data/chem_compounds.json are described in the
+background at startup, so they are answered from memory from the first
+request, and can also be asked for by name ("água", "ácido sulfúrico").
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from cpu_pool import CpuPool
+from library_registry import get_library
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPOUNDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'chem_compounds.json')
+MAX_FORMULA_LENGTH = 64
+MAX_REACTION_SPECIES = 12
+
+_SUBSCRIPTS = str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')
+_SUPERSCRIPTS = str.maketrans('⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻', '0123456789+-')
+_FORMULA_RE = re.compile(r'[A-Za-z0-9()\[\].+\-]+')
+_ARROW_RE = re.compile(r'\s*(?:->|→|⟶|=)\s*')
+# " + " between species; a "+" glued to a formula is a charge (Na+)
+_PLUS_RE = re.compile(r'\s+\+\s+')
+_COEFFICIENT_RE = re.compile(r'^\d+\s*(?=[A-Z(\[])')
+
+
+class ChemError(ValueError):
+    """A formula or reaction that can't be parsed or balanced (the message is shown to the student)"""
+
+
+def _fold(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def normalize_formula(text: str) -> str:
+    """ChemPy syntax for a formula as students type it ("SO₄²⁻", "Fe^3+", "CuSO4·5H2O")"""
+    formula = (text or '').strip().translate(_SUBSCRIPTS)
+    # Superscript charges come after the formula: SO₄²⁻ -> SO4-2
+    formula = re.sub(r'([⁰¹²³⁴⁵⁶⁷⁸⁹]*)([⁺⁻])$',
+                     lambda m: m.group(2).translate(_SUPERSCRIPTS) + m.group(1).translate(_SUPERSCRIPTS), formula)
+    formula = re.sub(r'\^(\d*)([+-])$', r'\2\1', formula)
+    # Hydrates: ChemPy writes CuSO4..5H2O
+    formula = re.sub(r'\s*[·*.]+\s*(?=\d*[A-Z(])', '..', formula)
+    if not formula or len(formula) > MAX_FORMULA_LENGTH or not _FORMULA_RE.fullmatch(formula):
+        raise ChemError(f"Fórmula inválida: {text}")
+    return formula
+
+
+def parse_equation(equation: str) -> Tuple[List[str], List[str]]:
+    """Reactant and product formulas of "2 H2 + O2 -> 2 H2O" (coefficients are dropped)"""
+    sides = _ARROW_RE.split((equation or '').strip())
+    if len(sides) != 2:
+        raise ChemError("Use uma seta entre reagentes e produtos, como em H2 + O2 -> H2O")
+    reactants, products = ([normalize_formula(_COEFFICIENT_RE.sub('', species.strip()))
+                            for species in _PLUS_RE.split(side) if species.strip()] for side in sides)
+    if not reactants or not products or len(reactants) + len(products) > MAX_REACTION_SPECIES:
+        raise ChemError("Reação inválida")
+    return reactants, products
+
+
+# --- Runs inside the CPU pool workers ---------------------------------------
+
+def _hill(composition: Dict[int, float], symbols) -> Tuple[str, Dict[str, float]]:
+    """Hill formula (C, H, then alphabetical; all alphabetical without carbon) with
+    the charge, and the element counts in that order"""
+    counts = {symbols[number - 1]: _count(count) for number, count in composition.items() if number}
+    first = ['C', 'H'] if 'C' in counts else []
+    counts = {symbol: counts[symbol] for symbol in [symbol for symbol in first if symbol in counts]
+              + sorted(set(counts) - set(first))}
+    formula = ''.join(f"{symbol}{count if count != 1 else ''}" for symbol, count in counts.items())
+    charge = _count(composition.get(0, 0))
+    if charge:
+        formula += f"{'+' if charge > 0 else '-'}{abs(charge) if abs(charge) != 1 else ''}"
+    return formula, counts
+
+
+def _count(value: float):
+    return int(value) if float(value).is_integer() else value
+
+
+def describe_formulas(formulas: List[str]) -> List[Dict]:
+    """Composition, molar mass and charge of each normalized formula ({"error"} for bad ones)"""
+    get_library('chempy')
+    from chempy import Substance
+    from chempy.util.periodic import symbols
+
+    described = []
+    for formula in formulas:
+        try:
+            substance = Substance.from_formula(formula)
+            composition = {number: count for number, count in substance.composition.items() if count}
+            if not any(composition.get(number) for number in composition if number):
+                raise ValueError("no elements")
+            canonical, counts = _hill(composition, symbols)
+            described.append({
+                "canonical": canonical,
+                "display": substance.unicode_name,
+                "composition": counts,
+                "molarMass": round(float(substance.mass), 4),
+                "charge": _count(composition.get(0, 0)),
+            })
+        except Exception as e:
+            described.append({"error": f"Fórmula inválida: {formula}", "detail": type(e).__name__})
+    return described
+
+
+def balance_reaction(reactants: List[str], products: List[str]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Smallest whole coefficients of each species"""
+    get_library('chempy')
+    from chempy import balance_stoichiometry
+
+    try:
+        balanced_reactants, balanced_products = balance_stoichiometry(set(reactants), set(products))
+    except Exception as e:
+        raise ChemError(f"Não consegui balancear essa reação ({type(e).__name__})") from None
+    coefficients = [*balanced_reactants.values(), *balanced_products.values()]
+    if not all(getattr(value, 'is_Integer', isinstance(value, int)) for value in coefficients):
+        raise ChemError("Essa reação tem mais de um balanceamento possível")
+    return ({species: int(balanced_reactants[species]) for species in reactants},
+            {species: int(balanced_products[species]) for species in products})
+
+
+# ---------------------------------------------------------------------------
+
+class ChemToolkit:
+    """Memoized formula descriptions and balanced reactions, computed on the CPU pool"""
+
+    def __init__(self, pool: CpuPool, compounds: List[Dict], timeout: float = 5.0, max_entries: int = 10000):
+        self.pool = pool
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.compounds = [dict(compound) for compound in compounds]
+        self._names = {_fold(compound["name"]): compound["formula"] for compound in self.compounds}
+        self._table_names = {normalize_formula(compound["formula"]): compound["name"] for compound in self.compounds}
+        # spelling -> (canonical or None, display or error, description); the
+        # descriptions are shared by canonical formula while it is in `_described`
+        self._aliases: 'OrderedDict[str, Tuple[Optional[str], str, Optional[Dict]]]' = OrderedDict()
+        self._described: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._reactions: 'OrderedDict[Tuple, Tuple[Dict, Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"formulaHits": 0, "formulaMisses": 0, "reactionHits": 0, "reactionMisses": 0,
+                          "poolCalls": 0}
+        self._pool_seconds = 0.0
+
+    def warm_up(self) -> threading.Thread:
+        """Describe the compound table in a daemon thread"""
+        def describe_table():
+            try:
+                # The worker imports ChemPy (and SymPy) here, so allow more than a request would
+                self.describe([compound["formula"] for compound in self.compounds], timeout=max(self.timeout, 30.0))
+                logger.info(f"Chemistry table ready: {len(self.compounds)} compounds")
+            except Exception as e:
+                logger.warning(f"Could not describe the chemistry table: {e}")
+        thread = threading.Thread(target=describe_table, name='chem-table', daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self, fn, *args, timeout: Optional[float] = None):
+        started = time.perf_counter()
+        try:
+            return self.pool.run(fn, *args, timeout=timeout or self.timeout)
+        finally:
+            with self._lock:
+                self._counters["poolCalls"] += 1
+                self._pool_seconds += time.perf_counter() - started
+
+    def describe(self, texts: List[str], timeout: Optional[float] = None) -> List[Dict]:
+        """One description per input formula or compound name, in order.
+
+        Raises CpuTaskError only when the pool fails; bad formulas get
+        {"formula", "error"} entries instead.
+        """
+        spellings: List[Optional[str]] = []
+        for text in texts:
+            try:
+                spellings.append(normalize_formula(self._names.get(_fold(text or ''), text)))
+            except ChemError:
+                spellings.append(None)
+        with self._lock:
+            missing = list(dict.fromkeys(spelling for spelling in spellings
+                                         if spelling is not None and spelling not in self._aliases))
+            self._counters["formulaMisses"] += len(missing)
+            self._counters["formulaHits"] += sum(spelling is not None for spelling in spellings) - len(missing)
+        if missing:
+            for spelling, description in zip(missing, self._run(describe_formulas, missing, timeout=timeout)):
+                with self._lock:
+                    if "error" in description:
+                        self._aliases[spelling] = (None, description["error"], None)
+                    else:
+                        canonical, display = description.pop("canonical"), description.pop("display")
+                        description = self._described.setdefault(canonical, description)
+                        self._aliases[spelling] = (canonical, display, description)
+                    while len(self._aliases) > self.max_entries:
+                        self._aliases.popitem(last=False)
+                    while len(self._described) > self.max_entries:
+                        self._described.popitem(last=False)
+        results = []
+        with self._lock:
+            for text, spelling in zip(texts, spellings):
+                canonical, display, description = self._aliases.get(spelling, (None, f"Fórmula inválida: {text}", None))
+                if canonical is None:
+                    results.append({"formula": text, "error": True, "message": display})
+                    continue
+                result = {"formula": text, "canonical": canonical, "display": display, **description}
+                name = self._table_names.get(spelling)
+                if name is not None:
+                    result["name"] = name
+                results.append(result)
+        return results
+
+    def balance(self, equation: str, given: Optional[Dict[str, float]] = None) -> Dict:
+        """Balanced `equation`, with the mass and moles of every species when `given`
+        ({formula: grams}, one entry) is set. Raises ChemError for bad input."""
+        reactants, products = parse_equation(equation)
+        if given:
+            given_formula, given_grams = self._given(given, reactants + products)
+        key = (tuple(sorted(reactants)), tuple(sorted(products)))
+        with self._lock:
+            balanced = self._reactions.get(key)
+            if balanced is not None:
+                self._reactions.move_to_end(key)
+            self._counters["reactionHits" if balanced is not None else "reactionMisses"] += 1
+        if balanced is None:
+            balanced = self._run(balance_reaction, reactants, products)
+            with self._lock:
+                self._reactions[key] = balanced
+                while len(self._reactions) > self.max_entries:
+                    self._reactions.popitem(last=False)
+        reactant_coefficients, product_coefficients = balanced
+
+        def side(coefficients: Dict[str, int]) -> str:
+            return ' + '.join(f"{n} {species}" if n != 1 else species for species, n in coefficients.items())
+        result = {
+            "equation": f"{side(reactant_coefficients)} → {side(product_coefficients)}",
+            "reactants": reactant_coefficients,
+            "products": product_coefficients,
+        }
+        if given:
+            result["amounts"] = self._amounts({**reactant_coefficients, **product_coefficients},
+                                              given_formula, given_grams)
+        return result
+
+    @staticmethod
+    def _given(given: Dict[str, float], species: List[str]) -> Tuple[str, float]:
+        """(formula as in the reaction, grams) of a {formula: grams} input"""
+        if len(given) != 1:
+            raise ChemError("Informe a massa de uma única substância")
+        (formula, grams), = given.items()
+        try:
+            spelling, grams = normalize_formula(formula), float(grams)
+        except (TypeError, ValueError):
+            raise ChemError("Massa inválida") from None
+        if not grams > 0:
+            raise ChemError("Massa inválida")
+        if spelling not in species:
+            raise ChemError(f"{formula} não está na reação")
+        return spelling, grams
+
+    def _amounts(self, coefficients: Dict[str, int], spelling: str, grams: float) -> Dict[str, Dict]:
+        species = list(coefficients)
+        masses = {formula: description["molarMass"] for formula, description in zip(species, self.describe(species))}
+        moles = grams / masses[spelling] / coefficients[spelling]
+        return {formula: {"mol": round(moles * coefficient, 6), "g": round(moles * coefficient * masses[formula], 4)}
+                for formula, coefficient in coefficients.items()}
+
+    def table(self) -> List[Dict]:
+        """The compound table with each compound's description"""
+        return self.describe([compound["formula"] for compound in self.compounds])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["avgPoolMs"] = round(self._pool_seconds / stats["poolCalls"] * 1000, 3) if stats["poolCalls"] else 0.0
+            stats["formulas"] = len(self._described)
+            stats["spellings"] = len(self._aliases)
+            stats["reactions"] = len(self._reactions)
+        stats["tableCompounds"] = len(self.compounds)
+        return stats
+
+
+def chem_toolkit_from_env(pool: CpuPool, warm_up: bool = True) -> Optional[ChemToolkit]:
+    """Toolkit over the LAYZA_CHEM_COMPOUNDS_PATH table, described in the background
+    if `warm_up` (None when LAYZA_CHEM_ENABLED=0; an empty table if the file can't be read)"""
+    if os.environ.get('LAYZA_CHEM_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    path = os.environ.get('LAYZA_CHEM_COMPOUNDS_PATH', DEFAULT_COMPOUNDS_PATH)
+    try:
+        with open(path, encoding='utf-8') as f:
+            compounds = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not load the compound table from {path}: {e}")
+        compounds = []
+    toolkit = ChemToolkit(
+        pool,
+        compounds,
+        timeout=float(os.environ.get('LAYZA_CHEM_TIMEOUT', 5.0)),
+        max_entries=int(os.environ.get('LAYZA_CHEM_CACHE_SIZE', 10000)),
+    )
+    if compounds and warm_up:
+        toolkit.warm_up()
+    return toolkit
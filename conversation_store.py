@@ -0,0 +1,216 @@
+"""Server-side conversation memory keyed by the frontend's conversationId.
+
+Each conversation keeps its latest turns in a small ring buffer (UTF-8 bytes,
+so emoji-heavy answers don't make Python widen the whole string to 4 bytes a
+character). Turns pushed out of the ring are folded into a short extractive
+summary. build_messages() then fills a token budget newest-first: the summary
+rides along with the system prompt, recent turns are added while they fit
+and the first one that doesn't is truncated.
+
+Memory stays bounded by the number of conversations (LRU), a total byte
+budget and an idle TTL, so 100k active conversations cost a predictable
+amount of RAM.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Per-message framing overhead the chat API adds (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Rough bytes held besides the text itself: the conversation object, its
+# deque and dict slot, and each turn's tuple and bytes header
+CONVERSATION_OVERHEAD_BYTES = 1000
+TURN_OVERHEAD_BYTES = 100
+
+_ROLES = ('user', 'assistant')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for Portuguese text)"""
+    return (len(text) + 3) // 4
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - 1)].rstrip() + '…'
+
+
+def _first_sentence(text: str, max_chars: int = 160, min_chars: int = 40) -> str:
+    # Skip past greetings like "Oi! 😊" to the first sentence with content
+    sentence = ''
+    for part in _SENTENCE_END.split(' '.join(text.split())):
+        sentence = f"{sentence} {part}".strip()
+        if len(sentence) >= min_chars:
+            break
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars - 1].rstrip() + '…'
+    return sentence
+
+
+class _Conversation:
+    __slots__ = ('turns', 'summary', 'updated_at', 'size')
+
+    def __init__(self, max_turns: int):
+        # (0 = user / 1 = assistant, UTF-8 text)
+        self.turns: Deque[Tuple[int, bytes]] = deque(maxlen=max_turns)
+        self.summary: List[bytes] = []
+        self.updated_at = time.monotonic()
+        self.size = CONVERSATION_OVERHEAD_BYTES
+
+
+class ConversationStore:
+    """Bounded in-memory store of recent turns per conversation"""
+
+    def __init__(self, max_conversations: int = 100000, max_turns: int = 12,
+                 ttl: float = 6 * 3600, max_bytes: int = 256 * 1024 * 1024,
+                 max_turn_chars: int = 4000, summary_chars: int = 800):
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_turn_chars = max_turn_chars
+        self.summary_chars = summary_chars
+        self._conversations: 'OrderedDict[str, _Conversation]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"turns": 0, "summarized": 0, "evictions": 0, "expirations": 0}
+
+    def _get(self, conversation_id: str) -> Optional[_Conversation]:
+        # Caller holds self._lock
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return None
+        if time.monotonic() - conversation.updated_at > self.ttl:
+            self._drop(conversation_id)
+            self._counters["expirations"] += 1
+            return None
+        return conversation
+
+    def _drop(self, conversation_id: str) -> None:
+        # Caller holds self._lock
+        conversation = self._conversations.pop(conversation_id)
+        self._bytes -= conversation.size
+
+    def _fold_into_summary(self, conversation: _Conversation, role: int, text: bytes) -> None:
+        # Caller holds self._lock; `text` just fell out of the ring buffer
+        label = 'Aluno' if role == 0 else 'Layza'
+        line = f"{label}: {_first_sentence(text.decode('utf-8'))}".encode('utf-8')
+        conversation.summary.append(line)
+        conversation.size += len(line)
+        while sum(len(item) for item in conversation.summary) > self.summary_chars and len(conversation.summary) > 1:
+            conversation.size -= len(conversation.summary.pop(0))
+        self._counters["summarized"] += 1
+
+    def append(self, conversation_id: str, role: str, text: str) -> None:
+        """Record one turn ("user" or "assistant")"""
+        data = text[:self.max_turn_chars].encode('utf-8')
+        code = _ROLES.index(role)
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if conversation is None:
+                conversation = _Conversation(self.max_turns)
+                self._conversations[conversation_id] = conversation
+                self._bytes += conversation.size
+            else:
+                self._conversations.move_to_end(conversation_id)
+
+            before = conversation.size
+            if len(conversation.turns) == conversation.turns.maxlen:
+                old_role, old_text = conversation.turns[0]
+                conversation.size -= len(old_text) + TURN_OVERHEAD_BYTES
+                self._fold_into_summary(conversation, old_role, old_text)
+            conversation.turns.append((code, data))
+            conversation.size += len(data) + TURN_OVERHEAD_BYTES
+            conversation.updated_at = time.monotonic()
+            self._bytes += conversation.size - before
+            self._counters["turns"] += 1
+
+            while self._conversations and (len(self._conversations) > self.max_conversations
+                                           or self._bytes > self.max_bytes):
+                oldest = next(iter(self._conversations))
+                if oldest == conversation_id and len(self._conversations) == 1:
+                    break
+                self._drop(oldest)
+                self._counters["evictions"] += 1
+
+    def add_exchange(self, conversation_id: str, message: str, answer: str) -> None:
+        """Record a question and the answer it got"""
+        self.append(conversation_id, 'user', message)
+        self.append(conversation_id, 'assistant', answer)
+
+    def history(self, conversation_id: str) -> Tuple[str, List[Dict]]:
+        """(summary, turns as chat messages), oldest turn first"""
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if conversation is None:
+                return '', []
+            summary = '\n'.join(line.decode('utf-8') for line in conversation.summary)
+            turns = [{"role": _ROLES[code], "content": text.decode('utf-8')}
+                     for code, text in conversation.turns]
+        return summary, turns
+
+    def build_messages(self, conversation_id: Optional[str], system_prompt: str,
+                       message: str, budget: int) -> List[Dict]:
+        """Chat messages for the next call, fitting `budget` estimated tokens"""
+        summary, turns = self.history(conversation_id) if conversation_id else ('', [])
+        if summary:
+            system_prompt += f"\n\nResumo do início da conversa:\n{summary}"
+
+        remaining = budget - estimate_tokens(system_prompt) - MESSAGE_OVERHEAD_TOKENS * 2
+        # The new question always goes in, cut down if it alone exceeds the budget
+        message = _truncate(message, max(remaining, 64))
+        remaining -= estimate_tokens(message)
+
+        kept: List[Dict] = []
+        for turn in reversed(turns):
+            cost = estimate_tokens(turn["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if cost <= remaining:
+                kept.append(turn)
+                remaining -= cost
+                continue
+            # Keep the start of the newest turn that doesn't fit, then stop
+            if remaining - MESSAGE_OVERHEAD_TOKENS >= 32:
+                kept.append({"role": turn["role"],
+                             "content": _truncate(turn["content"], remaining - MESSAGE_OVERHEAD_TOKENS)})
+            break
+        kept.reverse()
+        # The API expects the history to start with a user turn
+        while kept and kept[0]["role"] != 'user':
+            kept.pop(0)
+
+        return [{"role": "system", "content": system_prompt}, *kept, {"role": "user", "content": message}]
+
+    def forget(self, conversation_id: str) -> bool:
+        with self._lock:
+            if conversation_id not in self._conversations:
+                return False
+            self._drop(conversation_id)
+            return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["conversations"] = len(self._conversations)
+            stats["bytes"] = self._bytes
+        stats["maxConversations"] = self.max_conversations
+        stats["maxBytes"] = self.max_bytes
+        stats["maxTurns"] = self.max_turns
+        return stats
+
+
+def conversation_store_from_env() -> Optional[ConversationStore]:
+    """Build the conversation store from LAYZA_CONVERSATION_* variables (None when disabled)"""
+    if os.environ.get('LAYZA_CONVERSATION_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return ConversationStore(
+        max_conversations=int(os.environ.get('LAYZA_CONVERSATION_MAX', 100000)),
+        max_turns=int(os.environ.get('LAYZA_CONVERSATION_MAX_TURNS', 12)),
+        ttl=float(os.environ.get('LAYZA_CONVERSATION_TTL', 6 * 3600)),
+        max_bytes=int(os.environ.get('LAYZA_CONVERSATION_MAX_BYTES', 256 * 1024 * 1024)),
+    )
@@ -0,0 +1,299 @@
+"""Shared process pool for CPU-heavy library work (SymPy, SciPy, spaCy...).
+
+Running a solver on a request thread holds the GIL and the thread for as
+long as the solver likes. Tasks sent here run in separate worker processes
+that have the configured libraries imported already:
+
+    cpu_pool.run(solve_hint, 'equation', 'x**2 - 4 = 0', timeout=1.0)
+    future = cpu_pool.submit(check_library, 'scipy')
+    result = await cpu_pool.run_async(check_library, 'spacy')
+
+Every task has a wall-clock timeout; a worker that overruns it is killed and
+a fresh one is started in the background. Results bigger than
+`max_result_bytes` (pickled) are refused in the worker, before they are sent.
+Task functions and their arguments must be picklable (module-level functions).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from library_registry import get_library
+
+logger = logging.getLogger(__name__)
+
+
+class CpuTaskError(Exception):
+    """A task could not be completed by the pool"""
+
+
+class TaskTimeout(CpuTaskError):
+    """The task ran past its timeout; its worker was replaced"""
+
+
+class ResultTooLarge(CpuTaskError):
+    """The pickled result was bigger than max_result_bytes"""
+
+
+class WorkerCrashed(CpuTaskError):
+    """The worker process died while running the task"""
+
+
+class PoolBusy(CpuTaskError):
+    """No worker became free within queue_timeout"""
+
+
+def _worker_main(conn, preload: Sequence[str], max_result_bytes: int) -> None:
+    """Worker process loop: import the libraries, then run tasks until the pipe closes"""
+    # Ctrl+C on the server is handled by the parent, which kills the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in preload:
+        try:
+            get_library(name)
+        except Exception:
+            pass  # Already logged by the registry; tasks will see the error
+    conn.send_bytes(pickle.dumps(('ready', os.getpid())))
+
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            return
+        fn, args = pickle.loads(data)
+        try:
+            payload = pickle.dumps(('ok', fn(*args)), pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            try:
+                payload = pickle.dumps(('error', e), pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                payload = pickle.dumps(('error', CpuTaskError(f"{type(e).__name__}: {e}")))
+        if len(payload) > max_result_bytes:
+            payload = pickle.dumps(('too_large', len(payload)))
+        conn.send_bytes(payload)
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'pid')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.pid = process.pid
+
+
+class CpuPool:
+    """Pre-warmed worker processes with per-task timeouts and result size limits"""
+
+    def __init__(self, workers: int = 2, preload: Sequence[str] = ('sympy',),
+                 default_timeout: float = 10.0, queue_timeout: float = 10.0,
+                 max_result_bytes: int = 1_000_000, startup_timeout: float = 60.0,
+                 start_method: Optional[str] = None):
+        self.workers = workers
+        self.preload = tuple(preload)
+        self.default_timeout = default_timeout
+        self.queue_timeout = queue_timeout
+        self.max_result_bytes = max_result_bytes
+        self.startup_timeout = startup_timeout
+        self._context = multiprocessing.get_context(start_method)
+        self._idle: 'queue.Queue[_Worker]' = queue.Queue()
+        self._all: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self._unavailable: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "tooLarge": 0,
+            "crashed": 0,
+            "busy": 0,
+            "replaced": 0,
+        }
+        self._task_seconds = 0.0
+
+    def _count(self, name: str, seconds: float = 0.0) -> None:
+        with self._lock:
+            self._counters[name] += 1
+            self._task_seconds += seconds
+
+    def warm_up(self) -> None:
+        """Start the workers now (in the background) instead of on the first task"""
+        with self._lock:
+            if self._started or self._closed:
+                return
+            self._started = True
+        if multiprocessing.current_process().daemon:
+            # e.g. the worker processes of the hypercorn CLI: daemonic
+            # processes may not have children
+            self._unavailable = "CPU pool unavailable in a daemonic process"
+            logger.error(f"{self._unavailable}; run the server with `python async_server.py` to use it")
+            return
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _spawn(self) -> None:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.preload, self.max_result_bytes),
+            name='layza-cpu-worker',
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        with self._lock:
+            self._all.append(worker)
+        # Importing the preloaded libraries takes a while; the worker only
+        # becomes available once it says it is ready
+        threading.Thread(target=self._wait_ready, args=(worker,),
+                         name='layza-cpu-worker-start', daemon=True).start()
+
+    def _wait_ready(self, worker: _Worker) -> None:
+        try:
+            if worker.conn.poll(self.startup_timeout):
+                status, _ = pickle.loads(worker.conn.recv_bytes())
+                if status == 'ready':
+                    logger.info(f"CPU worker {worker.pid} ready")
+                    self._idle.put(worker)
+                    return
+        except (EOFError, OSError):
+            pass
+        if self._closed:
+            return
+        logger.error(f"CPU worker {worker.pid} failed to start, replacing it")
+        time.sleep(1)  # Don't spin if every new worker crashes on import
+        self._replace(worker)
+
+    def _kill(self, worker: _Worker) -> None:
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+        worker.process.kill()
+        worker.process.join(1)
+        worker.conn.close()
+
+    def _replace(self, worker: _Worker) -> None:
+        self._kill(worker)
+        if self._closed:
+            return
+        self._count("replaced")
+        self._spawn()
+
+    def run(self, fn: Callable, *args: Any, timeout: Optional[float] = None,
+            queue_timeout: Optional[float] = None) -> Any:
+        """Run fn(*args) in a worker and return its result.
+
+        Raises TaskTimeout, ResultTooLarge, WorkerCrashed or PoolBusy (no
+        worker free within `queue_timeout`, the pool's own by default), or the
+        exception raised by fn itself.
+        """
+        if self._closed:
+            raise CpuTaskError("CPU pool is closed")
+        self.warm_up()
+        if self._unavailable:
+            raise CpuTaskError(self._unavailable)
+        data = pickle.dumps((fn, args), pickle.HIGHEST_PROTOCOL)
+        timeout = self.default_timeout if timeout is None else timeout
+        queue_timeout = self.queue_timeout if queue_timeout is None else queue_timeout
+        self._count("submitted")
+
+        try:
+            worker = self._idle.get(timeout=queue_timeout)
+        except queue.Empty:
+            self._count("busy")
+            raise PoolBusy(f"No CPU worker free after {queue_timeout}s")
+
+        started = time.perf_counter()
+        try:
+            worker.conn.send_bytes(data)
+            if not worker.conn.poll(timeout):
+                logger.warning(f"CPU task {getattr(fn, '__name__', fn)} timed out after {timeout}s, "
+                               f"killing worker {worker.pid}")
+                self._replace(worker)
+                self._count("timeouts", time.perf_counter() - started)
+                raise TaskTimeout(f"Task timed out after {timeout}s")
+            status, value = pickle.loads(worker.conn.recv_bytes())
+        except (EOFError, OSError) as e:
+            logger.error(f"CPU worker {worker.pid} died: {e}")
+            self._replace(worker)
+            self._count("crashed", time.perf_counter() - started)
+            raise WorkerCrashed(f"CPU worker {worker.pid} died while running the task")
+
+        self._idle.put(worker)
+        elapsed = time.perf_counter() - started
+        if status == 'ok':
+            self._count("completed", elapsed)
+            return value
+        if status == 'too_large':
+            self._count("tooLarge", elapsed)
+            raise ResultTooLarge(f"Result of {value} bytes exceeds {self.max_result_bytes}")
+        self._count("failed", elapsed)
+        raise value
+
+    def submit(self, fn: Callable, *args: Any, timeout: Optional[float] = None,
+               queue_timeout: Optional[float] = None) -> Future:
+        """Like run, but returns a concurrent.futures.Future right away"""
+        with self._lock:
+            if self._executor is None:
+                # Threads only wait on worker pipes, so a few per worker is plenty
+                self._executor = ThreadPoolExecutor(max_workers=max(4, self.workers * 4),
+                                                    thread_name_prefix='layza-cpu-wait')
+            executor = self._executor
+        return executor.submit(self.run, fn, *args, timeout=timeout, queue_timeout=queue_timeout)
+
+    async def run_async(self, fn: Callable, *args: Any, timeout: Optional[float] = None,
+                        queue_timeout: Optional[float] = None) -> Any:
+        """asyncio version of run"""
+        return await asyncio.wrap_future(self.submit(fn, *args, timeout=timeout, queue_timeout=queue_timeout))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            finished = sum(stats[name] for name in ("completed", "failed", "timeouts", "tooLarge", "crashed"))
+            stats["avgTaskMs"] = round(self._task_seconds / finished * 1000, 3) if finished else 0.0
+            stats["workers"] = len(self._all)
+        stats["idle"] = self._idle.qsize()
+        stats["preload"] = list(self.preload)
+        stats["defaultTimeoutSeconds"] = self.default_timeout
+        stats["maxResultBytes"] = self.max_result_bytes
+        return stats
+
+    def close(self) -> None:
+        """Kill every worker; further tasks raise CpuTaskError"""
+        with self._lock:
+            self._closed = True
+            workers = list(self._all)
+            executor, self._executor = self._executor, None
+        for worker in workers:
+            self._kill(worker)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def cpu_pool_from_env() -> CpuPool:
+    """Build the shared CPU pool from LAYZA_CPU_* variables"""
+    preload = os.environ.get('LAYZA_CPU_PRELOAD', 'sympy')
+    return CpuPool(
+        workers=int(os.environ.get('LAYZA_CPU_WORKERS', 2)),
+        preload=[name.strip() for name in preload.split(',') if name.strip()],
+        default_timeout=float(os.environ.get('LAYZA_CPU_TASK_TIMEOUT', 10)),
+        queue_timeout=float(os.environ.get('LAYZA_CPU_QUEUE_TIMEOUT', 10)),
+        max_result_bytes=int(os.environ.get('LAYZA_CPU_MAX_RESULT_BYTES', 1_000_000)),
+        start_method=os.environ.get('LAYZA_CPU_START_METHOD') or None,
+    )
+
+
+def prewarm_from_env() -> bool:
+    """LAYZA_CPU_PREWARM (default on): start the workers when the server starts"""
+    return os.environ.get('LAYZA_CPU_PREWARM', '1').lower() not in ('0', 'false', 'no', 'off')
@@ -0,0 +1,43 @@
+"""Module-level task functions for the CPU pool (they must be picklable)."""
+from typing import Any
+
+from library_registry import get_library
+
+
+def check_library(name: str) -> Any:
+    """Run a tiny real computation with one library, as /api/libraries-check reports it"""
+    if name == 'sympy':
+        sympy = get_library('sympy')
+        x = sympy.Symbol('x')
+        return str(sympy.solve(x**2 - 4, x))
+    if name == 'numpy':
+        numpy = get_library('numpy')
+        return numpy.array([1, 2, 3]).tolist()
+    if name == 'matplotlib':
+        get_library('matplotlib')
+        from matplotlib.figure import Figure
+        Figure()
+        return 'OK'
+    if name == 'scipy':
+        get_library('scipy')
+        from scipy import integrate
+        return integrate.quad(lambda x: x**2, 0, 1)[0]
+    if name == 'biopython':
+        get_library('biopython')
+        from Bio.Seq import Seq
+        return str(Seq('ATGC').complement())
+    if name == 'chempy':
+        get_library('chempy')
+        from chempy import Substance
+        return Substance.from_formula('H2O').unicode_name
+    if name == 'spacy':
+        # The worker's text analysis pipeline, built once and reused
+        from text_analysis import pipeline
+        return [token.text for token in pipeline()('Olá mundo!')]
+    if name == 'nltk':
+        nltk = get_library('nltk')
+        return nltk.word_tokenize('Olá, tudo bem?')
+    if name == 'textblob_pt':
+        TextBlobPT = get_library('textblob_pt')
+        return str(TextBlobPT('Gosto muito de estudar matemática.').sentiment)
+    raise ValueError(f"Unknown library: {name}")
@@ -0,0 +1,217 @@
+"""Append-only event log for chat turns, feedback and upstream calls.
+
+Events go into an in-memory queue and a single writer thread stores them in
+SQLite (WAL mode, synchronous=NORMAL) in batches, so a request never waits
+on disk or fsync. If the queue is full the event is dropped and counted
+rather than slowing the request down. Aggregations (ratings per subject and
+time window, upstream outcomes) run as SQL over the same file.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    conversation_id TEXT,
+    subject TEXT,
+    rating INTEGER,
+    latency_ms REAL,
+    outcome TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+CREATE INDEX IF NOT EXISTS events_conversation ON events (conversation_id, kind, id);
+"""
+
+_COLUMNS = ('ts', 'kind', 'conversation_id', 'subject', 'rating', 'latency_ms', 'outcome', 'data')
+
+_STOP = object()
+
+
+class EventLog:
+    """Write-behind SQLite event store"""
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.5,
+                 max_queue: int = 100000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._counters = {"recorded": 0, "written": 0, "dropped": 0, "batches": 0, "writeErrors": 0}
+        self._writer = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode NORMAL only syncs at checkpoints: a crash can lose the
+        # last batches but never corrupts the file
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def record(self, kind: str, conversation_id: Optional[str] = None, subject: Optional[str] = None,
+               rating: Optional[int] = None, latency_ms: Optional[float] = None,
+               outcome: Optional[str] = None, **data) -> None:
+        """Queue an event; never blocks"""
+        # A value sqlite3 can't bind would fail the whole batch, other users' events included
+        if not isinstance(conversation_id, str):
+            conversation_id = None
+        if not isinstance(subject, str):
+            subject = None
+        row = (time.time(), kind, conversation_id or None, subject or None, rating,
+               round(latency_ms, 3) if latency_ms is not None else None, outcome,
+               json.dumps(data, ensure_ascii=False) if data else None)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count("dropped")
+            return
+        self._count("recorded")
+
+    def _run(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            item = first
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(conn, batch)
+        conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO events ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    batch,
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write {len(batch)} events: {e}")
+            self._count("writeErrors")
+            self._count("dropped", len(batch))
+            return
+        self._count("written", len(batch))
+        self._count("batches")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write whatever is still queued and stop the writer"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join(timeout)
+
+    def rating_summary(self, since: Optional[float] = None, until: Optional[float] = None,
+                       window: Optional[float] = None) -> List[Dict]:
+        """Feedback count and average rating per subject (and per time window, in seconds).
+
+        Feedback that doesn't name a subject takes the subject of the latest
+        chat turn in the same conversation.
+        """
+        bucket = f"CAST(f.ts / {float(window)} AS INTEGER) * {float(window)}" if window else "NULL"
+        sql = f"""
+            SELECT COALESCE(f.subject, (
+                       SELECT c.subject FROM events c
+                       WHERE c.kind = 'chat' AND c.conversation_id = f.conversation_id
+                       ORDER BY c.id DESC LIMIT 1
+                   ), 'unknown') AS subject,
+                   {bucket} AS window_start,
+                   COUNT(*), AVG(f.rating), MIN(f.rating), MAX(f.rating)
+            FROM events f
+            WHERE f.kind = 'feedback' AND f.ts >= ? AND f.ts < ?
+            GROUP BY 1, 2
+            ORDER BY 2, 1
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, (since or 0, until or time.time() + 1)).fetchall()
+        return [
+            {
+                "subject": subject,
+                "windowStart": window_start,
+                "count": count,
+                "avgRating": round(avg, 3) if avg is not None else None,
+                "minRating": low,
+                "maxRating": high,
+            }
+            for subject, window_start, count, avg, low, high in rows
+        ]
+
+    def upstream_summary(self, since: Optional[float] = None, until: Optional[float] = None) -> List[Dict]:
+        """Upstream call count and latency per outcome"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                """
+                SELECT outcome, COUNT(*), AVG(latency_ms), MAX(latency_ms)
+                FROM events
+                WHERE kind = 'upstream' AND ts >= ? AND ts < ?
+                GROUP BY outcome ORDER BY outcome
+                """,
+                (since or 0, until or time.time() + 1),
+            ).fetchall()
+        return [
+            {
+                "outcome": outcome,
+                "count": count,
+                "avgLatencyMs": round(avg, 3) if avg is not None else None,
+                "maxLatencyMs": high,
+            }
+            for outcome, count, avg, high in rows
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        stats["path"] = self.path
+        return stats
+
+
+def event_log_from_env() -> Optional[EventLog]:
+    """Build the event log from LAYZA_EVENT_LOG_* variables (None when disabled)"""
+    if os.environ.get('LAYZA_EVENT_LOG_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    path = os.environ.get('LAYZA_EVENT_LOG_PATH', os.path.join('var', 'events.db'))
+    try:
+        return EventLog(
+            path,
+            batch_size=int(os.environ.get('LAYZA_EVENT_LOG_BATCH', 256)),
+            flush_interval=float(os.environ.get('LAYZA_EVENT_LOG_FLUSH_INTERVAL', 0.5)),
+            max_queue=int(os.environ.get('LAYZA_EVENT_LOG_MAX_QUEUE', 100000)),
+        )
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Event log disabled, could not open {path}: {e}")
+        return None
@@ -0,0 +1,193 @@
+"""ENEM exam-paper catalog served by /api/exam-papers.
+
+Papers are read once from a JSON file (data/exam_papers.json) and indexed
+by year, day, color and subject, so a filter is a set intersection instead of
+a scan. Every response body is serialized and gzipped once and kept with its
+strong ETag: the full list, the facets and each year are built at load time,
+other filter/page combinations on first use (bounded LRU). The catalog never
+changes while the process runs, so cached bodies never go stale.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COLOR_ORDER = ('azul', 'amarelo', 'rosa', 'branco', 'cinza', 'verde')
+REQUIRED_FIELDS = ('id', 'year', 'day', 'color', 'subjects')
+
+
+class CatalogBody(NamedTuple):
+    """A serialized response: identity and gzip bodies with their ETags"""
+    body: bytes
+    gzipped: bytes
+    etag: str
+    gzip_etag: str
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """True when an If-None-Match header already names this body"""
+        return etag_matches(if_none_match, self.etag, self.gzip_etag)
+
+
+def etag_matches(if_none_match: Optional[str], *etags: str) -> bool:
+    """True when an If-None-Match header names one of `etags`"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison: W/ prefixes are ignored
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return any(etag in tags for etag in etags)
+
+
+def _serialize(data) -> CatalogBody:
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    # mtime=0 keeps the gzip bytes (and so the ETag) identical across restarts
+    return CatalogBody(body, gzip.compress(body, 6, mtime=0), f'"{digest}"', f'"{digest}-gz"')
+
+
+class ExamCatalog:
+    """Immutable, indexed list of exam papers with cached serialized responses"""
+
+    def __init__(self, papers: Iterable[Dict], max_cached_bodies: int = 1024):
+        papers = [dict(paper) for paper in papers]
+        for paper in papers:
+            missing = [field for field in REQUIRED_FIELDS if field not in paper]
+            if missing:
+                raise ValueError(f"Exam paper {paper.get('id')!r} is missing {', '.join(missing)}")
+        papers.sort(key=lambda p: (-p['year'], p['day'],
+                                   COLOR_ORDER.index(p['color']) if p['color'] in COLOR_ORDER else len(COLOR_ORDER),
+                                   p['id']))
+        self._papers: Tuple[Dict, ...] = tuple(papers)
+        self._all: FrozenSet[int] = frozenset(range(len(papers)))
+        self._by_year = self._index(lambda p: [p['year']])
+        self._by_day = self._index(lambda p: [p['day']])
+        self._by_color = self._index(lambda p: [p['color']])
+        self._by_subject = self._index(lambda p: p['subjects'])
+
+        self.max_cached_bodies = max_cached_bodies
+        self._bodies: 'OrderedDict[Tuple, CatalogBody]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+        self.facets_body = _serialize(self.facets())
+        # Built eagerly: the unfiltered list and one year at a time are what the page asks for
+        self._prebuilt: Dict[Tuple, CatalogBody] = {self._key(): _serialize(list(self._papers))}
+        for year in self._by_year:
+            key = self._key(year=year)
+            self._prebuilt[key] = _serialize(self._select(year=year))
+
+    def _index(self, values) -> Dict:
+        index: Dict = {}
+        for position, paper in enumerate(self._papers):
+            for value in values(paper):
+                index.setdefault(value, set()).add(position)
+        return {value: frozenset(positions) for value, positions in index.items()}
+
+    @staticmethod
+    def _key(year: Optional[int] = None, day: Optional[int] = None, subject: Optional[str] = None,
+             color: Optional[str] = None, page: Optional[int] = None, per_page: Optional[int] = None) -> Tuple:
+        return (year, day, subject, color, page, per_page)
+
+    def __len__(self) -> int:
+        return len(self._papers)
+
+    def _select(self, year: Optional[int] = None, day: Optional[int] = None,
+                subject: Optional[str] = None, color: Optional[str] = None) -> List[Dict]:
+        positions = self._all
+        for index, value in ((self._by_year, year), (self._by_day, day),
+                             (self._by_subject, subject), (self._by_color, color)):
+            if value is not None:
+                positions = positions & index.get(value, frozenset())
+                if not positions:
+                    return []
+        return [self._papers[position] for position in sorted(positions)]
+
+    def facets(self) -> Dict:
+        """Available filter values with the number of papers for each"""
+        def counts(index: Dict, reverse: bool = False) -> List[Dict]:
+            return [{"value": value, "count": len(index[value])}
+                    for value in sorted(index, reverse=reverse)]
+        return {
+            "total": len(self._papers),
+            "years": counts(self._by_year, reverse=True),
+            "days": counts(self._by_day),
+            "subjects": counts(self._by_subject),
+            "colors": [{"value": value, "count": len(self._by_color[value])}
+                       for value in sorted(self._by_color,
+                                           key=lambda c: COLOR_ORDER.index(c) if c in COLOR_ORDER else len(COLOR_ORDER))],
+        }
+
+    def query(self, year: Optional[int] = None, day: Optional[int] = None, subject: Optional[str] = None,
+              color: Optional[str] = None, page: Optional[int] = None, per_page: Optional[int] = None) -> CatalogBody:
+        """Serialized papers matching every given filter.
+
+        Without `page` the body is the plain list the frontend has always
+        received; with it, {"papers", "total", "page", "perPage", "pages"}.
+        """
+        key = self._key(year, day, subject, color, page, per_page)
+        prebuilt = self._prebuilt.get(key)
+        if prebuilt is not None:
+            self._count("hits")
+            return prebuilt
+        with self._lock:
+            cached = self._bodies.get(key)
+            if cached is not None:
+                self._bodies.move_to_end(key)
+                self._counters["hits"] += 1
+                return cached
+
+        papers = self._select(year, day, subject, color)
+        if page is None:
+            data = papers
+        else:
+            per_page = per_page or 20
+            start = (page - 1) * per_page
+            data = {
+                "papers": papers[start:start + per_page],
+                "total": len(papers),
+                "page": page,
+                "perPage": per_page,
+                "pages": (len(papers) + per_page - 1) // per_page,
+            }
+        body = _serialize(data)
+        with self._lock:
+            self._counters["misses"] += 1
+            self._bodies[key] = body
+            while len(self._bodies) > self.max_cached_bodies:
+                self._bodies.popitem(last=False)
+        return body
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["cachedBodies"] = len(self._bodies)
+        stats["papers"] = len(self._papers)
+        stats["prebuiltBodies"] = len(self._prebuilt)
+        return stats
+
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'exam_papers.json')
+
+
+def exam_catalog_from_env() -> ExamCatalog:
+    """Load the catalog from LAYZA_EXAM_CATALOG_PATH (an empty catalog if it can't be read)"""
+    path = os.environ.get('LAYZA_EXAM_CATALOG_PATH', DEFAULT_CATALOG_PATH)
+    try:
+        with open(path, encoding='utf-8') as f:
+            papers = json.load(f)
+        catalog = ExamCatalog(papers, max_cached_bodies=int(os.environ.get('LAYZA_EXAM_CATALOG_CACHE', 1024)))
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not load the exam catalog from {path}: {e}")
+        return ExamCatalog([])
+    logger.info(f"Exam catalog loaded: {len(catalog)} papers from {path}")
+    return catalog
@@ -0,0 +1,303 @@
+"""Function graphs for /api/plot, rendered on the CPU pool and cached.
+
+An expression typed by a student ("x^2 - 5x + 6", "2^x", "sen(x)") is
+checked against a small vocabulary here (x, numbers, operators and a few
+functions, with the Portuguese names), so nothing else ever reaches SymPy's
+parser. The rest runs in the cpu_pool.py workers: SymPy parses the text into
+its canonical form, lambdify compiles it once per worker into a NumPy
+function, which is evaluated over the whole grid in one call, and a
+Matplotlib Figure (Agg canvas, no pyplot) is saved as PNG or SVG.
+
+Rendered images are cached by a hash of the canonical expression, range and
+format, so "x^2+2x" and "2*x + x**2" share one entry, and carry that hash as
+a strong ETag. The spellings seen before are remembered too, so a repeated
+plot of a popular function (ENEM quadratics and exponentials) is served
+without calling the pool at all.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from cpu_pool import CpuPool, CpuTaskError, TaskTimeout
+from exam_catalog import etag_matches
+from library_registry import get_library
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MAX_EXPRESSION_LENGTH = 120
+DEFAULT_RANGE = (-10.0, 10.0)
+# Widest x range accepted; beyond it every curve is a vertical line anyway
+MAX_SPAN = 1e6
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+GRID_POINTS = 1001
+
+# Applied in order to the lowercased expression
+_REPLACEMENTS: List[Tuple[str, str]] = [
+    (r'^\s*(?:y|f\s*\(\s*x\s*\))\s*=', ''),             # "y = ...", "f(x) = ..."
+    (r'(\d),(\d)', r'\1.\2'),                           # 2,5 -> 2.5
+    (r'[−–]', '-'),
+    (r'[×·]', '*'),
+    (r'÷', '/'),
+    (r'²', '^2'),
+    (r'³', '^3'),
+    (r'√', 'sqrt'),
+    (r'\*\*', '^'),
+]
+_TOKEN_RE = re.compile(r'\d+(?:\.\d+)?|\.\d+|[a-z]+|[-+*/^()]|\s+|.')
+# Every name the parser may see, with the Portuguese spellings
+_NAMES = frozenset({'x', 'pi', 'e', 'sin', 'sen', 'cos', 'tan', 'tg', 'exp', 'log', 'ln',
+                    'sqrt', 'raiz', 'abs'})
+
+
+class PlotError(ValueError):
+    """The expression or range can't be plotted (bad input, not a server failure)"""
+
+
+def normalize_expression(expression: str) -> str:
+    """The expression with one space between tokens, after checking every token is allowed"""
+    text = (expression or '').strip().lower()
+    for pattern, replacement in _REPLACEMENTS:
+        text = re.sub(pattern, replacement, text)
+    tokens = [token for token in _TOKEN_RE.findall(text) if not token.isspace()]
+    if not tokens:
+        raise PlotError("Empty expression")
+    for previous, token in zip([None] + tokens, tokens):
+        if token[0].isalpha() and token not in _NAMES:
+            raise PlotError(f"Unknown name: {token}")
+        if not (token[0].isalnum() or token[0] == '.' or token in '+-*/^()'):
+            raise PlotError(f"Unexpected character: {token}")
+        # "5x 6" (a "+" lost in a query string) or "x2": the parser would
+        # multiply them, so ask for the operator instead
+        if (token[0].isdigit() or token[0] == '.') and previous is not None and \
+                (previous[0].isalnum() or previous[0] == '.' or previous == ')'):
+            raise PlotError(f"Missing operator before {token}")
+    normalized = ' '.join(tokens)
+    if len(normalized) > MAX_EXPRESSION_LENGTH:
+        raise PlotError("Expression too long")
+    return normalized
+
+
+# --- Runs inside the CPU pool workers ---------------------------------------
+
+# Canonical expression -> (SymPy expression, NumPy function), per worker
+_compiled: 'OrderedDict[str, Tuple]' = OrderedDict()
+_COMPILED_MAX = 256
+
+
+def _parse(text: str):
+    sympy = get_library('sympy')
+    from sympy.parsing.sympy_parser import (convert_xor, implicit_multiplication_application,
+                                            parse_expr, standard_transformations)
+
+    x = sympy.Symbol('x', real=True)
+    names = {'x': x, 'pi': sympy.pi, 'e': sympy.E, 'sin': sympy.sin, 'sen': sympy.sin,
+             'cos': sympy.cos, 'tan': sympy.tan, 'tg': sympy.tan, 'exp': sympy.exp, 'log': sympy.log,
+             'ln': sympy.log, 'sqrt': sympy.sqrt, 'raiz': sympy.sqrt, 'abs': sympy.Abs}
+    transformations = standard_transformations + (implicit_multiplication_application, convert_xor)
+    try:
+        expr = parse_expr(text, local_dict=names, transformations=transformations)
+    except Exception as e:
+        raise PlotError(f"Could not parse {text!r}: {type(e).__name__}") from None
+    if not isinstance(expr, sympy.Expr) or expr.free_symbols - {x}:
+        raise PlotError(f"Not a function of x: {text!r}")
+    return x, expr
+
+
+def canonical_plot(text: str) -> Tuple[str, str]:
+    """(canonical form, label) of a normalized expression"""
+    sympy = get_library('sympy')
+    _, expr = _parse(text)
+    label = sympy.sstr(expr, order='lex').replace('**', '^').replace('*', '·')
+    return sympy.srepr(expr), label
+
+
+def _function(canonical: str) -> Callable:
+    entry = _compiled.get(canonical)
+    if entry is None:
+        sympy = get_library('sympy')
+        expr = sympy.sympify(canonical)
+        x = sympy.Symbol('x', real=True)
+        entry = _compiled[canonical] = (expr, sympy.lambdify(x, expr, 'numpy'))
+        while len(_compiled) > _COMPILED_MAX:
+            _compiled.popitem(last=False)
+    else:
+        _compiled.move_to_end(canonical)
+    return entry[1]
+
+
+def render_plot(canonical: str, label: str, x_min: float, x_max: float, fmt: str) -> bytes:
+    """PNG or SVG bytes of the curve over [x_min, x_max]"""
+    np = get_library('numpy')
+    matplotlib = get_library('matplotlib')
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    xs = np.linspace(x_min, x_max, GRID_POINTS)
+    with np.errstate(all='ignore'):
+        ys = np.asarray(_function(canonical)(xs))
+        if np.iscomplexobj(ys):
+            ys = np.where(np.abs(ys.imag) < 1e-12, ys.real, np.nan)
+        ys = np.broadcast_to(ys.astype(float), xs.shape).copy()
+    ys[~np.isfinite(ys)] = np.nan
+    finite = ys[~np.isnan(ys)]
+    if not len(finite):
+        raise PlotError(f"No real values of {label} between {x_min} and {x_max}")
+
+    # Asymptotes (1/x, tan x) would squash the rest of the curve: frame the
+    # bulk of the values and break the line where it jumps across the frame
+    low, high = np.percentile(finite, [1, 99])
+    if high - low < 1e-9:
+        low, high = low - 1, high + 1
+    margin = (high - low) * 0.1
+    low, high = low - margin, high + margin
+    jumps = np.abs(np.diff(ys)) > (high - low)
+    ys[1:][jumps] = np.nan
+
+    figure = Figure(figsize=(6.4, 4.0), dpi=100)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.plot(xs, ys, color='#8b5cf6', linewidth=2)
+    axes.set_xlim(x_min, x_max)
+    axes.set_ylim(low, high)
+    if x_min < 0 < x_max:
+        axes.axvline(0, color='#555555', linewidth=0.8)
+    if low < 0 < high:
+        axes.axhline(0, color='#555555', linewidth=0.8)
+    axes.grid(True, alpha=0.3)
+    axes.set_title(f"f(x) = {label}")
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    # No dates, version strings or random SVG ids: the same plot is the same bytes
+    metadata = {'Date': None, 'Creator': None} if fmt == 'svg' else {'Software': None}
+    with matplotlib.rc_context({'svg.hashsalt': 'layza'}):
+        figure.savefig(buffer, format=fmt, metadata=metadata)
+    return buffer.getvalue()
+
+
+# ---------------------------------------------------------------------------
+
+class PlotImage(NamedTuple):
+    body: bytes
+    content_type: str
+    etag: str
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        return etag_matches(if_none_match, self.etag)
+
+
+class FunctionPlotter:
+    """Cached function graphs, parsed and drawn on the shared CPU pool"""
+
+    def __init__(self, pool: CpuPool, timeout: float = 5.0, max_bytes: int = 32 * 1024 * 1024,
+                 max_aliases: int = 4096):
+        self.pool = pool
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_aliases = max_aliases
+        # (normalized text) -> (canonical, label); (canonical, range, format) hash -> image
+        self._aliases: 'OrderedDict[str, Tuple[str, str]]' = OrderedDict()
+        self._images: 'OrderedDict[str, PlotImage]' = OrderedDict()
+        self._bytes = 0
+        self._renders = SingleFlight()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "shared": 0, "invalid": 0, "timeouts": 0, "failed": 0}
+        self._render_seconds = 0.0
+
+    def _count(self, name: str, seconds: float = 0.0) -> None:
+        with self._lock:
+            self._counters[name] += 1
+            self._render_seconds += seconds
+
+    def _canonical(self, text: str) -> Tuple[str, str]:
+        with self._lock:
+            found = self._aliases.get(text)
+            if found is not None:
+                self._aliases.move_to_end(text)
+                return found
+        found = self.pool.run(canonical_plot, text, timeout=self.timeout)
+        with self._lock:
+            self._aliases[text] = found
+            while len(self._aliases) > self.max_aliases:
+                self._aliases.popitem(last=False)
+        return found
+
+    def plot(self, expression: str, x_min: float = DEFAULT_RANGE[0], x_max: float = DEFAULT_RANGE[1],
+             fmt: str = 'png') -> PlotImage:
+        """The graph of `expression` over [x_min, x_max].
+
+        Raises PlotError for input that can't be plotted, and TaskTimeout or
+        another CpuTaskError when the pool couldn't finish the work.
+        """
+        try:
+            if fmt not in FORMATS:
+                raise PlotError(f"Unknown format: {fmt}")
+            if not (-MAX_SPAN <= x_min < x_max <= MAX_SPAN):
+                raise PlotError(f"Invalid range: {x_min}..{x_max}")
+            canonical, label = self._canonical(normalize_expression(expression))
+        except PlotError:
+            self._count("invalid")
+            raise
+        except CpuTaskError as e:
+            self._count("timeouts" if isinstance(e, TaskTimeout) else "failed")
+            raise
+        key = hashlib.sha256(f"{canonical}|{x_min!r}|{x_max!r}|{fmt}".encode('utf-8')).hexdigest()[:32]
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self._counters["hits"] += 1
+                return image
+
+        started = time.perf_counter()
+        try:
+            image, shared = self._renders.do(key, lambda: self._render(key, canonical, label, x_min, x_max, fmt))
+        except PlotError:
+            self._count("invalid")
+            raise
+        except CpuTaskError as e:
+            self._count("timeouts" if isinstance(e, TaskTimeout) else "failed")
+            raise
+        self._count("shared" if shared else "misses", time.perf_counter() - started)
+        return image
+
+    def _render(self, key: str, canonical: str, label: str, x_min: float, x_max: float, fmt: str) -> PlotImage:
+        body = self.pool.run(render_plot, canonical, label, x_min, x_max, fmt, timeout=self.timeout)
+        image = PlotImage(body, FORMATS[fmt], f'"{key}"')
+        with self._lock:
+            self._images[key] = image
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted.body)
+        logger.info(f"Plotted {label!r} on [{x_min}, {x_max}] as {fmt} ({len(body)} bytes)")
+        return image
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            rendered = stats["misses"] + stats["shared"]
+            stats["avgRenderMs"] = round(self._render_seconds / rendered * 1000, 3) if rendered else 0.0
+            stats["cachedImages"] = len(self._images)
+            stats["cachedBytes"] = self._bytes
+            stats["aliases"] = len(self._aliases)
+        lookups = stats["hits"] + rendered
+        stats["hitRate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def function_plotter_from_env(pool: CpuPool) -> Optional[FunctionPlotter]:
+    """Build the plotter from LAYZA_PLOT_* variables (None when LAYZA_PLOT_ENABLED=0)"""
+    if os.environ.get('LAYZA_PLOT_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return FunctionPlotter(
+        pool,
+        timeout=float(os.environ.get('LAYZA_PLOT_TIMEOUT', 5.0)),
+        max_bytes=int(os.environ.get('LAYZA_PLOT_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    )
@@ -0,0 +1,184 @@
+"""Liveness, readiness and the cached library report behind /api/health and
+/api/libraries-check.
+
+Readiness is a set of named checks for the background warm-ups started at
+boot (library imports, CPU workers, precomputed tables, the first DeepSeek
+connection). It turns green once every check has passed and then stays
+green: later upstream trouble is the circuit breaker's job, not a reason to
+take the instance out of the load balancer.
+
+The library report runs the smoke test of every library on the CPU pool, one
+per worker at a time, in a background thread. Requests get the last
+snapshot; a stale one is served as is while a single refresh runs behind it.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from cpu_pool import CpuPool
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Named warm-up checks; ready once all of them have passed"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self._checks: Dict[str, Callable[[], bool]] = {}
+        self._passed: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, check: Callable[[], bool]) -> None:
+        """Register a cheap check, polled by status() until it returns True"""
+        with self._lock:
+            self._checks[name] = check
+            self._passed[name] = False
+
+    def track(self, name: str, thread: Optional[threading.Thread]) -> None:
+        """Ready once a warm-up thread has finished (nothing to wait for if None)"""
+        if thread is not None:
+            self.add(name, lambda: not thread.is_alive())
+
+    def probe(self, name: str, fn: Callable[[], Any], retry_seconds: float = 5.0,
+              max_retry_seconds: float = 60.0, max_wait: Optional[float] = None) -> threading.Thread:
+        """Call fn in a daemon thread until it returns without raising. With
+        `max_wait` the check also passes after that many seconds, while the
+        retries go on: a dependency with its own fallbacks shouldn't keep the
+        instance out of the load balancer"""
+        done = threading.Event()
+        started = time.monotonic()
+
+        def run():
+            delay = retry_seconds
+            while True:
+                try:
+                    fn()
+                    done.set()
+                    return
+                except Exception as e:
+                    logger.warning(f"Readiness probe {name} failed, retrying in {delay:.0f} s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, max_retry_seconds)
+
+        def check() -> bool:
+            if done.is_set():
+                return True
+            if max_wait is not None and time.monotonic() - started >= max_wait:
+                logger.warning(f"Readiness probe {name} still failing after {max_wait:.0f} s; not waiting for it")
+                return True
+            return False
+
+        self.add(name, check)
+        thread = threading.Thread(target=run, name=f'readiness-{name}', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict:
+        with self._lock:
+            if self.ready_at is None:
+                for name, check in self._checks.items():
+                    if not self._passed[name]:
+                        try:
+                            self._passed[name] = bool(check())
+                        except Exception as e:
+                            logger.warning(f"Readiness check {name} raised: {e}")
+                if all(self._passed.values()):
+                    self.ready_at = time.time()
+                    logger.info(f"Ready after {self.ready_at - self.started_at:.1f} s")
+            checks = dict(self._passed)
+            ready_at = self.ready_at
+        return {
+            "ready": ready_at is not None,
+            "checks": checks,
+            "pending": [name for name, passed in checks.items() if not passed],
+            "readyAfterSeconds": round(ready_at - self.started_at, 3) if ready_at is not None else None,
+        }
+
+
+class LibraryReport:
+    """Smoke test of every library, run across the CPU pool workers and cached"""
+
+    def __init__(self, pool: CpuPool, names: Iterable[str], check: Callable[[str], Any],
+                 timeout: float = 60.0, max_age: float = 300.0):
+        self.pool = pool
+        self.names = list(names)
+        self.check = check
+        self.timeout = timeout
+        self.max_age = max_age
+        self._snapshot: Optional[Dict] = None
+        self._refreshing: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counters = {"refreshes": 0, "served": 0, "servedStale": 0}
+
+    def _collect(self) -> None:
+        started = time.perf_counter()
+        waiting, running, results = list(self.names), {}, {}
+        try:
+            while waiting or running:
+                # At most one check per worker at a time, so none of them waits
+                # out the pool's queue timeout behind the others' imports
+                while waiting and len(running) < max(1, self.pool.workers):
+                    name = waiting.pop(0)
+                    running[self.pool.submit(self.check, name, timeout=self.timeout)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        results[name] = f'Erro: {e}'
+        except Exception as e:
+            logger.error(f"Library report failed: {e}")
+            with self._lock:
+                self._refreshing = None
+            return
+        libraries = {name: results[name] for name in self.names}
+        snapshot = {
+            "checkedAt": time.time(),
+            "durationMs": round((time.perf_counter() - started) * 1000, 1),
+            "libraries": libraries,
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._refreshing = None
+            self._counters["refreshes"] += 1
+        failed = [name for name, result in libraries.items() if isinstance(result, str) and result.startswith('Erro:')]
+        logger.info(f"Library report refreshed in {snapshot['durationMs']:.0f} ms"
+                    + (f"; failing: {', '.join(failed)}" if failed else ""))
+
+    def refresh(self) -> threading.Thread:
+        """Start a background refresh, or return the one already running"""
+        with self._lock:
+            if self._refreshing is None:
+                self._refreshing = threading.Thread(target=self._collect, name='library-report', daemon=True)
+                self._refreshing.start()
+            return self._refreshing
+
+    def snapshot(self) -> Optional[Dict]:
+        """The last report with its age (None before the first one), refreshing it when stale"""
+        with self._lock:
+            snapshot = self._snapshot
+            refreshing = self._refreshing is not None
+        age = time.time() - snapshot["checkedAt"] if snapshot is not None else None
+        if not refreshing and (age is None or age > self.max_age):
+            self.refresh()
+            refreshing = True
+        if snapshot is None:
+            return None
+        with self._lock:
+            self._counters["served"] += 1
+            self._counters["servedStale"] += age > self.max_age
+        return {**snapshot, "ageSeconds": round(age, 1), "refreshing": refreshing}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            snapshot = self._snapshot
+        stats["ageSeconds"] = round(time.time() - snapshot["checkedAt"], 1) if snapshot is not None else None
+        stats["lastDurationMs"] = snapshot["durationMs"] if snapshot is not None else None
+        stats["maxAgeSeconds"] = self.max_age
+        return stats
@@ -0,0 +1,205 @@
+"""Background jobs (OCR, preprocessing...) on files in the content store.
+
+A job is identified by its kind and the SHA-256 of its input file, so
+submitting the same file twice returns the job (or finished result) that
+already exists instead of doing the work again. Results are saved next to
+the file in the store and are found again after a restart:
+
+    job = jobs.submit('ocr', stored)   # {"id": "ocr-<sha>", "status": "queued", ...}
+    jobs.get(job["id"])                 # later: "running", "done" (+ "result") or "failed"
+
+Handlers take the file path and return a JSON-serializable dict. They run on
+a small thread pool through `run` (by default a direct call; server.py sends
+them to the CPU pool so a stuck OCR engine is killed on timeout).
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from upload_store import ContentStore, StoredObject
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('done', 'failed')
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are waiting; the caller should retry later"""
+
+
+def _public(job: Dict) -> Dict:
+    """Copy of a job record without the server-side file path"""
+    return {key: value for key, value in job.items() if key != 'path'}
+
+
+def _direct(handler: Callable[[str], Dict], path: str) -> Dict:
+    return handler(path)
+
+
+class JobQueue:
+    """Deduplicating job queue with results persisted in the content store"""
+
+    def __init__(self, store: ContentStore, handlers: Dict[str, Callable[[str], Dict]],
+                 run: Callable[[Callable, str], Dict] = _direct, workers: int = 2,
+                 max_pending: int = 256, max_jobs: int = 10000):
+        self.store = store
+        self.handlers = dict(handlers)
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self._run_handler = run
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='layza-job')
+        self._jobs: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+        # Notified whenever a job finishes, for get(..., wait=...)
+        self._finished = threading.Condition(self._lock)
+        self._counters = {"submitted": 0, "deduplicated": 0, "storedResults": 0,
+                          "completed": 0, "failed": 0, "rejected": 0}
+
+    @staticmethod
+    def job_id(kind: str, digest: str) -> str:
+        return f"{kind}-{digest}"
+
+    def submit(self, kind: str, stored: StoredObject) -> Dict:
+        """Queue `kind` for a stored file, or return the existing job for it"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.job_id(kind, stored.digest)
+        with self._lock:
+            existing = self._existing(job_id)
+            if existing is not None:
+                return existing
+
+        result = self.store.load_result(stored.digest, kind)
+        with self._lock:
+            existing = self._existing(job_id)
+            if existing is not None:
+                return existing
+            if result is not None:
+                self._counters["storedResults"] += 1
+                job = self._add(job_id, kind, stored, 'done', result=result)
+                return _public(job)
+            if self._pending >= self.max_pending:
+                self._counters["rejected"] += 1
+                raise JobQueueFull(f"{self._pending} jobs already waiting")
+            job = self._add(job_id, kind, stored, 'queued')
+            self._pending += 1
+            self._counters["submitted"] += 1
+            snapshot = _public(job)
+        self._executor.submit(self._execute, job)
+        return snapshot
+
+    def _existing(self, job_id: str) -> Optional[Dict]:
+        """Snapshot of a job that is still useful (anything but failed); lock held"""
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] == 'failed':
+            return None
+        self._jobs.move_to_end(job_id)
+        self._counters["deduplicated"] += 1
+        return _public(job)
+
+    def _add(self, job_id: str, kind: str, stored: StoredObject, status: str,
+             result: Optional[Dict] = None) -> Dict:
+        """Create a job record, forgetting the oldest finished ones past max_jobs; lock held"""
+        now = time.time()
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "digest": stored.digest,
+            "file": stored.name,
+            "path": stored.path,
+            "createdAt": now,
+            "finishedAt": now if status in FINISHED else None,
+            "result": result,
+            "error": None,
+        }
+        self._jobs[job_id] = job
+        self._jobs.move_to_end(job_id)
+        if len(self._jobs) > self.max_jobs:
+            for old_id in [i for i, old in self._jobs.items() if old["status"] in FINISHED]:
+                if len(self._jobs) <= self.max_jobs:
+                    break
+                del self._jobs[old_id]
+        return job
+
+    def _execute(self, job: Dict) -> None:
+        with self._lock:
+            job["status"] = 'running'
+        started = time.perf_counter()
+        try:
+            result = self._run_handler(self.handlers[job["kind"]], job["path"])
+            self.store.save_result(job["digest"], job["kind"], result)
+        except Exception as e:
+            logger.error(f"Job {job['id'][:20]} failed after {time.perf_counter() - started:.2f}s: {e}")
+            with self._lock:
+                job.update(status='failed', error=f"{type(e).__name__}: {e}", finishedAt=time.time())
+                self._pending -= 1
+                self._counters["failed"] += 1
+                self._finished.notify_all()
+            return
+        with self._lock:
+            job.update(status='done', result=result, finishedAt=time.time())
+            self._pending -= 1
+            self._counters["completed"] += 1
+            self._finished.notify_all()
+
+    def get(self, job_id: str, wait: float = 0) -> Optional[Dict]:
+        """Current state of a job; finished jobs no longer in memory are read from the store.
+
+        With `wait`, block up to that many seconds for a queued or running job to finish.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if wait > 0:
+                    self._finished.wait_for(lambda: job["status"] in FINISHED, timeout=wait)
+                return _public(job)
+        kind, _, digest = job_id.partition('-')
+        if kind not in self.handlers:
+            return None
+        result = self.store.load_result(digest, kind)
+        if result is None:
+            return None
+        return {"id": job_id, "kind": kind, "status": 'done', "digest": digest, "result": result, "error": None}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending"] = self._pending
+            stats["tracked"] = len(self._jobs)
+        return stats
+
+
+def resolve_handler(name: str, builtin: Dict[str, Callable], default: Callable) -> Callable:
+    """A built-in handler by name, or any function given as 'package.module:function'"""
+    if name in builtin:
+        return builtin[name]
+    module_name, _, attribute = name.partition(':')
+    try:
+        return getattr(importlib.import_module(module_name), attribute)
+    except (ImportError, AttributeError, ValueError) as e:
+        logger.error(f"Could not load job handler {name!r}, using {default.__name__}: {e}")
+        return default
+
+
+def job_queue_from_env(store: ContentStore, handlers: Dict[str, Callable[[str], Dict]],
+                       run: Callable[[Callable, str], Dict] = _direct, prefix: str = 'LAYZA_JOB',
+                       workers: int = 2, max_pending: int = 256) -> JobQueue:
+    """Build a job queue from {prefix}_WORKERS, {prefix}_MAX_PENDING and {prefix}_MAX"""
+    return JobQueue(
+        store,
+        handlers,
+        run=run,
+        workers=int(os.environ.get(f'{prefix}_WORKERS', workers)),
+        max_pending=int(os.environ.get(f'{prefix}_MAX_PENDING', max_pending)),
+        max_jobs=int(os.environ.get(f'{prefix}_MAX', 10000)),
+    )
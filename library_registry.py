@@ -0,0 +1,134 @@
+"""Lazy registry for the scientific/NLP libraries used by the Layza backend.
+
+Importing sympy, scipy, spaCy & co. costs seconds of CPU. Keeping them out of
+module import time lets the server answer /api/chat right after boot, while
+each library is loaded the first time a route actually needs it (or ahead of
+time by the optional background warm-up).
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _configure_matplotlib(module: Any) -> None:
+    # The server never opens windows: force the non-interactive backend
+    # before anything imports pyplot.
+    module.use('Agg')
+
+
+class LazyLibrary:
+    """A library that is imported on first use and then kept in memory"""
+
+    def __init__(self, name: str, module: str, attribute: Optional[str] = None,
+                 on_load: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.module = module
+        self.attribute = attribute
+        self.on_load = on_load
+        self.import_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._value: Any = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self) -> Any:
+        """Import the library (once) and return the module or attribute"""
+        if self._loaded:
+            return self._value
+
+        with self._lock:
+            if self._loaded:
+                return self._value
+
+            start = time.perf_counter()
+            try:
+                module = importlib.import_module(self.module)
+                if self.on_load is not None:
+                    self.on_load(module)
+                value = getattr(module, self.attribute) if self.attribute else module
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                logger.error(f"Failed to load library {self.name}: {self.error}")
+                raise
+            finally:
+                self.import_seconds = time.perf_counter() - start
+
+            self._value = value
+            self._loaded = True
+            self.error = None
+            logger.info(f"Library {self.name} loaded in {self.import_seconds * 1000:.1f} ms")
+            return value
+
+
+LIBRARIES: Dict[str, LazyLibrary] = {
+    'sympy': LazyLibrary('sympy', 'sympy'),
+    'numpy': LazyLibrary('numpy', 'numpy'),
+    'matplotlib': LazyLibrary('matplotlib', 'matplotlib', on_load=_configure_matplotlib),
+    'scipy': LazyLibrary('scipy', 'scipy'),
+    'biopython': LazyLibrary('biopython', 'Bio'),
+    'chempy': LazyLibrary('chempy', 'chempy'),
+    'spacy': LazyLibrary('spacy', 'spacy'),
+    'nltk': LazyLibrary('nltk', 'nltk'),
+    'textblob_pt': LazyLibrary('textblob_pt', 'textblob_apt', attribute='TextBlobPT'),
+}
+
+# The libraries the server process itself imports (the subject classifier and
+# the video index). Everything else runs in the cpu_pool.py workers, which
+# load their own copies (LAYZA_CPU_PRELOAD).
+IN_PROCESS_LIBRARIES = ('numpy',)
+
+
+def get_library(name: str) -> Any:
+    """Return a library from the registry, importing it if needed"""
+    return LIBRARIES[name].load()
+
+
+def warmup_names_from_env(value: Optional[str] = None) -> List[str]:
+    """Parse LAYZA_WARMUP_LIBRARIES ("1"/"all" or a comma separated list), keeping
+    only IN_PROCESS_LIBRARIES: importing the others here would only cost memory"""
+    if value is None:
+        value = os.environ.get('LAYZA_WARMUP_LIBRARIES', '')
+    value = value.strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return []
+    if value in ('1', 'true', 'yes', 'on', 'all'):
+        return list(IN_PROCESS_LIBRARIES)
+    names = [name.strip() for name in value.split(',') if name.strip() in LIBRARIES]
+    skipped = [name for name in names if name not in IN_PROCESS_LIBRARIES]
+    if skipped:
+        logger.info(f"Not warming up {', '.join(skipped)} in the server process: "
+                    f"they run in the CPU pool workers (see LAYZA_CPU_PRELOAD)")
+    return [name for name in names if name in IN_PROCESS_LIBRARIES]
+
+
+def warm_up_libraries(names: Optional[Iterable[str]] = None,
+                      background: bool = True) -> Optional[threading.Thread]:
+    """Import the given libraries ahead of time, by default in a daemon thread"""
+    names = list(LIBRARIES) if names is None else list(names)
+
+    def _warm_up():
+        start = time.perf_counter()
+        for name in names:
+            try:
+                LIBRARIES[name].load()
+            except Exception:
+                # Already logged by LazyLibrary.load; keep warming the others
+                pass
+        logger.info(f"Library warm-up finished in {time.perf_counter() - start:.2f} s")
+
+    if not background:
+        _warm_up()
+        return None
+
+    thread = threading.Thread(target=_warm_up, name='library-warmup', daemon=True)
+    thread.start()
+    return thread
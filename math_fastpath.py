@@ -0,0 +1,421 @@
+"""Local SymPy fast path for math questions.
+
+Arithmetic expressions and one-variable equations are pulled out of the
+Portuguese question ("quanto é 3 vezes 4 mais 2?", "resolva 2x + 3 = 7"),
+evaluated or solved with SymPy and answered with a Socratic step hint, with
+no DeepSeek call. SymPy runs on the shared CPU pool (cpu_pool.py), so a
+pathological input (9^9^9^9, a nasty polynomial) has its worker killed at
+`timeout` seconds instead of pinning a server thread. The pool is shared with
+plots, chemistry and text analysis, so the fast path only waits
+`queue_timeout` seconds for a free worker. Anything that can't be answered
+that way returns None and goes upstream as before.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from cpu_pool import CpuPool, CpuTaskError, PoolBusy, TaskTimeout
+
+logger = logging.getLogger(__name__)
+
+# Longest math run we hand to SymPy; real questions are far shorter
+MAX_EXPRESSION_LENGTH = 120
+
+# Applied in order to the lowercased question
+_WORD_REPLACEMENTS: List[Tuple[str, str]] = [
+    (r'(\d),(\d)', r'\1.\2'),                           # 3,5 -> 3.5
+    (r'[−–]', '-'),
+    (r'[×·]', '*'),
+    (r'÷', '/'),
+    (r'²', ' ^ 2 '),
+    (r'³', ' ^ 3 '),
+    (r'√', ' sqrt '),
+    (r'\braiz quadrada d[eoa]\b', ' sqrt '),
+    (r'\bao quadrado\b', ' ^ 2 '),
+    (r'\bao cubo\b', ' ^ 3 '),
+    (r'\belevado (?:a|à|ao)\b', ' ^ '),
+    (r'\bna\s+(?=\d)', ' ^ '),                          # 2 na 5
+    (r'(\d+(?:\.\d+)?)\s*(?:%|por cento)\s*de\s+(?=\d)', r' ( \1 / 100 ) * '),
+    (r'\bmultiplicado por\b', ' * '),
+    (r'\bdividido por\b', ' / '),
+    (r'\bvezes\b', ' * '),
+    (r'\bmais\b', ' + '),
+    (r'\bmenos\b', ' - '),
+    (r'\b(?:é )?igual a\b', ' = '),
+    (r'(?<=\d)\s*:\s*(?=\d)', ' / '),                   # 12:4, divisão escolar
+]
+
+# Questions about something other than the value of the math in them: the
+# tutor (DeepSeek) answers those, never a number pulled out of the text
+_BAIL_RE = re.compile(
+    r'\b[a-z]\s*\(\s*[xyz]\s*\)'                              # f(x) = 2x + 1
+    r'|\bse\s+[xyz]\s*='                                         # se x = 3, quanto vale...
+    r'|\b(?:fun[çc][ãa]o|derivad|integra|limite|sistema|inequa|gr[áa]fico|matriz|logaritm)'
+    r'|\b(?:desconto|aumento|acr[ée]scimo|juros|lucro|pre[çc]o|reais|r\$)'
+    r'|\b(?:enem|ano|prova|vestibular|edi[çc][ãa]o)\s+(?:de\s+)?(?:19|20)\d\d'  # years
+    r'|\b(?:19|20)\d\d\s*[-/]\s*(?:19|20)\d\d\b'
+    r'|\b(?:p[áa]gina|p[áa]g|quest[ãõao]+|exerc[íi]cio|cap[íi]tulo|item|aula)\s*\.?\s*\d'  # page numbers
+    r'|\b(?:bhaskara|f[óo]rmula|explic|por\s*que|o que [ée]|significa|conceito|entend|demonstr|prove)'
+)
+# Asking for the value: the math right after one of these is the question
+_CUE_RE = re.compile(
+    r'(?:quanto (?:[ée]|d[áa]|vale|valem|fica)|calcul\w*|resolv\w*|simplifi\w*|encontre|ache|determine'
+    r'|qual (?:[ée] )?(?:o|a)(?: valor| resultado)?(?: de)?)'
+    r'(?: a (?:equa[çc][ãa]o|express[ãa]o|conta))?(?: [xyz](?: se)?)?\s*[:,]?\s*$'
+)
+# Without a cue, the math has to be most of the message ("2 + 2?", "x² - 4 = 0")
+MIN_MATH_SHARE = 0.6
+# Words allowed after the math ("quanto é 2 + 2 mesmo?")
+MAX_TRAILING_WORDS = 2
+
+_TOKEN_RE = re.compile(r'\d+(?:\.\d+)?|[a-zà-ú]+|\*\*|\S')
+_OPERATORS = {'+', '-', '*', '/', '^', '**'}
+_VARIABLES = {'x', 'y', 'z'}
+_FUNCTIONS = {'sqrt'}
+_ALLOWED = _OPERATORS | _VARIABLES | _FUNCTIONS | {'(', ')', '=', 'pi'}
+
+
+def _is_number(token: str) -> bool:
+    return token[0].isdigit()
+
+
+def _operand_end(token: str) -> bool:
+    return _is_number(token) or token in _VARIABLES or token in (')', 'pi')
+
+
+def _operand_start(token: str) -> bool:
+    return _is_number(token) or token in _VARIABLES or token in _FUNCTIONS or token in ('(', 'pi')
+
+
+def _join(tokens: List[str]) -> str:
+    """Rebuild a SymPy-ready string, adding the implicit multiplications (2x, 3(x+1))"""
+    out: List[str] = []
+    pending_sqrt = 0
+    for i, token in enumerate(tokens):
+        if out and _operand_end(tokens[i - 1]) and _operand_start(token):
+            out.append('*')
+        if token == '^':
+            token = '**'
+        out.append(token)
+        # "sqrt 16" -> "sqrt(16)"
+        if pending_sqrt and _is_number(token):
+            out.append(')')
+            pending_sqrt -= 1
+        if token == 'sqrt' and i + 1 < len(tokens) and _is_number(tokens[i + 1]):
+            out.append('(')
+            pending_sqrt += 1
+    return ''.join(out)
+
+
+def _asked_for(text: str, start: int, end: int, run: List[str]) -> bool:
+    """Whether the math at text[start:end] is what the question asks about"""
+    trailing = re.findall(r'[a-zà-ú\d]+', text[end:])
+    if len(trailing) > MAX_TRAILING_WORDS:
+        return False
+    if _CUE_RE.search(text[:start]):
+        return True
+    return len(''.join(run)) >= MIN_MATH_SHARE * len(re.sub(r'[\s?!.,;:]', '', text))
+
+
+def extract_math(message: str) -> Optional[Tuple[str, str]]:
+    """Find the math in a question: ("equation" | "expression", sympy string) or None"""
+    text = (message or '').lower()
+    if _BAIL_RE.search(text):
+        return None
+    for pattern, replacement in _WORD_REPLACEMENTS:
+        text = re.sub(pattern, replacement, text)
+    if '=' not in text:
+        # "3 x 4" is a product unless there is an equation to solve
+        text = re.sub(r'(?<=\d)\s+x\s+(?=\d)', ' * ', text)
+
+    # Maximal runs of math tokens, with their span in `text`
+    runs: List[Tuple[List[str], int, int]] = []
+    current: List[re.Match] = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if _is_number(token) or token in _ALLOWED:
+            current.append(match)
+            continue
+        if current:
+            runs.append(([m.group() for m in current], current[0].start(), current[-1].end()))
+        current = []
+    if current:
+        runs.append(([m.group() for m in current], current[0].start(), current[-1].end()))
+
+    best: Optional[Tuple[str, str]] = None
+    for run, start, end in runs:
+        # Trailing/leading punctuation-like operators ("... 2 + 2?" splits fine,
+        # but "- 5" at the end of a sentence should not count)
+        while run and run[-1] in _OPERATORS | {'=', '('}:
+            run.pop()
+        while run and run[0] in {'*', '/', '^', '**', '=', ')'}:
+            run.pop(0)
+        if not run or run.count('(') != run.count(')') or not _asked_for(text, start, end, run):
+            continue
+        numbers = sum(1 for token in run if _is_number(token))
+        has_variable = any(token in _VARIABLES for token in run)
+        operators = sum(1 for token in run if token in _OPERATORS)
+        if run.count('=') == 1 and has_variable:
+            kind = 'equation'
+        elif '=' not in run and numbers and ((operators and (numbers >= 2 or has_variable)) or 'sqrt' in run):
+            kind = 'expression'
+        else:
+            continue
+        candidate = (kind, _join(run))
+        if len(candidate[1]) > MAX_EXPRESSION_LENGTH:
+            continue
+        # Prefer an equation, then the longest expression
+        if best is None or (kind == 'equation' and best[0] != 'equation') or \
+                (kind == best[0] and len(candidate[1]) > len(best[1])):
+            best = candidate
+    return best
+
+
+# --- Runs inside the CPU pool workers ---------------------------------------
+
+def _show(expr, order: str = 'none') -> str:
+    from sympy.printing.str import StrPrinter
+
+    class HintPrinter(StrPrinter):
+        # evaluate=False keeps "x - 2" as x + (-1)*2; print it the way it was typed
+        def _print_Mul(self, expr):
+            if len(expr.args) == 2 and expr.args[0] == -1 and expr.args[1].is_Number:
+                return '-' + self._print(expr.args[1])
+            return super()._print_Mul(expr)
+
+    text = HintPrinter({'order': order}).doprint(expr)
+    return text.replace('**', '^').replace('*', '·').replace('sqrt', '√').replace('I', 'i')
+
+
+def _decimal(value) -> str:
+    return f"{float(value):.6g}".replace('.', ',')
+
+
+def _format_value(value) -> str:
+    if value.is_Integer:
+        return str(value)
+    if value.is_Rational:
+        return f"{value.p}/{value.q} (≈ {_decimal(value)})"
+    if value.is_real and value.is_number:
+        if value.is_Float:
+            return _decimal(value)
+        return f"{_show(value)} (≈ {_decimal(value)})"
+    return _show(value)
+
+
+def _is_value(node) -> bool:
+    # Numbers, including the -n and 1/n nodes that evaluate=False keeps around
+    if node.is_Number or node.is_NumberSymbol:
+        return True
+    if node.is_Mul and len(node.args) == 2 and -1 in node.args:
+        return all(_is_value(arg) for arg in node.args)
+    if node.is_Pow and node.exp == -1:
+        return _is_value(node.base)
+    return False
+
+
+def _first_step(expr):
+    """The operation a student should do first (powers, then products, then sums)"""
+    candidates = [node for node in _preorder(expr)
+                  if not _is_value(node) and node.args and all(_is_value(arg) for arg in node.args)]
+    for check in ('is_Pow', 'is_Mul', 'is_Add'):
+        for node in candidates:
+            if getattr(node, check):
+                return node
+    return None
+
+
+def _preorder(expr):
+    yield expr
+    for arg in expr.args:
+        yield from _preorder(arg)
+
+
+def _count_operations(expr) -> int:
+    return sum(1 for node in _preorder(expr) if node.args and not _is_value(node))
+
+
+def _expression_hint(source: str) -> Optional[str]:
+    import sympy
+    from sympy.parsing.sympy_parser import parse_expr
+
+    unevaluated = parse_expr(source, evaluate=False)
+    value = sympy.simplify(parse_expr(source))
+
+    if value.has(sympy.zoo, sympy.nan):
+        return ("Opa, repara bem nessa conta! 🤔 Em algum momento aparece uma divisão por zero. "
+                "O que acontece quando tentamos dividir um número por zero? Será que existe resposta?")
+
+    if value.free_symbols:
+        expanded = sympy.expand(value)
+        return ("Vamos organizar essa expressão juntas! 🧮 Primeiro aplique a distributiva onde houver "
+                "parênteses e depois junte os termos semelhantes (os que têm a mesma letra com o mesmo "
+                "expoente). Que expressão você encontra? "
+                f"Depois confira: {_show(unevaluated)} = {_show(expanded, 'lex')} ✨")
+
+    step = _first_step(unevaluated)
+    if step is not None and _count_operations(unevaluated) > 1:
+        start = (f"Lembra da ordem das operações? Primeiro potências e raízes, depois multiplicações e "
+                 f"divisões, e por último somas e subtrações. Então comece por {_show(step)}: "
+                 f"quanto dá? Depois siga com o resto da conta.")
+    else:
+        start = f"Vamos fazer essa conta com calma: {_show(unevaluated)}. Que resultado você encontra?"
+    return f"{start} 🧮 Quando terminar, confira: o resultado é {_format_value(value)} ✨"
+
+
+def _equation_hint(source: str) -> Optional[str]:
+    import sympy
+    from sympy.parsing.sympy_parser import parse_expr
+
+    left, right = source.split('=')
+    lhs, rhs = parse_expr(left), parse_expr(right)
+    equation = sympy.expand(lhs - rhs)
+    symbols = sorted(equation.free_symbols, key=str)
+    shown = f"{_show(parse_expr(left, evaluate=False))} = {_show(parse_expr(right, evaluate=False))}"
+
+    if not symbols:
+        verdict = "verdadeira ✅" if sympy.simplify(equation) == 0 else "falsa ❌"
+        return (f"Vamos conferir essa igualdade: calcule cada lado de {shown} separadamente. "
+                f"Os dois lados dão o mesmo valor? (Spoiler: ela é {verdict})")
+    if len(symbols) > 1:
+        return None
+
+    x = symbols[0]
+    if not equation.is_polynomial(x):
+        solutions = sympy.solve(equation, x)
+        if not solutions:
+            return None
+        answers = ', '.join(f"{x} = {_format_value(s)}" for s in solutions)
+        return (f"Vamos pensar em {shown}: que operação desfaz cada passo aplicado ao {x}? "
+                f"Tente isolar o {x} um passo de cada vez. 🤔 Depois confira: {answers} ✨")
+
+    poly = sympy.Poly(equation, x)
+    if poly.degree() == 1:
+        a, b = poly.all_coeffs()
+        steps = f"Passo 1: deixe os termos com {x} de um lado e os números do outro. "
+        if a == 1:
+            steps += "Que número sobra do outro lado? "
+        else:
+            steps += (f"Você deve chegar em {_show(a * x)} = {_show(-b)}. "
+                      f"Passo 2: o que precisamos fazer para o {x} ficar sozinho? ")
+        return (f"Vamos isolar o {x} em {shown}! 😊 {steps}"
+                f"Depois confira: {x} = {_format_value(sympy.nsimplify(-b / a))} ✨")
+    if poly.degree() == 2:
+        a, b, c = poly.all_coeffs()
+        delta = b ** 2 - 4 * a * c
+        solutions = sympy.solve(equation, x)
+        answers = ' e '.join(f"{x} = {_format_value(s)}" for s in solutions)
+        return (f"{shown} é uma equação do 2º grau! 📐 Identifique os coeficientes: a = {_show(a)}, "
+                f"b = {_show(b)} e c = {_show(c)}. Agora calcule o discriminante Δ = b² - 4ac. "
+                f"Quanto deu? O sinal do Δ diz quantas soluções reais existem. "
+                f"Depois use Bhaskara e confira: Δ = {_show(delta)}, "
+                f"{answers if solutions else 'sem soluções'} ✨")
+    solutions = sympy.solve(equation, x)
+    if not solutions:
+        return None
+    answers = ', '.join(f"{x} = {_format_value(s)}" for s in solutions)
+    return (f"{shown} tem grau {poly.degree()}. Que tal tentar colocar o {x} em evidência ou "
+            f"procurar uma raiz testando valores pequenos? 🔍 Depois confira: {answers} ✨")
+
+
+def solve_hint(kind: str, source: str) -> Optional[str]:
+    """Evaluate/solve with SymPy and write the hint; None when SymPy can't help"""
+    try:
+        if kind == 'equation':
+            return _equation_hint(source)
+        return _expression_hint(source)
+    except Exception:
+        # Unsupported syntax or a SymPy error: let DeepSeek answer instead
+        return None
+
+
+# ---------------------------------------------------------------------------
+
+class MathFastPath:
+    """Answers math questions locally, solving them on the shared CPU pool"""
+
+    def __init__(self, pool: CpuPool, timeout: float = 1.0, queue_timeout: float = 0.2):
+        self.pool = pool
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._counters = {"attempts": 0, "hits": 0, "noMath": 0, "unsolved": 0, "timeouts": 0, "busy": 0}
+        self._solve_seconds = 0.0
+
+    def _count(self, name: str, seconds: float = 0.0) -> None:
+        with self._lock:
+            self._counters[name] += 1
+            self._solve_seconds += seconds
+
+    def _extract(self, message: str) -> Optional[Tuple[str, str]]:
+        found = extract_math(message)
+        self._count("attempts")
+        if found is None:
+            self._count("noMath")
+        return found
+
+    def answer(self, message: str) -> Optional[str]:
+        """A local answer for `message`, or None to use the upstream model"""
+        found = self._extract(message)
+        if found is None:
+            return None
+        started = time.perf_counter()
+        try:
+            hint = self.pool.run(solve_hint, *found, timeout=self.timeout, queue_timeout=self.queue_timeout)
+        except CpuTaskError as e:
+            return self._failed(found, e, started)
+        return self._finish(found, hint, started)
+
+    async def answer_async(self, message: str) -> Optional[str]:
+        """asyncio version of answer"""
+        found = self._extract(message)
+        if found is None:
+            return None
+        started = time.perf_counter()
+        try:
+            hint = await self.pool.run_async(solve_hint, *found, timeout=self.timeout,
+                                             queue_timeout=self.queue_timeout)
+        except CpuTaskError as e:
+            return self._failed(found, e, started)
+        return self._finish(found, hint, started)
+
+    def _failed(self, found: Tuple[str, str], error: CpuTaskError, started: float) -> None:
+        # Timeouts (9^9^9^9), a busy pool or a crashed worker: DeepSeek answers instead
+        logger.warning(f"Math fast path gave up on {found[1]!r}: {error}")
+        if isinstance(error, PoolBusy):
+            self._count("busy")  # Nothing was solved: keep it out of avgSolveMs
+            return None
+        self._count("timeouts" if isinstance(error, TaskTimeout) else "unsolved",
+                    time.perf_counter() - started)
+        return None
+
+    def _finish(self, found: Tuple[str, str], hint: Optional[str], started: float) -> Optional[str]:
+        elapsed = time.perf_counter() - started
+        if hint is None:
+            logger.info(f"Math fast path could not answer {found[1]!r}")
+            self._count("unsolved", elapsed)
+            return None
+        logger.info(f"Math fast path answered {found[0]} {found[1]!r} in {elapsed * 1000:.1f}ms")
+        self._count("hits", elapsed)
+        return hint
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            solved = stats["hits"] + stats["unsolved"] + stats["timeouts"]
+            stats["avgSolveMs"] = round(self._solve_seconds / solved * 1000, 3) if solved else 0.0
+        stats["hitRate"] = round(stats["hits"] / stats["attempts"], 4) if stats["attempts"] else 0.0
+        stats["timeoutSeconds"] = self.timeout
+        stats["queueTimeoutSeconds"] = self.queue_timeout
+        return stats
+
+
+def math_fastpath_from_env(pool: CpuPool) -> Optional[MathFastPath]:
+    """Build the math fast path from LAYZA_MATH_* variables (None when disabled)"""
+    if os.environ.get('LAYZA_MATH_FASTPATH_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return MathFastPath(pool, timeout=float(os.environ.get('LAYZA_MATH_TIMEOUT', 1.0)),
+                        queue_timeout=float(os.environ.get('LAYZA_MATH_QUEUE_TIMEOUT', 0.2)))
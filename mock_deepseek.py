@@ -0,0 +1,230 @@
+"""Local stand-in for the DeepSeek chat completions API.
+
+Lets the backend be exercised offline, including stream mode:
+
+    python mock_deepseek.py --port 8001
+    DEEPSEEK_API_URL=http://localhost:8001/v1/chat/completions DEEPSEEK_API_KEY=mock python server.py
+
+Latencies (before the first byte, and between streamed tokens) are either a
+number of seconds or a distribution:
+
+    fixed:0.5            always 0.5 s
+    uniform:0.2,1.5      between 0.2 and 1.5 s
+    normal:0.8,0.2       mean 0.8 s, standard deviation 0.2 s (never negative)
+    lognormal:0.8,0.6    median 0.8 s, sigma 0.6 (long right tail, like real LLM APIs)
+    exponential:0.5      mean 0.5 s
+
+It can also be started inside another process with MockDeepSeekServer;
+fail_first makes the next requests fail deterministically, and request_times
+records when each request arrived (the tests use both).
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Union
+
+MOCK_REPLY = (
+    "Oi! 😊 Vamos pensar juntas nessa questão. O que você já sabe sobre o assunto? "
+    "Tente identificar os dados do problema e me conte o que encontrou!"
+)
+
+
+class Latency:
+    """A latency distribution in seconds, parsed from "kind:a,b" or a plain number"""
+
+    KINDS: Dict[str, Callable[..., float]] = {
+        'fixed': lambda value: value,
+        'uniform': random.uniform,
+        'normal': lambda mean, stddev: random.gauss(mean, stddev),
+        'lognormal': lambda median, sigma: random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0,
+        'exponential': lambda mean: random.expovariate(1 / mean) if mean > 0 else 0.0,
+    }
+
+    def __init__(self, spec: Union[str, float, int] = 0.0):
+        self.spec = str(spec)
+        kind, sep, params = self.spec.partition(':')
+        if not sep:
+            kind, params = 'fixed', kind
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind!r} (expected one of {', '.join(self.KINDS)})")
+        try:
+            self.params = [float(value) for value in params.split(',')]
+            self.KINDS[kind](*self.params)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid latency {self.spec!r}: {e}")
+        self.kind = kind
+
+    def sample(self) -> float:
+        return max(0.0, self.KINDS[self.kind](*self.params))
+
+    def __repr__(self) -> str:
+        return f"Latency({self.spec!r})"
+
+
+def _split_tokens(text: str) -> List[str]:
+    words = text.split(' ')
+    return [word + (' ' if i < len(words) - 1 else '') for i, word in enumerate(words)]
+
+
+class MockDeepSeekHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/chat/completions like DeepSeek does"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        with self.server.lock:
+            self.server.request_times.append(time.monotonic())
+            fail = self.server.fail_first > 0
+            self.server.fail_first -= fail
+
+        time.sleep(self.server.latency.sample())
+
+        if fail or (self.server.error_rate and random.random() < self.server.error_rate):
+            self.send_response(self.server.error_status)
+            body = json.dumps({"error": {"message": "mock upstream failure"}}).encode('utf-8')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if self.server.retry_after is not None:
+                self.send_header('Retry-After', str(self.server.retry_after))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = payload.get('model', 'deepseek-ai/deepseek-v3')
+
+        if payload.get('stream'):
+            self._stream(completion_id, model)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.server.reply},
+                "finish_reason": "stop"
+            }]
+        })
+
+    def _stream(self, completion_id: str, model: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        for token in _split_tokens(self.server.reply):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.token_delay.sample())
+
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class MockDeepSeekServer(ThreadingHTTPServer):
+    """Threaded mock server; use port=0 to bind a free port"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: Union[str, float] = 0.0,
+                 token_delay: Union[str, float] = 0.0, reply: str = MOCK_REPLY, error_rate: float = 0.0,
+                 error_status: int = 503, retry_after: Optional[float] = None,
+                 fail_first: int = 0, verbose: bool = False):
+        super().__init__((host, port), MockDeepSeekHandler)
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency)
+        self.token_delay = token_delay if isinstance(token_delay, Latency) else Latency(token_delay)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.request_times: List[float] = []
+        self.lock = threading.Lock()
+        self.reply = reply
+        self.verbose = verbose
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> 'MockDeepSeekServer':
+        """Serve in a daemon thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-deepseek', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock DeepSeek chat completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=Latency, default=Latency(0.0),
+                        help='seconds before the first byte, or a distribution such as lognormal:0.8,0.6')
+    parser.add_argument('--token-delay', type=Latency, default=Latency(0.05),
+                        help='seconds between streamed tokens, or a distribution')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After sent with errors')
+    parser.add_argument('--fail-first', type=int, default=0, help='number of requests that fail before any succeeds')
+    args = parser.parse_args()
+
+    server = MockDeepSeekServer(args.host, args.port, latency=args.latency,
+                                token_delay=args.token_delay, error_rate=args.error_rate,
+                                error_status=args.error_status, retry_after=args.retry_after,
+                                fail_first=args.fail_first, verbose=True)
+    print(f"Mock DeepSeek listening on {server.url} (latency {server.latency.spec}, "
+          f"token delay {server.token_delay.spec}, error rate {server.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""OCR backends for uploaded question photos.
+
+A backend is a module-level function taking the image path and returning a
+dict with at least "text"; it runs in a CPU pool worker, so it must be
+importable by name. LAYZA_OCR_BACKEND picks one:
+
+    stub       (default) preprocesses the image and returns placeholder text
+    tesseract  Tesseract through pytesseract (Portuguese model), if installed
+    pkg.mod:fn any other function with the same signature
+"""
+import os
+from typing import Callable, Dict, Tuple
+
+from job_queue import resolve_handler
+
+# Longest side after preprocessing: enough for OCR, far smaller than a phone photo
+MAX_SIDE = 2048
+
+
+def preprocess_image(path: str) -> Tuple[object, Dict]:
+    """Upright, grayscale, auto-contrasted copy of the image (Pillow) and a summary"""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as original:
+        info = {"format": original.format, "originalWidth": original.width, "originalHeight": original.height}
+        image = ImageOps.exif_transpose(original)
+        image = ImageOps.autocontrast(image.convert('L'))
+    image.thumbnail((MAX_SIDE, MAX_SIDE))
+    info.update(width=image.width, height=image.height)
+    return image, info
+
+
+def stub_ocr(path: str) -> Dict:
+    """Local stand-in for an OCR engine: real preprocessing, placeholder text"""
+    try:
+        _, info = preprocess_image(path)
+    except Exception as e:  # Pillow missing or a format it can't open (e.g. HEIC)
+        info = {"preprocessError": f"{type(e).__name__}: {e}"}
+    return {"engine": "stub", "text": "Texto extraído da imagem", **info}
+
+
+def tesseract_ocr(path: str) -> Dict:
+    """Tesseract OCR on the preprocessed image (needs pytesseract and the tesseract binary)"""
+    import pytesseract
+
+    image, info = preprocess_image(path)
+    text = pytesseract.image_to_string(image, lang=os.environ.get('LAYZA_OCR_LANG', 'por'))
+    return {"engine": "tesseract", "text": text.strip(), **info}
+
+
+BACKENDS = {
+    'stub': stub_ocr,
+    'tesseract': tesseract_ocr,
+}
+
+
+def ocr_backend_from_env() -> Callable[[str], Dict]:
+    """The function named by LAYZA_OCR_BACKEND (the stub if it can't be loaded)"""
+    return resolve_handler(os.environ.get('LAYZA_OCR_BACKEND', 'stub'), BACKENDS, stub_ocr)
@@ -0,0 +1,276 @@
+"""Per-client token-bucket rate limiting for the chat routes.
+
+Clients are identified by API key, conversationId or IP (see ClientIdentity).
+Buckets live in a bounded LRU dict of two-float lists, so 100k clients cost
+a few MB. With LAYZA_RATE_LIMIT_REDIS_URL the buckets live in Redis instead
+and every worker process shares them; with LAYZA_SHARED_CACHE=mmap they are
+shared by the workers of one host through a memory-mapped table.
+"""
+import hashlib
+import ipaddress
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from shared_cache import shared_store_from_env
+
+logger = logging.getLogger(__name__)
+
+
+def api_key_id(api_key: str) -> str:
+    """The client id for an API key: a truncated SHA-256, so the key itself never
+    reaches logs, Redis or the shared mmap table"""
+    return f"key:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}"
+
+
+class ClientIdentity:
+    """Who is calling: "key:<key hash>", "conv:<address>#<slot>" or "ip:<address>".
+
+    In "auto" mode a configured X-API-Key wins, then the conversationId (a
+    whole classroom often shares one NAT address), then the client IP.
+    Everything a caller can make up is checked: unknown API keys are ignored,
+    X-Forwarded-For only counts when the request comes from a trusted proxy,
+    and conversations are hashed into `conversations_per_ip` slots under the
+    caller's address, so new conversationIds can't mint new buckets.
+    """
+
+    def __init__(self, mode: str = 'auto', api_keys: Iterable[str] = (),
+                 trusted_proxies: Iterable[str] = (), conversations_per_ip: int = 64):
+        self.mode = mode
+        # Hashed once here rather than on every request
+        self.api_keys = {api_key: api_key_id(api_key) for api_key in api_keys}
+        self.trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies]
+        self.conversations_per_ip = max(1, conversations_per_ip)
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def address(self, headers, remote_addr: Optional[str]) -> str:
+        """The client IP: the last X-Forwarded-For hop not added by a trusted proxy"""
+        address = remote_addr or 'unknown'
+        if not self._trusted(address):
+            return address
+        for hop in reversed(headers.get('X-Forwarded-For', '').split(',')):
+            hop = hop.strip()
+            if not hop:
+                continue
+            address = hop
+            if not self._trusted(hop):
+                break
+        return address
+
+    def __call__(self, headers, data: Optional[Dict], remote_addr: Optional[str]) -> str:
+        api_key = headers.get('X-API-Key', '').strip()
+        if api_key in self.api_keys and self.mode in ('auto', 'api_key'):
+            return self.api_keys[api_key]
+
+        address = self.address(headers, remote_addr)
+        conversation_id = str((data or {}).get('conversationId') or '').strip()
+        if conversation_id and self.mode in ('auto', 'conversation'):
+            # hashlib, not hash(): every worker process must pick the same slot
+            digest = hashlib.blake2b(conversation_id.encode('utf-8', 'replace'), digest_size=8).digest()
+            return f"conv:{address}#{int.from_bytes(digest, 'big') % self.conversations_per_ip}"
+        return f"ip:{address}"
+
+
+def client_identity_from_env() -> ClientIdentity:
+    """LAYZA_CLIENT_ID_MODE (auto, api_key, conversation or ip), LAYZA_CLIENT_API_KEYS,
+    LAYZA_TRUSTED_PROXIES (IPs or CIDRs) and LAYZA_CONVERSATIONS_PER_IP, comma separated"""
+    def listed(name: str) -> List[str]:
+        return [item.strip() for item in os.environ.get(name, '').split(',') if item.strip()]
+    return ClientIdentity(
+        mode=os.environ.get('LAYZA_CLIENT_ID_MODE', 'auto').lower(),
+        api_keys=listed('LAYZA_CLIENT_API_KEYS'),
+        trusted_proxies=listed('LAYZA_TRUSTED_PROXIES'),
+        conversations_per_ip=int(os.environ.get('LAYZA_CONVERSATIONS_PER_IP', 64)),
+    )
+
+
+class TokenBucketLimiter:
+    """In-process token buckets: `rate` tokens per second, up to `burst` saved"""
+
+    def __init__(self, rate: float = 0.5, burst: float = 10, max_clients: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> [tokens, last refill timestamp]
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited": 0}
+
+    def allow(self, client: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """(allowed, retry_after_seconds) for one request of `cost` tokens"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = [self.burst, now]
+                self._buckets[client] = bucket
+                if len(self._buckets) > self.max_clients:
+                    # The least recently seen client would be full again anyway
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self._counters["allowed"] += 1
+                return True, 0.0
+            self._counters["limited"] += 1
+            return False, (cost - bucket[0]) / self.rate
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "clients": len(self._buckets),
+                "ratePerSecond": self.rate,
+                "burst": self.burst,
+                **self._counters,
+            }
+
+
+class SharedTokenBucketLimiter:
+    """Token buckets in the host's shared mmap table, so every worker process
+    on the machine spends from the same bucket (see shared_cache.py)"""
+
+    def __init__(self, store, rate: float = 0.5, burst: float = 10):
+        self.rate = rate
+        self.burst = burst
+        self._store = store
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited": 0}
+
+    def allow(self, client: str, cost: float = 1.0) -> Tuple[bool, float]:
+        outcome = []
+
+        def spend(current: Optional[str]) -> Tuple[str, float]:
+            # Wall-clock time: the timestamp is compared across processes
+            now = time.time()
+            if current is None:
+                tokens = self.burst
+            else:
+                saved, last = current.split(',')
+                tokens = min(self.burst, float(saved) + (now - float(last)) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                outcome.append(0.0)
+            else:
+                outcome.append((cost - tokens) / self.rate)
+            # Forgotten once it would be full again anyway
+            return f"{tokens:.6f},{now:.6f}", now + (self.burst - tokens) / self.rate + 1
+
+        self._store.update(client, spend)
+        retry_after = outcome[0]
+        with self._lock:
+            self._counters["allowed" if retry_after == 0.0 else "limited"] += 1
+        return retry_after == 0.0, retry_after
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "shared",
+                "ratePerSecond": self.rate,
+                "burst": self.burst,
+                **self._counters,
+                "store": self._store.stats(),
+            }
+
+
+# Refill, spend and persist a bucket atomically; time comes from the Redis
+# server so workers with skewed clocks agree
+_REDIS_TOKEN_BUCKET = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisTokenBucketLimiter:
+    """Token buckets shared by every worker through Redis (fails open if Redis is down)"""
+
+    def __init__(self, url: str, rate: float = 0.5, burst: float = 10, prefix: str = 'layza:rl:'):
+        import redis  # Optional dependency, only needed for multi-worker deployments
+
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.05)
+        self._script = self._redis.register_script(_REDIS_TOKEN_BUCKET)
+        self._errors = (redis.RedisError,)
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited": 0, "backendErrors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def allow(self, client: str, cost: float = 1.0) -> Tuple[bool, float]:
+        try:
+            allowed, retry_after = self._script(keys=[self.prefix + client],
+                                                args=[self.rate, self.burst, cost])
+        except self._errors as e:
+            logger.error(f"Rate limit backend unavailable, allowing request: {e}")
+            self._count("backendErrors")
+            return True, 0.0
+        if int(allowed):
+            self._count("allowed")
+            return True, 0.0
+        self._count("limited")
+        return False, float(retry_after)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "redis",
+                "ratePerSecond": self.rate,
+                "burst": self.burst,
+                **self._counters,
+            }
+
+
+def limiter_from_env():
+    """Build the chat rate limiter from LAYZA_RATE_LIMIT_* variables (None when disabled)"""
+    if os.environ.get('LAYZA_RATE_LIMIT_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    rate = float(os.environ.get('LAYZA_RATE_LIMIT_RATE', 0.5))
+    burst = float(os.environ.get('LAYZA_RATE_LIMIT_BURST', 10))
+    redis_url = os.environ.get('LAYZA_RATE_LIMIT_REDIS_URL')
+    if redis_url:
+        return RedisTokenBucketLimiter(redis_url, rate=rate, burst=burst)
+    if os.environ.get('LAYZA_SHARED_CACHE', 'off').lower() == 'mmap':
+        # 128-byte slots: a bucket is two numbers, and answers never evict them
+        store = shared_store_from_env('rate-limit', size_bytes=8 * 1024 * 1024, slot_bytes=128)
+        if store is not None:
+            return SharedTokenBucketLimiter(store, rate=rate, burst=burst)
+    return TokenBucketLimiter(
+        rate=rate,
+        burst=burst,
+        max_clients=int(os.environ.get('LAYZA_RATE_LIMIT_MAX_CLIENTS', 100000)),
+    )
@@ -0,0 +1,200 @@
+"""Tiered cache for AI responses: in-memory LRU with TTL plus optional SQLite tier.
+
+ENEM prep traffic repeats the same (subject, question) pairs many times, so
+successful upstream answers are kept here and reused instead of paying for
+another DeepSeek round trip.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from shared_cache import shared_store_from_env
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message: str) -> str:
+    """Case and whitespace insensitive form of a user message"""
+    return _WHITESPACE.sub(' ', (message or '').strip()).casefold()
+
+
+def make_cache_key(message: str, subject: str, prompt_version: str) -> str:
+    """Cache key for a (normalized message, subject, system prompt version) triple"""
+    raw = f"{prompt_version}\x1f{subject or ''}\x1f{normalize_message(message)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Bounded LRU + TTL cache, optionally backed by a tier shared between worker
+    processes (see shared_cache.py) and a SQLite file that survives restarts"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400,
+                 disk_path: Optional[str] = None, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.shared = shared
+        self._entries: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "sharedHits": 0,
+            "diskHits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "sets": 0,
+        }
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if disk_path:
+            self._open_disk_tier(disk_path)
+
+    def _open_disk_tier(self, path: str) -> None:
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+            logger.info(f"Response cache disk tier opened at {path}")
+        except sqlite3.Error as e:
+            logger.error(f"Could not open response cache disk tier at {path}: {e}")
+            self._db = None
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._counters["expirations"] += 1
+
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None and entry[1] > now:
+                value, expires_at = entry
+                with self._lock:
+                    self._store_in_memory(key, value, expires_at)
+                    self._counters["hits"] += 1
+                    self._counters["sharedHits"] += 1
+                return value
+
+        if self._db is not None:
+            row = self._disk_get(key)
+            if row is not None:
+                value, expires_at = row
+                if expires_at > now:
+                    with self._lock:
+                        self._store_in_memory(key, value, expires_at)
+                        self._counters["hits"] += 1
+                        self._counters["diskHits"] += 1
+                    return value
+                self._disk_delete(key)
+                with self._lock:
+                    self._counters["expirations"] += 1
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store_in_memory(key, value, expires_at)
+            self._counters["sets"] += 1
+        if self.shared is not None:
+            self.shared.set(key, value, expires_at)
+        if self._db is not None:
+            self._disk_set(key, value, expires_at)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hitRate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["maxEntries"] = self.max_entries
+        stats["ttlSeconds"] = self.ttl
+        stats["diskTier"] = self._db is not None
+        stats["sharedTier"] = self.shared.stats() if self.shared is not None else False
+        return stats
+
+    def _store_in_memory(self, key: str, value: str, expires_at: float) -> None:
+        # Caller holds self._lock
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            with self._db_lock:
+                return self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache disk read failed: {e}")
+            return None
+
+    def _disk_set(self, key: str, value: str, expires_at: float) -> None:
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache disk write failed: {e}")
+
+    def _disk_delete(self, key: str) -> None:
+        try:
+            with self._db_lock:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Response cache disk delete failed: {e}")
+
+
+def cache_from_env() -> Optional[ResponseCache]:
+    """Build the response cache from LAYZA_CACHE_* variables (None when disabled);
+    LAYZA_SHARED_CACHE adds the cross-worker tier"""
+    if os.environ.get('LAYZA_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return ResponseCache(
+        max_entries=int(os.environ.get('LAYZA_CACHE_MAX_ENTRIES', 1024)),
+        ttl=float(os.environ.get('LAYZA_CACHE_TTL', 86400)),
+        disk_path=os.environ.get('LAYZA_CACHE_DISK_PATH') or None,
+        shared=shared_store_from_env('responses'),
+    )
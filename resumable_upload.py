@@ -0,0 +1,267 @@
+"""Resumable uploads: a file sent in chunks that can continue after a dropped connection.
+
+The client creates a session with the total size, then appends chunks at the
+offset the server reports; after a failure it asks for the offset again and
+continues from there (the same idea as the tus protocol, without its
+extensions):
+
+    POST   .../sessions            {"size": 1234567}  -> {"uploadId", "offset": 0, "chunkSize"}
+    PATCH  .../sessions/<id>       Upload-Offset: 0, raw bytes -> {"offset": 1048576}
+    HEAD   .../sessions/<id>       -> Upload-Offset: 1048576
+
+Everything lives on disk under <store root>/sessions (the partial file is the
+source of truth for the offset), so a session can be resumed through any
+worker process or after a restart. When the last byte arrives the file is
+hashed and moved into the content store like any other upload, and a receipt
+(<id>.done) takes the session's place until it expires, so a client that
+retries the last PATCH gets the same answer instead of an error.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Optional
+
+from upload_store import ContentStore, StoredObject, UnsupportedUpload, UploadError, UploadTooLarge, sniff_type
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Suggested chunk size for clients: small enough to resend cheaply on a bad connection
+CHUNK_BYTES = 1024 * 1024
+
+
+class SessionNotFound(UploadError):
+    status = 404
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the upload currently ends"""
+    status = 409
+
+    def __init__(self, expected: int):
+        super().__init__(f"Upload is at offset {expected}")
+        self.expected = expected
+
+
+class UploadBusy(UploadError):
+    """Another request is appending to the same session"""
+    status = 409
+
+
+class ResumableUploads:
+    """Upload sessions stored next to the content store"""
+
+    def __init__(self, store: ContentStore, allowed_types: Dict[str, str], max_bytes: int,
+                 ttl: float = 86400):
+        self.store = store
+        self.allowed_types = allowed_types
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = os.path.join(store.root, 'sessions')
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._appending = set()
+        self._last_sweep = 0.0
+        self._counters = {"created": 0, "completed": 0, "chunks": 0, "offsetMismatches": 0, "replayed": 0,
+                          "expired": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _paths(self, upload_id: str):
+        if not upload_id.isalnum() or len(upload_id) != 32:
+            raise SessionNotFound(f"Unknown upload {upload_id[:40]!r}")
+        base = os.path.join(self.directory, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def _receipt_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.done")
+
+    def create(self, size: int, filename: Optional[str] = None) -> Dict:
+        """Start a session for a file of `size` bytes"""
+        if size > self.max_bytes:
+            raise UploadTooLarge(f"Declared size {size} is over {self.max_bytes} bytes")
+        if size <= 0:
+            raise UploadError("Declared size must be positive")
+        self._sweep()
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({"size": size, "filename": filename, "createdAt": time.time()}, f)
+        self._count("created")
+        return {"uploadId": upload_id, "offset": 0, "size": size, "chunkSize": CHUNK_BYTES}
+
+    def _load(self, upload_id: str) -> Dict:
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            # A finished upload: {"size", "offset", "stored"}
+            with open(self._receipt_path(upload_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            meta["offset"] = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            raise SessionNotFound(f"Unknown upload {upload_id}")
+        return meta
+
+    def status(self, upload_id: str) -> Dict:
+        meta = self._load(upload_id)
+        return {"uploadId": upload_id, "offset": meta["offset"], "size": meta["size"]}
+
+    def append(self, upload_id: str, offset: int, chunks: Iterable[bytes]) -> Dict:
+        """Write a chunk that starts at `offset`.
+
+        Returns the new status; when the file is complete it also contains
+        "stored" (the StoredObject in the content store). A repeated last
+        chunk on a finished upload gets that same result again.
+        """
+        meta = self._load(upload_id)
+        if "stored" in meta:
+            return self._replay(upload_id, meta, offset)
+        _, part_path = self._paths(upload_id)
+        with self._lock:
+            if upload_id in self._appending:
+                raise UploadBusy(f"Upload {upload_id} is already receiving a chunk")
+            self._appending.add(upload_id)
+        try:
+            try:
+                # Never 'ab': that would recreate the part of an upload that just finished
+                fd = os.open(part_path, os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                meta = self._load(upload_id)
+                if "stored" in meta:
+                    return self._replay(upload_id, meta, offset)
+                raise SessionNotFound(f"Unknown upload {upload_id}")
+            with os.fdopen(fd, 'ab') as part:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        raise UploadBusy(f"Upload {upload_id} is already receiving a chunk")
+                # Completion happens under this lock: if another request finished
+                # the upload while this one waited, `part` is already in the store
+                meta = self._load(upload_id)
+                if "stored" in meta:
+                    return self._replay(upload_id, meta, offset)
+                current = os.fstat(part.fileno()).st_size
+                if offset != current:
+                    self._count("offsetMismatches")
+                    raise OffsetMismatch(current)
+                try:
+                    written = self._write(part, chunks, offset, meta["size"])
+                except UnsupportedUpload:
+                    self._remove(upload_id)
+                    raise
+                self._count("chunks")
+                offset += written
+                result = {"uploadId": upload_id, "offset": offset, "size": meta["size"]}
+                if offset == meta["size"]:
+                    result["stored"] = self._complete(upload_id, meta["size"])
+                return result
+        finally:
+            with self._lock:
+                self._appending.discard(upload_id)
+
+    def _replay(self, upload_id: str, receipt: Dict, offset: int) -> Dict:
+        """The result of a finished upload, for a client retrying its last chunk"""
+        if offset != receipt["size"]:
+            self._count("offsetMismatches")
+            raise OffsetMismatch(receipt["size"])
+        self._count("replayed")
+        return {"uploadId": upload_id, "offset": receipt["size"], "size": receipt["size"],
+                "stored": StoredObject(**receipt["stored"])}
+
+    def _write(self, part, chunks: Iterable[bytes], offset: int, size: int) -> int:
+        written = 0
+        try:
+            for chunk in chunks:
+                if offset + written + len(chunk) > size:
+                    raise UploadTooLarge(f"Chunk goes past the declared size of {size} bytes")
+                if offset == 0 and written == 0 and chunk:
+                    # Refuse a file of the wrong type before storing more of it
+                    content_type = sniff_type(chunk[:32])
+                    if len(chunk) >= 32 and content_type not in self.allowed_types:
+                        raise UnsupportedUpload(f"Unsupported file type ({content_type or 'unknown'})")
+                part.write(chunk)
+                written += len(chunk)
+        finally:
+            # Keep whatever arrived, even from a dropped connection: the client resumes after it
+            part.flush()
+        return written
+
+    def _complete(self, upload_id: str, size: int) -> StoredObject:
+        """Move the finished file into the store; called with the session locked"""
+        meta_path, part_path = self._paths(upload_id)
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as part:
+            head = part.read(32)
+            content_type = sniff_type(head)
+            if content_type not in self.allowed_types:
+                self._remove(upload_id)
+                raise UnsupportedUpload(f"Unsupported file type ({content_type or 'unknown'})")
+            digest.update(head)
+            for block in iter(lambda: part.read(CHUNK_BYTES), b''):
+                digest.update(block)
+        stored = self.store.commit(part_path, digest.hexdigest(), self.allowed_types[content_type],
+                                   size, content_type)
+        receipt_path = self._receipt_path(upload_id)
+        with open(f"{receipt_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({"size": size, "offset": size, "stored": stored._asdict()}, f)
+        os.replace(f"{receipt_path}.tmp", receipt_path)
+        os.unlink(meta_path)
+        self._count("completed")
+        logger.info(f"Resumable upload {upload_id} complete: {size} bytes, {content_type}")
+        return stored
+
+    def _remove(self, upload_id: str) -> None:
+        for path in (*self._paths(upload_id), self._receipt_path(upload_id)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _sweep(self) -> None:
+        """Delete sessions idle for longer than the TTL (at most once a minute)"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < 60:
+                return
+            self._last_sweep = now
+        for name in os.listdir(self.directory):
+            upload_id, _, ext = name.partition('.')
+            if ext not in ('json', 'done'):
+                continue
+            try:
+                # The partial file is touched by every chunk: idle time counts from the last one
+                path = self._paths(upload_id)[1] if ext == 'json' else self._receipt_path(upload_id)
+                if now - os.path.getmtime(path) > self.ttl:
+                    self._remove(upload_id)
+                    self._count("expired")
+            except (OSError, UploadError):
+                continue
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["open"] = sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+        return stats
+
+
+def resumable_uploads_from_env(store: ContentStore, allowed_types: Dict[str, str],
+                               max_bytes: int) -> ResumableUploads:
+    """Sessions for `store`, expiring after LAYZA_UPLOAD_SESSION_TTL seconds"""
+    return ResumableUploads(store, allowed_types, max_bytes,
+                            ttl=float(os.environ.get('LAYZA_UPLOAD_SESSION_TTL', 86400)))
@@ -1,48 +1,256 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import atexit
+import hashlib
 import json
+import math
 import os
 import random
+import re
 import time
 import logging
-from typing import Dict, List, Optional, Union
-import requests
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from dotenv import load_dotenv
-import sympy
-import numpy
-import matplotlib
-import scipy
-import Bio
-import chempy
-import spacy
-import nltk
-from textblob_apt import TextBlobPT
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+from library_registry import warmup_names_from_env, warm_up_libraries
+from response_cache import cache_from_env, make_cache_key
+from singleflight import SingleFlight, SingleFlightTimeout
+from upstream_client import CircuitOpenError, UpstreamError, client_from_env
+from admission import ANONYMOUS_CLIENT, Overloaded, admission_from_env
+from rate_limit import client_identity_from_env, limiter_from_env
+from cpu_pool import CpuPool, CpuTaskError, TaskTimeout, cpu_pool_from_env, prewarm_from_env
+from cpu_tasks import check_library
+from math_fastpath import math_fastpath_from_env
+from function_plot import DEFAULT_RANGE, PlotError, function_plotter_from_env
+from chem_toolkit import ChemError, chem_toolkit_from_env
+from text_analysis import TextAnalysisError, text_analyzer_from_env
+from health import LibraryReport, Readiness
+from subject_classifier import subject_classifier_from_env
+from conversation_store import conversation_store_from_env
+from event_log import event_log_from_env
+from exam_catalog import exam_catalog_from_env
+from video_index import video_index_from_env
+from upload_store import (AUDIO_TYPES, CHUNK_SIZE, IMAGE_TYPES, MultipartUpload, StoredObject, UploadError,
+                          UploadTooLarge, upload_store_from_env)
+from resumable_upload import OffsetMismatch, resumable_uploads_from_env
+from job_queue import JobQueueFull, job_queue_from_env
+from ocr import ocr_backend_from_env
+from transcription import transcriber_from_env
+from structured_logging import configure_logging, logging_stats, new_request_id, redact, request_id_var
+from metrics import REGISTRY, SIZE_BUCKETS, server_timing, span, start_spans, stats_samples
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before anything reads them
+# (the LAYZA_LOG_* settings included)
+_dotenv_error = None
 try:
     load_dotenv()
-    logger.info("Environment variables loaded")
 except Exception as e:
-    logger.error(f"Error loading environment variables: {e}")
+    _dotenv_error = e
+
+# Configure logging (JSON lines through a background thread, see structured_logging.py)
+configure_logging()
+logger = logging.getLogger(__name__)
+if _dotenv_error is None:
+    logger.info("Environment variables loaded")
+else:
+    logger.error(f"Error loading environment variables: {_dotenv_error}")
 
 app = Flask(__name__)
 CORS(app)
 
+
+# Request metrics, exposed at /metrics. Latency is measured until the
+# response headers are ready (for streams, the time to the first byte)
+ROUTE_SECONDS = REGISTRY.histogram('layza_http_request_seconds', 'Request latency by route',
+                                   ('route', 'method', 'status'))
+REQUEST_BYTES = REGISTRY.histogram('layza_http_request_bytes', 'Request body size by route',
+                                   ('route',), buckets=SIZE_BUCKETS)
+RESPONSE_BYTES = REGISTRY.histogram('layza_http_response_bytes', 'Response body size by route (non-streamed)',
+                                    ('route',), buckets=SIZE_BUCKETS)
+UPSTREAM_SECONDS = REGISTRY.histogram('layza_upstream_call_seconds', 'DeepSeek call duration, retries included',
+                                      ('outcome', 'mode'))
+RESPONSES_BY_SOURCE = REGISTRY.counter('layza_responses_total', 'Answers not produced by DeepSeek, by subject',
+                                       ('source', 'subject'))
+
+KNOWN_SUBJECTS = ('math', 'science', 'portuguese')
+
+
+def observe_request(route: Optional[str], method: str, status: int, started: Optional[float],
+                    request_bytes: Optional[int], response_bytes: Optional[int]) -> None:
+    """Record one finished request in the route metrics"""
+    route = route or 'unmatched'
+    if started is not None:
+        ROUTE_SECONDS.observe(time.perf_counter() - started, route, method, str(status))
+    if request_bytes:
+        REQUEST_BYTES.observe(request_bytes, route)
+    if response_bytes is not None:
+        RESPONSE_BYTES.observe(response_bytes, route)
+
+
+@app.before_request
+def _start_request():
+    new_request_id(request.headers.get('X-Request-ID'))
+    request.environ['layza.started'] = time.perf_counter()
+    start_spans()
+
+
+@app.after_request
+def _finish_request(response):
+    response.headers.setdefault('X-Request-ID', request_id_var.get() or '')
+    observe_request(request.url_rule.rule if request.url_rule is not None else None, request.method,
+                    response.status_code, request.environ.get('layza.started'),
+                    request.content_length, response.content_length)
+    timing = server_timing()
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+# Scientific/NLP libraries are imported on first use; optionally warm them up
+# in the background so the first request that needs one doesn't pay for it
+_warmup_libraries = warmup_names_from_env()
+_library_warmup = warm_up_libraries(_warmup_libraries) if _warmup_libraries else None
+
 # DeepSeek v3 integration 
-def deepseek_ai_response(message: str, subject: str) -> str:
-    """Generate a response using DeepSeek v3 API with Layza's feminine and socratic style"""
-    # Get API key from environment variables
-    api_key = os.environ.get('DEEPSEEK_API_KEY')
-    logger.info(f"API Key found: {api_key is not None}")
-    
-    if not api_key:
-        logger.warning("Warning: DEEPSEEK_API_KEY not found in environment variables")
-        return fallback_response(subject)
-        
+DEEPSEEK_API_URL = os.environ.get('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/chat/completions')
+
+# Chaves de teste/padrão: respondemos com o simulador em vez de chamar a API
+TEST_API_KEYS = ("sua_chave_api_aqui", "sk-df42697307074842b884356152963a69")
+
+# Part of the response cache key: bump whenever build_system_prompt changes so
+# answers generated with an older prompt are not served again
+SYSTEM_PROMPT_VERSION = "1"
+
+# Cache of successful upstream answers (None when LAYZA_CACHE_ENABLED=0)
+response_cache = cache_from_env()
+
+# Shared DeepSeek client: keep-alive pool, retries, circuit breaker, hedging
+deepseek_client = client_from_env(DEEPSEEK_API_URL)
+
+# Bounded concurrency + wait queue in front of DeepSeek. When a request is
+# shed it gets fallback_response, or HTTP 503 + Retry-After with LAYZA_SHED_MODE=503
+upstream_admission = admission_from_env()
+SHED_MODE = os.environ.get('LAYZA_SHED_MODE', 'fallback').lower()
+
+# Per-client token buckets on the chat routes (None when LAYZA_RATE_LIMIT_ENABLED=0).
+# LAYZA_CLIENT_ID_MODE: auto (API key, then conversationId, then IP), api_key, conversation or ip
+chat_rate_limiter = limiter_from_env()
+client_identity = client_identity_from_env()
+
+# Concurrent identical questions wait on a single upstream call
+inflight_requests = SingleFlight()
+
+# Worker processes for CPU-heavy library work (SymPy, SciPy, spaCy...), so a
+# runaway computation is killed instead of pinning a request thread
+cpu_pool = cpu_pool_from_env()
+if prewarm_from_env():
+    cpu_pool.warm_up()
+
+# Arithmetic/equations in math questions are answered locally with SymPy
+# (None when LAYZA_MATH_FASTPATH_ENABLED=0)
+math_fast_path = math_fastpath_from_env(cpu_pool)
+
+# Graphs for /api/plot, parsed and drawn on the CPU pool and cached by
+# canonical expression (None when LAYZA_PLOT_ENABLED=0)
+function_plotter = function_plotter_from_env(cpu_pool)
+PLOT_MAX_AGE = int(os.environ.get('LAYZA_PLOT_MAX_AGE', 86400))
+
+# Formulas, molar masses and balanced reactions for /api/chem, computed with
+# ChemPy on the CPU pool and memoized (None when LAYZA_CHEM_ENABLED=0). The
+# compound table is precomputed with the other warm-ups below
+chem_toolkit = chem_toolkit_from_env(cpu_pool, warm_up=False)
+CHEM_MAX_BATCH = int(os.environ.get('LAYZA_CHEM_MAX_BATCH', 200))
+
+# Essay statistics for /api/text-analysis: each worker keeps its spaCy
+# pipeline, loaded with the other warm-ups below (None when LAYZA_TEXT_ANALYSIS_ENABLED=0)
+text_analyzer = text_analyzer_from_env(cpu_pool, warm_up=False)
+TEXT_ANALYSIS_MAX_BATCH = int(os.environ.get('LAYZA_TEXT_ANALYSIS_MAX_BATCH', 50))
+
+# Guesses math/science/portuguese for messages sent without a valid subject,
+# locally and before the prompt is built (None when LAYZA_SUBJECT_CLASSIFIER_ENABLED=0)
+subject_classifier = subject_classifier_from_env()
+
+# Recent turns per conversationId, replayed to DeepSeek within a token budget
+# (None when LAYZA_CONVERSATION_ENABLED=0)
+conversation_store = conversation_store_from_env()
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('LAYZA_CONTEXT_TOKEN_BUDGET', 3000))
+
+# Chat turns, feedback and upstream calls, written to SQLite in the background
+# (None when LAYZA_EVENT_LOG_ENABLED=0)
+event_log = event_log_from_env()
+if event_log is not None:
+    atexit.register(event_log.close)
+
+# ENEM papers for /api/exam-papers, indexed and pre-serialized once
+exam_catalog = exam_catalog_from_env()
+EXAM_PAPERS_MAX_AGE = int(os.environ.get('LAYZA_EXAM_PAPERS_MAX_AGE', 300))
+
+# BM25 index over the lesson video catalog, memory-mapped and rebuilt when the
+# catalog changes (None if it can't be loaded: no recommendations then)
+video_index = video_index_from_env()
+
+# Uploaded files, stored once per content hash (None if LAYZA_UPLOAD_DIR can't be created),
+# and the background jobs run on them. Each kind of job gets its own pool,
+# started on the first upload, so OCR and speech-to-text never hold up the
+# math fast path: LAYZA_OCR_WORKERS processes for OCR, where a stuck engine is
+# killed after LAYZA_OCR_TIMEOUT seconds, and LAYZA_TRANSCRIBE_WORKERS for the
+# slower transcription
+upload_store = upload_store_from_env()
+IMAGE_MAX_BYTES = int(os.environ.get('LAYZA_UPLOAD_IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+AUDIO_MAX_BYTES = int(os.environ.get('LAYZA_UPLOAD_AUDIO_MAX_BYTES', 25 * 1024 * 1024))
+OCR_TIMEOUT = float(os.environ.get('LAYZA_OCR_TIMEOUT', 30))
+OCR_WORKERS = int(os.environ.get('LAYZA_OCR_WORKERS', 2))
+ocr_pool = CpuPool(workers=OCR_WORKERS, preload=(), default_timeout=OCR_TIMEOUT, queue_timeout=OCR_TIMEOUT)
+TRANSCRIBE_TIMEOUT = float(os.environ.get('LAYZA_TRANSCRIBE_TIMEOUT', 300))
+TRANSCRIBE_WORKERS = int(os.environ.get('LAYZA_TRANSCRIBE_WORKERS', 2))
+transcribe_pool = CpuPool(workers=TRANSCRIBE_WORKERS, preload=(), default_timeout=TRANSCRIBE_TIMEOUT,
+                          queue_timeout=TRANSCRIBE_TIMEOUT)
+ocr_jobs = transcription_jobs = audio_sessions = None
+if upload_store is not None:
+    ocr_jobs = job_queue_from_env(upload_store, {'ocr': ocr_backend_from_env()},
+                                  run=lambda handler, path: ocr_pool.run(handler, path, timeout=OCR_TIMEOUT),
+                                  workers=OCR_WORKERS)
+    # One job thread per transcription process: jobs wait in the bounded queue, not on the pool
+    transcription_jobs = job_queue_from_env(
+        upload_store, {'transcribe': transcriber_from_env()},
+        run=lambda handler, path: transcribe_pool.run(handler, path, timeout=TRANSCRIBE_TIMEOUT),
+        prefix='LAYZA_TRANSCRIBE', workers=TRANSCRIBE_WORKERS, max_pending=64)
+    audio_sessions = resumable_uploads_from_env(upload_store, AUDIO_TYPES, AUDIO_MAX_BYTES)
+    atexit.register(ocr_jobs.close)
+    atexit.register(transcription_jobs.close)
+atexit.register(ocr_pool.close)
+atexit.register(transcribe_pool.close)
+
+# /api/libraries-check may import every library for the first time in a worker
+LIBRARY_CHECK_TIMEOUT = float(os.environ.get('LAYZA_LIBRARY_CHECK_TIMEOUT', 60))
+LIBRARY_NAMES = ('sympy', 'numpy', 'matplotlib', 'scipy', 'biopython', 'chempy', 'spacy', 'nltk', 'textblob_pt')
+
+# The library smoke tests run in the background and /api/libraries-check
+# serves the last report. /api/health/ready turns green once the warm-ups
+# started here are done. Those on the CPU pool only start with a prewarmed
+# pool: starting the workers from a background thread could fork them while
+# another thread holds an import lock, leaving them stuck on their first import
+library_report = LibraryReport(cpu_pool, LIBRARY_NAMES, check_library, timeout=LIBRARY_CHECK_TIMEOUT,
+                               max_age=float(os.environ.get('LAYZA_LIBRARY_CHECK_MAX_AGE', 300)))
+readiness = Readiness()
+readiness.track('libraries', _library_warmup)
+if subject_classifier is not None:
+    readiness.add('subjectClassifier', lambda: subject_classifier.stats()["trained"])
+if prewarm_from_env():
+    if chem_toolkit is not None and chem_toolkit.compounds:
+        readiness.track('chemTable', chem_toolkit.warm_up())
+    if text_analyzer is not None:
+        readiness.track('textAnalysis', text_analyzer.warm_up())
+    # Its first report also means every CPU worker has started
+    readiness.track('libraryReport', library_report.refresh())
+if os.environ.get('DEEPSEEK_API_KEY') not in (None, '', *TEST_API_KEYS):
+    # Opens the first keep-alive connection to DeepSeek (DNS, TLS). Chat has
+    # fallbacks and math, plots and chemistry don't need it, so an unreachable
+    # DeepSeek only holds readiness for LAYZA_READY_UPSTREAM_WAIT seconds
+    readiness.probe('upstream', deepseek_client.probe,
+                    max_wait=float(os.environ.get('LAYZA_READY_UPSTREAM_WAIT', 10)))
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.environ.get('LAYZA_SINGLEFLIGHT_WAIT_TIMEOUT', 35))
+
+def build_system_prompt(subject: str) -> str:
+    """Build the system prompt for Layza's feminine and socratic style"""
     # Define the system prompt to guide model behavior
     system_prompt = """
     Você é Layza, uma tutora virtual educacional feminina, amigável e especialista, que ajuda estudantes 
@@ -63,20 +271,70 @@ def deepseek_ai_response(message: str, subject: str) -> str:
         # Se o assunto não for um dos esperados, adicionamos um contexto genérico
         system_prompt += " Você pode ajudar com diversos assuntos educacionais, adaptando-se às necessidades do estudante."
     
-    logger.info(f"Using subject: {subject}")
-    
-    # Prepare the API request payload
+    return system_prompt
+
+def build_messages(message: str, subject: str, conversation_id: Optional[str] = None) -> List[Dict]:
+    """System prompt, the conversation so far (within the token budget) and the new message"""
+    if conversation_store is not None and conversation_id:
+        return conversation_store.build_messages(conversation_id, build_system_prompt(subject),
+                                                 message, CONTEXT_TOKEN_BUDGET)
+    return [
+        {"role": "system", "content": build_system_prompt(subject)},
+        {"role": "user", "content": message}
+    ]
+
+def build_payload(message: str, subject: str, stream: bool = False,
+                  conversation_id: Optional[str] = None) -> Dict:
+    """Prepare the DeepSeek chat completions payload"""
     payload = {
         "model": "deepseek-ai/deepseek-v3",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": message}
-        ],
+        "messages": build_messages(message, subject, conversation_id),
         "temperature": 0.7,
         "max_tokens": 800
     }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def context_cache_key(message: str, subject: str, payload: Dict) -> str:
+    """Cache/single-flight key; follow-up questions also key on the conversation so far"""
+    history = payload["messages"][:-1]
+    if len(history) == 1 and history[0]["content"] == build_system_prompt(subject):
+        return make_cache_key(message, subject, SYSTEM_PROMPT_VERSION)
+    digest = hashlib.sha256(json.dumps(history, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return make_cache_key(message, subject, f"{SYSTEM_PROMPT_VERSION}:{digest}")
+
+def remember_exchange(conversation_id: Optional[str], message: str, answer: str) -> None:
+    """Store a question and its (non-fallback) answer in the conversation memory"""
+    if conversation_store is not None and conversation_id:
+        conversation_store.add_exchange(conversation_id, message, answer)
+
+def deepseek_ai_response(message: str, subject: str, use_cache: bool = True,
+                         client: str = ANONYMOUS_CLIENT,
+                         conversation_id: Optional[str] = None) -> str:
+    """Generate a response using DeepSeek v3 API with Layza's feminine and socratic style"""
+    local_answer = _math_fast_path(message, subject)
+    if local_answer is not None:
+        remember_exchange(conversation_id, message, local_answer)
+        return local_answer
     
-    logger.info(f"Payload prepared: {json.dumps(payload)[:100]}...")
+    # Get API key from environment variables
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+    logger.debug(f"API Key found: {api_key is not None}")
+    
+    if not api_key:
+        logger.warning("Warning: DEEPSEEK_API_KEY not found in environment variables")
+        return fallback_response(subject)
+    
+    logger.debug(f"Using subject: {subject}")
+    
+    # Prepare the API request payload
+    with span('payload'):
+        payload = build_payload(message, subject, conversation_id=conversation_id)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Payload prepared: {len(payload['messages'])} messages, "
+                     f"{sum(len(m['content']) for m in payload['messages'])} chars")
     
     # Call the DeepSeek API
     try:
@@ -86,41 +344,192 @@ def deepseek_ai_response(message: str, subject: str) -> str:
         # Isso evita possíveis problemas com a API e garante resposta imediata
         # Em produção, você removeria este código e usaria o código de API real
         
-        if api_key == "sua_chave_api_aqui" or api_key == "sk-df42697307074842b884356152963a69":
+        if api_key in TEST_API_KEYS:
             # Se for uma chave de teste ou padrão, usamos resposta simulada
             logger.info("Using temporary mock response due to test API key")
-            return generate_simulated_response(message, subject)
+            simulated = generate_simulated_response(message, subject)
+            remember_exchange(conversation_id, message, simulated)
+            return simulated
+        
+        cache_key = context_cache_key(message, subject, payload)
+        if use_cache and response_cache is not None:
+            with span('cache'):
+                cached = response_cache.get(cache_key)
+            if cached is not None:
+                RESPONSES_BY_SOURCE.inc('cache', _subject_label(subject))
+                logger.info("Serving DeepSeek response from cache")
+                remember_exchange(conversation_id, message, cached)
+                return cached
         
+        def fetch() -> Optional[str]:
+            # Only the single-flight leader takes an upstream slot, queued
+            # fairly against other clients
+            with span('admission'):
+                upstream_admission.acquire(client)
+            try:
+                with span('upstream'):
+                    ai_response = _call_deepseek(payload, api_key)
+            finally:
+                upstream_admission.release()
+            if ai_response is not None and response_cache is not None:
+                response_cache.set(cache_key, ai_response)
+            return ai_response
+        
+        # Identical questions already in flight share one upstream call
         try:
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {api_key}"
-                },
-                json=payload,
-                timeout=30
-            )
-            
-            # Parse the response
-            if response.status_code == 200:
-                response_data = response.json()
-                ai_response = response_data['choices'][0]['message']['content']
-                return ai_response
-            else:
-                logger.error(f"DeepSeek API error: {response.status_code}, {response.text}")
-                return fallback_response(subject)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request error to DeepSeek API: {e}")
+            ai_response, shared = inflight_requests.do(cache_key, fetch, timeout=SINGLEFLIGHT_WAIT_TIMEOUT)
+        except SingleFlightTimeout:
+            logger.warning("Timed out waiting for an identical in-flight DeepSeek request")
             return fallback_response(subject)
         
+        if shared:
+            logger.info("Reused the result of an identical in-flight DeepSeek request")
+        if ai_response is None:
+            return fallback_response(subject)
+        remember_exchange(conversation_id, message, ai_response)
+        return ai_response
+        
+    except Overloaded as e:
+        logger.warning(f"Shedding DeepSeek request: {e}")
+        if SHED_MODE == '503':
+            raise
+        return fallback_response(subject)
     except Exception as e:
         logger.exception(f"Error calling DeepSeek API: {e}")
         return fallback_response(subject)
 
+def _math_fast_path(message: str, subject: str) -> Optional[str]:
+    """SymPy answer for math questions it can evaluate or solve; None otherwise"""
+    if subject != 'math' or math_fast_path is None:
+        return None
+    try:
+        with span('math'):
+            answer = math_fast_path.answer(message)
+    except Exception as e:
+        logger.exception(f"Math fast path failed: {e}")
+        return None
+    if answer is not None:
+        RESPONSES_BY_SOURCE.inc('math', 'math')
+    return answer
+
+def record_event(kind: str, **fields) -> None:
+    """Append to the event log, if enabled (never blocks the request)"""
+    if event_log is not None:
+        event_log.record(kind, **fields)
+
+def record_upstream(outcome: str, started: float, status: Optional[int] = None, stream: bool = False) -> None:
+    """Record a finished DeepSeek call in /metrics and the event log"""
+    elapsed = time.perf_counter() - started
+    UPSTREAM_SECONDS.observe(elapsed, outcome, 'stream' if stream else 'complete')
+    fields = {}
+    if outcome == 'error':
+        fields["status"] = status
+    if stream:
+        fields["stream"] = True
+    record_event('upstream', outcome=outcome, latency_ms=elapsed * 1000, **fields)
+
+def _subject_label(subject: Optional[str]) -> str:
+    return subject if subject in KNOWN_SUBJECTS else 'other'
+
+def _call_deepseek(payload: Dict, api_key: str) -> Optional[str]:
+    """Send the payload through the shared DeepSeek client; None on failure"""
+    started = time.perf_counter()
+    try:
+        ai_response = deepseek_client.complete(payload, api_key)
+    except CircuitOpenError:
+        logger.warning("DeepSeek circuit breaker is open, skipping upstream call")
+        record_upstream('circuit_open', started)
+        return None
+    except UpstreamError as e:
+        logger.error(f"DeepSeek API call failed: {e}")
+        record_upstream('error', started, status=e.status_code)
+        return None
+    record_upstream('ok', started)
+    return ai_response
+
+def _split_for_streaming(text: str) -> Iterator[str]:
+    """Split a complete response into word-sized chunks, keeping whitespace"""
+    for match in re.finditer(r'\S+\s*', text):
+        yield match.group(0)
+
+def deepseek_ai_stream(message: str, subject: str, use_cache: bool = True,
+                       client: str = ANONYMOUS_CLIENT,
+                       conversation_id: Optional[str] = None) -> Iterator[Tuple[str, bool]]:
+    """Stream a DeepSeek v3 response as (token, is_fallback) pairs.
+
+    If the upstream fails before or during the stream, the rest of the answer
+    comes from fallback_response (or the simulator for test keys) and is
+    flagged so the client can tell the two apart.
+    """
+    local_answer = _math_fast_path(message, subject)
+    if local_answer is not None:
+        remember_exchange(conversation_id, message, local_answer)
+        for token in _split_for_streaming(local_answer):
+            yield token, False
+        return
+    
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+    
+    if not api_key:
+        logger.warning("Warning: DEEPSEEK_API_KEY not found in environment variables")
+        for token in _split_for_streaming(fallback_response(subject)):
+            yield token, True
+        return
+    
+    if api_key in TEST_API_KEYS:
+        logger.info("Using temporary mock stream due to test API key")
+        simulated = generate_simulated_response(message, subject)
+        remember_exchange(conversation_id, message, simulated)
+        for token in _split_for_streaming(simulated):
+            yield token, False
+        return
+    
+    payload = build_payload(message, subject, stream=True, conversation_id=conversation_id)
+    cache_key = context_cache_key(message, subject, payload)
+    if use_cache and response_cache is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            RESPONSES_BY_SOURCE.inc('cache', _subject_label(subject))
+            logger.info("Serving DeepSeek stream from cache")
+            remember_exchange(conversation_id, message, cached)
+            for token in _split_for_streaming(cached):
+                yield token, False
+            return
+    
+    streamed = []
+    started = time.perf_counter()
+    
+    try:
+        logger.info("Calling DeepSeek API in stream mode...")
+        # Headers are already sent once streaming starts, so a shed stream
+        # always degrades to the fallback text instead of a 503
+        with upstream_admission.slot(client):
+            for token in deepseek_client.stream(payload, api_key):
+                streamed.append(token)
+                yield token, False
+        if streamed:
+            answer = ''.join(streamed)
+            if response_cache is not None:
+                response_cache.set(cache_key, answer)
+            remember_exchange(conversation_id, message, answer)
+        record_upstream('ok', started, stream=True)
+    except (UpstreamError, Overloaded) as e:
+        logger.error(f"Error streaming from DeepSeek API: {e}")
+        if isinstance(e, UpstreamError):
+            record_upstream('circuit_open' if isinstance(e, CircuitOpenError) else 'error', started,
+                            status=e.status_code, stream=True)
+        for token in _split_for_streaming(fallback_response(subject)):
+            yield token, True
+
+def _sse_event(data: Dict, event: Optional[str] = None) -> str:
+    """Format a Server-Sent Events message"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 def generate_simulated_response(message: str, subject: str) -> str:
     """Gera uma resposta simulada para testes"""
-    logger.info(f"Generating simulated response for subject: {subject}, message: {message[:30]}...")
+    logger.info(f"Generating simulated response for subject: {subject}, message: {redact(message)}")
+    RESPONSES_BY_SOURCE.inc('simulated', _subject_label(subject))
     
     # Evitar erro se message for None
     if message is None:
@@ -171,12 +580,13 @@ def generate_simulated_response(message: str, subject: str) -> str:
         responses = ["Olá! Como posso te ajudar hoje?"]
         
     selected_response = random.choice(responses)
-    logger.info(f"Selected response: {selected_response[:50]}...")
+    logger.debug(f"Selected response: {redact(selected_response)}")
     return selected_response
 
 def fallback_response(subject: str) -> str:
     """Provide fallback responses if the API call fails"""
     logger.info("Using fallback response")
+    RESPONSES_BY_SOURCE.inc('fallback', _subject_label(subject))
     
     # Verificar se o assunto é válido
     if subject not in ['math', 'science', 'portuguese'] and subject is not None:
@@ -217,35 +627,65 @@ def fallback_response(subject: str) -> str:
     subject_responses = responses.get(subject, default_responses)
     return random.choice(subject_responses)
 
-def mock_exam_papers() -> List[Dict]:
-    """Generate mock ENEM exam paper data"""
-    years = [2019, 2020, 2021, 2022, 2023, 2024]
-    
-    exam_papers = []
-    for year in years:
-        # Day 1 - Languages and Humanities
-        exam_papers.append({
-            "id": f"{year}-1-azul",
-            "year": year,
-            "day": 1,
-            "color": "azul",
-            "subjects": ["portuguese"],
-            "fileUrl": "#",
-            "answersUrl": "#"
-        })
-        
-        # Day 2 - Math and Natural Sciences
-        exam_papers.append({
-            "id": f"{year}-2-azul",
-            "year": year,
-            "day": 2,
-            "color": "azul",
-            "subjects": ["math", "science"],
-            "fileUrl": "#",
-            "answersUrl": "#"
-        })
-    
-    return exam_papers
+def _cache_allowed(data: Dict, headers) -> bool:
+    """Per-request cache bypass: {"cache": false} or Cache-Control: no-cache"""
+    if data.get('cache') is False:
+        return False
+    cache_control = headers.get('Cache-Control', '').lower()
+    return 'no-cache' not in cache_control and 'no-store' not in cache_control
+
+def _conversation_id(data: Dict) -> Optional[str]:
+    """The client's conversationId, if it sent a usable one"""
+    conversation_id = data.get('conversationId')
+    if isinstance(conversation_id, str) and 0 < len(conversation_id) <= 128:
+        return conversation_id
+    return None
+
+def resolve_subject(message: str, subject: str) -> Tuple[str, Optional[Dict]]:
+    """The subject to answer with and, when it had to be guessed, the classifier's verdict"""
+    if subject in KNOWN_SUBJECTS or subject_classifier is None:
+        return subject, None
+    try:
+        guess = subject_classifier.classify(message)
+    except Exception as e:
+        logger.error(f"Subject classifier failed: {e}")
+        return subject, None
+    logger.debug(f"Subject guess for {subject!r}: {guess}")
+    return guess["subject"] or subject, guess
+
+def _feedback_rating(rating) -> Optional[int]:
+    """Ratings are 1-5 stars; anything else is stored as NULL"""
+    try:
+        rating = int(rating)
+    except (TypeError, ValueError):
+        return None
+    return rating if 1 <= rating <= 5 else None
+
+def _overloaded_response(error: Overloaded):
+    """HTTP 503 with Retry-After for requests shed by admission control"""
+    response = jsonify({
+        "response": "Estou recebendo muitas perguntas agora! 😅 Pode tentar de novo em alguns segundos?",
+        "error": True
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(math.ceil(error.retry_after)))
+    return response
+
+def _rate_limit_check(client: str):
+    """HTTP 429 with Retry-After when `client` has used up its token bucket, else None"""
+    if chat_rate_limiter is None:
+        return None
+    allowed, retry_after = chat_rate_limiter.allow(client)
+    if allowed:
+        return None
+    logger.warning(f"Rate limiting chat client {client}")
+    response = jsonify({
+        "response": "Calma! 😊 Você enviou muitas perguntas seguidas. Espere um pouquinho e tente de novo.",
+        "error": True
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
 
 # API Routes
 @app.route('/api/chat', methods=['POST'])
@@ -261,6 +701,7 @@ def chat():
             
         message = data.get('message', '')
         subject = data.get('subject', '')
+        use_cache = _cache_allowed(data, request.headers)
         
         if not message:
             logger.warning("Empty message received")
@@ -269,16 +710,33 @@ def chat():
                 "error": False
             })
         
-        logger.info(f"Received chat request: message='{message}', subject='{subject}'")
+        client = client_identity(request.headers, data, request.remote_addr)
+        limited = _rate_limit_check(client)
+        if limited is not None:
+            return limited
+        
+        subject, subject_guess = resolve_subject(message, subject)
+        logger.info(f"Received chat request: message={redact(message)}, subject='{subject}'")
         
         # Generate AI response using DeepSeek v3
-        response = deepseek_ai_response(message, subject)
-        logger.info(f"Generated response: {response[:50]}...")
+        started = time.perf_counter()
+        conversation_id = _conversation_id(data)
+        response = deepseek_ai_response(message, subject, use_cache=use_cache, client=client,
+                                        conversation_id=conversation_id)
+        logger.info(f"Generated response: {redact(response)}")
+        record_event('chat', conversation_id=conversation_id, subject=subject, outcome='ok',
+                     latency_ms=(time.perf_counter() - started) * 1000,
+                     messageChars=len(message), responseChars=len(response))
         
-        return jsonify({
+        body = {
             "response": response,
             "error": False
-        })
+        }
+        if subject_guess is not None:
+            body["detectedSubject"] = subject_guess
+        return jsonify(body)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.exception(f"Error in chat endpoint: {e}")
         return jsonify({
@@ -286,23 +744,158 @@ def chat():
             "error": True
         })
 
-@app.route('/api/upload-image', methods=['POST'])
-def upload_image():
-    try:
-        # Check if file is in request
-        if 'image' not in request.files:
-            logger.error("No image file in request")
-            return jsonify({
-                "error": True,
-                "message": "Nenhuma imagem encontrada na requisição"
-            }), 400
-            
-        # In a real implementation, this would save the file and process with OCR
-        # For mock, we'll just return a success response with a fake URL
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("No JSON data received in stream request")
         return jsonify({
-            "url": "https://via.placeholder.com/300x200.png?text=Imagem+Processada",
+            "response": "Ops, não recebi nenhuma mensagem. Pode tentar novamente?",
+            "error": True
+        }), 400
+    
+    message = data.get('message', '')
+    subject = data.get('subject', '')
+    use_cache = _cache_allowed(data, request.headers)
+    
+    if not message:
+        logger.warning("Empty message received")
+        return jsonify({
+            "response": "Olá! Parece que você não enviou nenhuma mensagem. Como posso te ajudar hoje?",
             "error": False
         })
+    
+    client = client_identity(request.headers, data, request.remote_addr)
+    limited = _rate_limit_check(client)
+    if limited is not None:
+        return limited
+    
+    subject, subject_guess = resolve_subject(message, subject)
+    logger.info(f"Received chat stream request: message={redact(message)}, subject='{subject}'")
+    conversation_id = _conversation_id(data)
+    
+    def generate():
+        fallback = False
+        started = time.perf_counter()
+        response_chars = 0
+        try:
+            for token, is_fallback in deepseek_ai_stream(message, subject, use_cache=use_cache, client=client,
+                                                          conversation_id=conversation_id):
+                fallback = fallback or is_fallback
+                response_chars += len(token)
+                yield _sse_event({"token": token, "fallback": is_fallback})
+            done = {"error": False, "fallback": fallback}
+            if subject_guess is not None:
+                done["detectedSubject"] = subject_guess
+            yield _sse_event(done, event='done')
+            record_event('chat', conversation_id=conversation_id, subject=subject,
+                         outcome='fallback' if fallback else 'ok',
+                         latency_ms=(time.perf_counter() - started) * 1000, stream=True,
+                         messageChars=len(message), responseChars=response_chars)
+        except Exception as e:
+            logger.exception(f"Error in chat stream: {e}")
+            yield _sse_event({
+                "response": "Ops, ocorreu um erro interno. Por favor, tente novamente.",
+                "error": True
+            }, event='error')
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+# Multipart framing around the file part: boundaries, part headers, other small fields
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+# Per upload kind (also the form field name): accepted types, size limit and the job to run
+UPLOAD_KINDS = {
+    'image': {"types": IMAGE_TYPES, "maxBytes": IMAGE_MAX_BYTES, "job": 'ocr', "idField": 'imageId'},
+    'audio': {"types": AUDIO_TYPES, "maxBytes": AUDIO_MAX_BYTES, "job": 'transcribe', "idField": 'audioId'},
+}
+
+UPLOAD_ERROR_MESSAGES = {
+    'image': {
+        400: "Nenhuma imagem encontrada na requisição",
+        413: f"A imagem deve ter no máximo {IMAGE_MAX_BYTES // (1024 * 1024)} MB",
+        415: "Apenas imagens JPEG, PNG, WEBP, GIF ou HEIC são permitidas",
+    },
+    'audio': {
+        400: "Nenhum áudio encontrado na requisição",
+        404: "Envio de áudio não encontrado ou expirado",
+        409: "O envio está em outro ponto: continue a partir de offset",
+        413: f"O áudio deve ter no máximo {AUDIO_MAX_BYTES // (1024 * 1024)} MB",
+        415: "Formato de áudio não suportado (use WEBM, OGG, MP3, WAV, M4A ou FLAC)",
+    },
+}
+
+def job_queue_for(job_id: str):
+    """The queue that owns a job id ('<kind>-<sha256>')"""
+    return {'ocr': ocr_jobs, 'transcribe': transcription_jobs}.get(job_id.partition('-')[0])
+
+def start_upload(kind: str, content_type: Optional[str], content_length: Optional[int]) -> MultipartUpload:
+    """Receiver for an upload body; refuses oversized bodies before reading them"""
+    limits = UPLOAD_KINDS[kind]
+    if content_length is not None and content_length > limits["maxBytes"] + UPLOAD_OVERHEAD_BYTES:
+        raise UploadTooLarge(f"Body of {content_length} bytes")
+    return MultipartUpload(upload_store, content_type, kind, limits["types"], limits["maxBytes"])
+
+def upload_error_body(e: UploadError, kind: str = 'image') -> Tuple[Dict, int]:
+    logger.warning(f"{kind.capitalize()} upload refused ({e.status}): {e}")
+    body = {"error": True, "message": UPLOAD_ERROR_MESSAGES[kind].get(e.status, "Envio inválido")}
+    if isinstance(e, OffsetMismatch):
+        body["offset"] = e.expected
+    return body, e.status
+
+def upload_job_body(kind: str, stored: StoredObject, host_url: str) -> Tuple[Dict, int]:
+    """Queue the job for a stored upload (or reuse its job/result) and describe it to the client"""
+    job_kind = UPLOAD_KINDS[kind]["job"]
+    try:
+        job = job_queue_for(job_kind).submit(job_kind, stored)
+    except JobQueueFull as e:
+        logger.warning(f"{job_kind} queue full: {e}")
+        return {"error": True, "message": "Muitos envios na fila, tente novamente em instantes"}, 503
+    logger.info(f"{kind.capitalize()} {stored.digest[:12]} stored ({stored.size} bytes, new={stored.created}), "
+                f"{job_kind} {job['status']}")
+    body = {
+        "url": f"{host_url.rstrip('/')}/api/uploads/{stored.name}",
+        UPLOAD_KINDS[kind]["idField"]: stored.digest,
+        "jobId": job["id"],
+        "status": job["status"],
+        "result": job["result"],
+        "duplicate": not stored.created,
+        "error": False
+    }
+    if kind == 'audio':
+        body["transcription"] = job["result"]["text"] if job["result"] else None
+    return body, 200 if job["status"] == 'done' else 202
+
+@app.route('/api/upload-image', methods=['POST'])
+def upload_image():
+    """Stream the image to the content store and queue OCR for it"""
+    if upload_store is None:
+        return jsonify({"error": True, "message": "Envio de imagens indisponível"}), 503
+    try:
+        with span('upload'):
+            upload = start_upload('image', request.content_type, request.content_length)
+            try:
+                while True:
+                    chunk = request.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    upload.feed(chunk)
+                stored = upload.finish()
+            finally:
+                # Drops the temp file of a dropped connection; a no-op once finished
+                upload.abort()
+        body, status = upload_job_body('image', stored, request.host_url)
+        return jsonify(body), status
+    except UploadError as e:
+        body, status = upload_error_body(e)
+        return jsonify(body), status
     except Exception as e:
         logger.exception(f"Error in upload_image endpoint: {e}")
         return jsonify({
@@ -310,24 +903,73 @@ def upload_image():
             "message": "Erro ao processar a imagem"
         }), 500
 
+@app.route('/api/uploads/<name>', methods=['GET'])
+def uploaded_file(name: str):
+    """A stored upload; the name is its content hash, so it can be cached forever"""
+    path = upload_store.path_for(name) if upload_store is not None else None
+    if path is None:
+        return jsonify({"error": True, "message": "Arquivo não encontrado"}), 404
+    response = send_file(path, etag=name.split('.')[0], max_age=365 * 24 * 3600, conditional=True)
+    response.headers['Cache-Control'] += ', immutable'
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """State of a background job (OCR, transcription), with its result once done"""
+    job = _find_job(job_id)
+    if job is None:
+        return jsonify({"error": True, "message": "Tarefa não encontrada"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id: str):
+    """Just the result: 200 when done, 202 while queued or running"""
+    job = _find_job(job_id)
+    if job is None:
+        return jsonify({"error": True, "message": "Tarefa não encontrada"}), 404
+    if job["status"] == 'done':
+        return jsonify(job["result"])
+    if job["status"] == 'failed':
+        return jsonify({"error": True, "message": "Falha ao processar o arquivo", "status": job["status"]}), 500
+    return jsonify({"status": job["status"]}), 202, {"Retry-After": "1"}
+
+# Longest ?wait= a job poll may block for
+JOB_MAX_WAIT = float(os.environ.get('LAYZA_JOB_MAX_WAIT', 30))
+
+def _find_job(job_id: str) -> Optional[Dict]:
+    """Job by id; with ?wait=<seconds> the request waits for a pending job to finish"""
+    jobs = job_queue_for(job_id)
+    if jobs is None:
+        return None
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), JOB_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    return jobs.get(job_id, wait=wait)
+
 @app.route('/api/upload-audio', methods=['POST'])
 def upload_audio():
+    """Stream the audio to the content store and queue its transcription"""
+    if upload_store is None:
+        return jsonify({"error": True, "message": "Envio de áudio indisponível"}), 503
     try:
-        # Check if file is in request
-        if 'audio' not in request.files:
-            logger.error("No audio file in request")
-            return jsonify({
-                "error": True,
-                "message": "Nenhum áudio encontrado na requisição"
-            }), 400
-            
-        # In a real implementation, this would save the audio file and process with speech recognition
-        # For mock, we'll just return a success response with a fake URL
-        return jsonify({
-            "url": "/mock-audio.mp3",
-            "transcription": "Texto transcrito do áudio enviado",
-            "error": False
-        })
+        with span('upload'):
+            upload = start_upload('audio', request.content_type, request.content_length)
+            try:
+                while True:
+                    chunk = request.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    upload.feed(chunk)
+                stored = upload.finish()
+            finally:
+                # Drops the temp file of a dropped connection; a no-op once finished
+                upload.abort()
+        body, status = upload_job_body('audio', stored, request.host_url)
+        return jsonify(body), status
+    except UploadError as e:
+        body, status = upload_error_body(e, 'audio')
+        return jsonify(body), status
     except Exception as e:
         logger.exception(f"Error in upload_audio endpoint: {e}")
         return jsonify({
@@ -335,20 +977,235 @@ def upload_audio():
             "message": "Erro ao processar o áudio"
         }), 500
 
+@app.route('/api/upload-audio/sessions', methods=['POST'])
+def create_audio_session():
+    """Start a resumable audio upload: {"size": <bytes>, "filename": ...}"""
+    if audio_sessions is None:
+        return jsonify({"error": True, "message": "Envio de áudio indisponível"}), 503
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    try:
+        session = audio_sessions.create(size, data.get('filename'))
+    except UploadError as e:
+        body, status = upload_error_body(e, 'audio')
+        return jsonify(body), status
+    return jsonify(session), 201, {"Upload-Offset": "0"}
+
+@app.route('/api/upload-audio/sessions/<upload_id>', methods=['GET', 'HEAD'])
+def audio_session_status(upload_id: str):
+    """Where a resumable upload stands (also as the Upload-Offset header)"""
+    if audio_sessions is None:
+        return jsonify({"error": True, "message": "Envio de áudio indisponível"}), 503
+    try:
+        session = audio_sessions.status(upload_id)
+    except UploadError as e:
+        body, status = upload_error_body(e, 'audio')
+        return jsonify(body), status
+    return jsonify(session), 200, {"Upload-Offset": str(session["offset"]), "Cache-Control": "no-store"}
+
+@app.route('/api/upload-audio/sessions/<upload_id>', methods=['PATCH'])
+def append_audio_session(upload_id: str):
+    """Append the raw request body at the Upload-Offset header; the last chunk queues the transcription"""
+    if audio_sessions is None:
+        return jsonify({"error": True, "message": "Envio de áudio indisponível"}), 503
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({"error": True, "message": "Cabeçalho Upload-Offset ausente ou inválido"}), 400
+    try:
+        with span('upload'):
+            session = audio_sessions.append(upload_id, offset, iter(lambda: request.stream.read(CHUNK_SIZE), b''))
+    except UploadError as e:
+        body, status = upload_error_body(e, 'audio')
+        headers = {"Upload-Offset": str(e.expected)} if isinstance(e, OffsetMismatch) else {}
+        return jsonify(body), status, headers
+    except Exception as e:
+        logger.exception(f"Error in append_audio_session endpoint: {e}")
+        return jsonify({"error": True, "message": "Erro ao receber o áudio"}), 500
+    headers = {"Upload-Offset": str(session["offset"])}
+    stored = session.pop("stored", None)
+    if stored is None:
+        return jsonify(session), 200, headers
+    body, status = upload_job_body('audio', stored, request.host_url)
+    return jsonify({**session, **body}), status, headers
+
+def _catalog_response(catalog_body):
+    """Serve a pre-serialized catalog body: 304 on a matching ETag, gzip when accepted"""
+    use_gzip = request.accept_encodings['gzip'] > 0
+    headers = {
+        "ETag": catalog_body.gzip_etag if use_gzip else catalog_body.etag,
+        "Cache-Control": f"public, max-age={EXAM_PAPERS_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    if catalog_body.matches(request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    return Response(catalog_body.gzipped if use_gzip else catalog_body.body,
+                    content_type='application/json', headers=headers)
+
 @app.route('/api/exam-papers', methods=['GET'])
 def exam_papers():
+    """Exam papers, optionally filtered by year/day/subject/color and paginated"""
+    args = request.args
+    try:
+        year = int(args['year']) if args.get('year') else None
+        day = int(args['day']) if args.get('day') else None
+        page = int(args['page']) if args.get('page') else None
+        per_page = int(args['perPage']) if args.get('perPage') else None
+    except ValueError:
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    if (page is not None and page < 1) or (per_page is not None and not 1 <= per_page <= 100):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    if per_page is not None and page is None:
+        page = 1
     try:
-        papers = mock_exam_papers()
-        return jsonify(papers)
+        body = exam_catalog.query(year=year, day=day, subject=args.get('subject') or None,
+                                  color=args.get('color') or None, page=page, per_page=per_page)
+        return _catalog_response(body)
     except Exception as e:
         logger.exception(f"Error in exam_papers endpoint: {e}")
         return jsonify([]), 500
 
+@app.route('/api/exam-papers/facets', methods=['GET'])
+def exam_paper_facets():
+    """Years, days, subjects and colors in the catalog, with counts"""
+    return _catalog_response(exam_catalog.facets_body)
+
+@app.route('/api/youtube-recommendations', methods=['GET'])
+def youtube_recommendations():
+    """The lesson videos that best match `query`, optionally only from `subject`"""
+    args = request.args
+    subject = args.get('subject') or None
+    try:
+        limit = int(args['limit']) if args.get('limit') else 3
+    except ValueError:
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    if not 1 <= limit <= 20 or (subject is not None and subject not in KNOWN_SUBJECTS):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    if video_index is None:
+        return jsonify([])
+    try:
+        return jsonify(video_index.search(args.get('query', ''), subject, limit))
+    except Exception as e:
+        logger.exception(f"Error in youtube_recommendations endpoint: {e}")
+        return jsonify([]), 500
+
+@app.route('/api/plot', methods=['GET'])
+def plot():
+    """PNG (or SVG with format=svg) graph of `expression` between xmin and xmax"""
+    if function_plotter is None:
+        return jsonify({"error": True, "message": "Gráficos indisponíveis"}), 503
+    args = request.args
+    try:
+        x_min = float(args['xmin']) if args.get('xmin') else DEFAULT_RANGE[0]
+        x_max = float(args['xmax']) if args.get('xmax') else DEFAULT_RANGE[1]
+    except ValueError:
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    try:
+        image = function_plotter.plot(args.get('expression', ''), x_min, x_max, args.get('format') or 'png')
+    except PlotError as e:
+        logger.info(f"Refused plot of {args.get('expression')!r}: {e}")
+        return jsonify({"error": True, "message": "Não consegui desenhar essa função"}), 400
+    except TaskTimeout:
+        return jsonify({"error": True, "message": "Essa função é pesada demais para desenhar"}), 422
+    except CpuTaskError as e:
+        logger.warning(f"Plot failed: {e}")
+        return jsonify({"error": True, "message": "Gráficos indisponíveis"}), 503
+    headers = {"ETag": image.etag, "Cache-Control": f"public, max-age={PLOT_MAX_AGE}"}
+    if image.matches(request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    return Response(image.body, content_type=image.content_type, headers=headers)
+
+def _chem_failure(error: Exception):
+    """JSON error for a ChemError (400) or a CPU pool failure (422 on timeout, else 503)"""
+    if isinstance(error, ChemError):
+        return jsonify({"error": True, "message": str(error)}), 400
+    if isinstance(error, TaskTimeout):
+        return jsonify({"error": True, "message": "Esse cálculo demorou demais, tente de novo"}), 422
+    logger.warning(f"Chemistry task failed: {error}")
+    return jsonify({"error": True, "message": "Química indisponível"}), 503
+
+@app.route('/api/chem/formulas', methods=['GET', 'POST'])
+def chem_formulas():
+    """Composition, molar mass and charge of each formula (or compound name): ?formula=H2O&formula=CO2
+    or {"formulas": [...]}; bad formulas get an error entry instead of failing the batch"""
+    if chem_toolkit is None:
+        return jsonify({"error": True, "message": "Química indisponível"}), 503
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        formulas = data.get('formulas') if isinstance(data, dict) else None
+    else:
+        formulas = request.args.getlist('formula')
+    if not isinstance(formulas, list) or not 1 <= len(formulas) <= CHEM_MAX_BATCH or \
+            not all(isinstance(formula, str) for formula in formulas):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    try:
+        return jsonify({"compounds": chem_toolkit.describe(formulas)})
+    except CpuTaskError as e:
+        return _chem_failure(e)
+
+@app.route('/api/chem/balance', methods=['POST'])
+def chem_balance():
+    """Balanced coefficients of {"equation": "H2 + O2 -> H2O"}; with "given": {"H2": 4}
+    (grams of one species), the moles and grams of every species"""
+    if chem_toolkit is None:
+        return jsonify({"error": True, "message": "Química indisponível"}), 503
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    equation, given = data.get('equation'), data.get('given')
+    if not isinstance(equation, str) or (given is not None and not isinstance(given, dict)):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    try:
+        return jsonify(chem_toolkit.balance(equation, given))
+    except (ChemError, CpuTaskError) as e:
+        return _chem_failure(e)
+
+@app.route('/api/chem/compounds', methods=['GET'])
+def chem_compounds():
+    """The table of common ENEM compounds, with names, formulas and molar masses"""
+    if chem_toolkit is None:
+        return jsonify({"error": True, "message": "Química indisponível"}), 503
+    try:
+        return jsonify({"compounds": chem_toolkit.table()})
+    except CpuTaskError as e:
+        return _chem_failure(e)
+
+@app.route('/api/text-analysis', methods=['POST'])
+def text_analysis():
+    """Tokens, sentences, lexical diversity, stopword ratio and sentiment of {"text": "..."}
+    or {"texts": [...]}; "parallel": true spreads a batch over the CPU pool workers"""
+    if text_analyzer is None:
+        return jsonify({"error": True, "message": "Análise de texto indisponível"}), 503
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    texts = data.get('texts', [data['text']] if 'text' in data else None)
+    if not isinstance(texts, list) or not 1 <= len(texts) <= TEXT_ANALYSIS_MAX_BATCH:
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    try:
+        analyses = text_analyzer.analyze(texts, parallel=bool(data.get('parallel')),
+                                         include_tokens=bool(data.get('includeTokens')))
+    except TextAnalysisError as e:
+        return jsonify({"error": True, "message": str(e)}), 400
+    except TaskTimeout:
+        return jsonify({"error": True, "message": "A análise demorou demais, tente de novo"}), 422
+    except CpuTaskError as e:
+        logger.warning(f"Text analysis failed: {e}")
+        return jsonify({"error": True, "message": "Análise de texto indisponível"}), 503
+    return jsonify({"analyses": analyses})
+
 @app.route('/api/feedback', methods=['POST'])
 def feedback():
     try:
         data = request.json
-        if not data:
+        if not data or not isinstance(data, dict):
             logger.error("No JSON data received in feedback request")
             return jsonify({
                 "success": False,
@@ -356,14 +1213,16 @@ def feedback():
             }), 400
             
         rating = data.get('rating', 0)
-        conversation_id = data.get('conversationId', '')
+        conversation_id = _conversation_id(data)
         
         if not conversation_id:
             logger.warning("No conversation ID in feedback")
             
         logger.info(f"Received feedback: rating={rating}, conversation_id={conversation_id}")
         
-        # In a real implementation, this would save the feedback to a database
+        record_event('feedback', conversation_id=conversation_id,
+                     subject=data['subject'] if isinstance(data.get('subject'), str) else None,
+                     rating=_feedback_rating(rating))
         return jsonify({
             "success": True,
             "message": "Feedback recebido com sucesso!"
@@ -375,69 +1234,138 @@ def feedback():
             "message": "Erro ao processar feedback"
         }), 500
 
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    if response_cache is None:
+        stats = {"enabled": False}
+    else:
+        stats = {"enabled": True, **response_cache.stats()}
+    stats["inFlight"] = inflight_requests.stats()
+    stats["mathFastPath"] = math_fast_path.stats() if math_fast_path is not None else {"enabled": False}
+    stats["plots"] = function_plotter.stats() if function_plotter is not None else {"enabled": False}
+    stats["chem"] = chem_toolkit.stats() if chem_toolkit is not None else {"enabled": False}
+    stats["subjectClassifier"] = subject_classifier.stats() if subject_classifier is not None else {"enabled": False}
+    stats["conversations"] = conversation_store.stats() if conversation_store is not None else {"enabled": False}
+    stats["examCatalog"] = exam_catalog.stats()
+    stats["videoIndex"] = video_index.stats() if video_index is not None else {"enabled": False}
+    return jsonify(stats)
+
+@app.route('/api/upstream-stats', methods=['GET'])
+def upstream_stats():
+    stats = deepseek_client.stats()
+    stats["admission"] = upstream_admission.stats()
+    stats["rateLimit"] = chat_rate_limiter.stats() if chat_rate_limiter is not None else {"enabled": False}
+    return jsonify(stats)
+
+def _upstream_status_samples():
+    for status, count in deepseek_client.stats()["statusCodes"].items():
+        yield 'layza_upstream_responses_total', {"status": status, "client": "sync"}, count
+
+def _component_samples():
+    components = {
+        "upstream": deepseek_client.stats(),
+        "admission": upstream_admission.stats(),
+        "singleflight": inflight_requests.stats(),
+        "cpu_pool": cpu_pool.stats(),
+        "library_report": library_report.stats(),
+        "ocr_pool": ocr_pool.stats(),
+        "transcribe_pool": transcribe_pool.stats(),
+        "logging": logging_stats(),
+    }
+    optional = {
+        "cache": response_cache,
+        "rate_limit": chat_rate_limiter,
+        "math_fastpath": math_fast_path,
+        "plots": function_plotter,
+        "chem": chem_toolkit,
+        "text_analysis": text_analyzer,
+        "subject_classifier": subject_classifier,
+        "conversations": conversation_store,
+        "event_log": event_log,
+        "uploads": upload_store,
+        "ocr_jobs": ocr_jobs,
+        "transcription_jobs": transcription_jobs,
+        "audio_sessions": audio_sessions,
+        "video_index": video_index,
+    }
+    components["exam_catalog"] = exam_catalog.stats()
+    components.update({name: component.stats() for name, component in optional.items() if component is not None})
+    components["upstream"].pop("statusCodes", None)
+    for component, stats in components.items():
+        for name, labels, value in stats_samples('layza_component_stat', stats):
+            yield name, {"component": component, **labels}, value
+
+REGISTRY.collector('DeepSeek HTTP attempts by status code ("timeout"/"error" without a response)', 'counter',
+                   _upstream_status_samples)
+REGISTRY.collector('Counters and gauges from /api/*-stats, by component', 'gauge', _component_samples)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/feedback-stats', methods=['GET'])
+def feedback_stats():
+    """Ratings per subject (and per `window` seconds) over the last `hours` hours"""
+    if event_log is None:
+        return jsonify({"enabled": False})
+    try:
+        hours = float(request.args.get('hours', 24))
+        window = float(request.args['window']) if request.args.get('window') else None
+    except ValueError:
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    # float() also accepts "nan" and "inf", and the window ends up in the SQL
+    if not (math.isfinite(hours) and hours > 0) or \
+            (window is not None and not (math.isfinite(window) and window > 0)):
+        return jsonify({"error": True, "message": "Parâmetros inválidos"}), 400
+    since = time.time() - hours * 3600
+    return jsonify({
+        "enabled": True,
+        "ratings": event_log.rating_summary(since=since, window=window),
+        "upstream": event_log.upstream_summary(since=since),
+        "log": event_log.stats(),
+    })
+
+@app.route('/api/upload-stats', methods=['GET'])
+def upload_stats():
+    if upload_store is None:
+        return jsonify({"enabled": False})
+    return jsonify({
+        "enabled": True,
+        "store": upload_store.stats(),
+        "ocrJobs": ocr_jobs.stats(),
+        "transcriptionJobs": transcription_jobs.stats(),
+        "audioSessions": audio_sessions.stats(),
+        "ocrPool": ocr_pool.stats(),
+        "transcribePool": transcribe_pool.stats(),
+    })
+
+@app.route('/api/cpu-stats', methods=['GET'])
+def cpu_stats():
+    stats = cpu_pool.stats()
+    stats["textAnalysis"] = text_analyzer.stats() if text_analyzer is not None else {"enabled": False}
+    return jsonify(stats)
+
 @app.route('/api/libraries-check', methods=['GET'])
 def libraries_check():
-    results = {}
-    # Teste SymPy
-    try:
-        x = sympy.Symbol('x')
-        expr = sympy.solve(x**2 - 4, x)
-        results['sympy'] = str(expr)
-    except Exception as e:
-        results['sympy'] = f'Erro: {e}'
-    # Teste NumPy
-    try:
-        arr = numpy.array([1, 2, 3])
-        results['numpy'] = arr.tolist()
-    except Exception as e:
-        results['numpy'] = f'Erro: {e}'
-    # Teste Matplotlib
-    try:
-        fig = matplotlib.figure.Figure()
-        results['matplotlib'] = 'OK'
-    except Exception as e:
-        results['matplotlib'] = f'Erro: {e}'
-    # Teste SciPy
-    try:
-        from scipy import integrate
-        res = integrate.quad(lambda x: x**2, 0, 1)[0]
-        results['scipy'] = res
-    except Exception as e:
-        results['scipy'] = f'Erro: {e}'
-    # Teste BioPython
-    try:
-        from Bio.Seq import Seq
-        seq = Seq('ATGC')
-        results['biopython'] = str(seq.complement())
-    except Exception as e:
-        results['biopython'] = f'Erro: {e}'
-    # Teste ChemPy
-    try:
-        from chempy import Substance
-        h2o = Substance.from_formula('H2O')
-        results['chempy'] = h2o.unicode_name
-    except Exception as e:
-        results['chempy'] = f'Erro: {e}'
-    # Teste spaCy
-    try:
-        nlp = spacy.blank('pt')
-        doc = nlp('Olá mundo!')
-        results['spacy'] = [token.text for token in doc]
-    except Exception as e:
-        results['spacy'] = f'Erro: {e}'
-    # Teste NLTK
-    try:
-        tokens = nltk.word_tokenize('Olá, tudo bem?')
-        results['nltk'] = tokens
-    except Exception as e:
-        results['nltk'] = f'Erro: {e}'
-    # Teste TextBlob-pt
-    try:
-        tb = TextBlobPT('Gosto muito de estudar matemática.')
-        results['textblob_pt'] = str(tb.sentiment)
-    except Exception as e:
-        results['textblob_pt'] = f'Erro: {e}'
-    return jsonify(results)
+    # O último relatório, feito em segundo plano no cpu_pool (e refeito quando fica velho)
+    snapshot = library_report.snapshot()
+    if snapshot is None:
+        response = jsonify({"error": True, "message": "Verificação das bibliotecas em andamento, tente de novo em instantes"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return jsonify(snapshot)
+
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    """The process is up and answering; no other check"""
+    return jsonify({"status": "ok", "uptimeSeconds": round(time.time() - readiness.started_at, 1)})
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """200 once the startup warm-ups are done, 503 (with what is pending) until then"""
+    status = readiness.status()
+    return jsonify(status), 200 if status["ready"] else 503
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,288 @@
+"""Key/value tier shared by every worker process on a host (or, optionally, a network).
+
+Under gunicorn or several hypercorn workers each process has its own
+ResponseCache, so with N workers a question is answered from cache only if
+it already went through the same worker: the hit rate falls by about 1/N.
+A shared store sits behind the in-process LRU (same ResponseCache API) and is
+read on a local miss:
+
+    MmapCacheStore  fixed-size hash table in a memory-mapped file (by default
+                    in /dev/shm): no server to run, lookups of a few microseconds
+    RedisCacheStore any number of hosts, through Redis (optional dependency)
+
+The mmap table is split into sets of WAYS slots. A key (hashed with SHA-256)
+can only live in its set, so a lookup reads at most WAYS slots, and each set
+is protected by a byte-range lock on the file (fcntl.lockf, shared for
+reads) plus a per-process stripe lock, since POSIX record locks do not
+exclude threads of the same process. A full set overwrites the entry closest
+to expiring. Values bigger than a slot are simply not shared.
+
+Any object with get/set/delete/clear/stats like these can be passed as
+ResponseCache(shared=...).
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, the mmap store is unavailable
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<4sIII')  # magic, slot count, slot size, ways
+_HEADER_BYTES = 64
+_MAGIC = b'LZC1'
+# key digest, expires_at (0 = empty), value length
+_SLOT = struct.Struct('<32sdI')
+WAYS = 8
+_STRIPES = 64
+
+
+class MmapCacheStore:
+    """Set-associative hash table in a shared memory-mapped file"""
+
+    backend = 'mmap'
+
+    def __init__(self, path: str, size_bytes: int = 64 * 1024 * 1024, slot_bytes: int = 8192):
+        if fcntl is None:
+            raise OSError("The mmap cache store needs fcntl (POSIX)")
+        self.path = path
+        self.slot_bytes = slot_bytes
+        self.max_value_bytes = slot_bytes - _SLOT.size
+        self.slots = max(WAYS, (size_bytes - _HEADER_BYTES) // slot_bytes // WAYS * WAYS)
+        self.sets = self.slots // WAYS
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        total = _HEADER_BYTES + self.slots * slot_bytes
+        # Only the first worker to get here sizes and formats the file
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            expected = _HEADER.pack(_MAGIC, self.slots, slot_bytes, WAYS)
+            if header != expected:
+                if header[:4] == _MAGIC:
+                    logger.warning(f"Shared cache {path} has another layout, reformatting it")
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, total)
+                os.pwrite(self._fd, expected, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, total, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._stripes = [threading.Lock() for _ in range(_STRIPES)]
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "sets": 0, "overwrites": 0, "tooLarge": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _locate(self, key: str) -> Tuple[bytes, int]:
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        return digest, int.from_bytes(digest[:8], 'little') % self.sets
+
+    @contextmanager
+    def _locked(self, set_index: int, exclusive: bool) -> Iterator[None]:
+        start = _HEADER_BYTES + set_index * WAYS * self.slot_bytes
+        length = WAYS * self.slot_bytes
+        stripe = self._stripes[set_index % _STRIPES]
+        stripe.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+        finally:
+            stripe.release()
+
+    def _find(self, digest: bytes, set_index: int) -> Tuple[Optional[int], int]:
+        """(offset of the key's slot or None, offset of the slot to write it to); lock held"""
+        base = _HEADER_BYTES + set_index * WAYS * self.slot_bytes
+        victim, victim_expires = base, None
+        for way in range(WAYS):
+            offset = base + way * self.slot_bytes
+            slot_digest, expires_at, _ = _SLOT.unpack_from(self._map, offset)
+            if expires_at and slot_digest == digest:
+                return offset, offset
+            if victim_expires is None or expires_at < victim_expires:
+                victim, victim_expires = offset, expires_at
+        return None, victim
+
+    def _read(self, offset: int) -> Tuple[str, float]:
+        _, expires_at, length = _SLOT.unpack_from(self._map, offset)
+        start = offset + _SLOT.size
+        return self._map[start:start + length].decode('utf-8'), expires_at
+
+    def _write(self, offset: int, digest: bytes, value: bytes, expires_at: float) -> None:
+        start = offset + _SLOT.size
+        self._map[start:start + len(value)] = value
+        _SLOT.pack_into(self._map, offset, digest, expires_at, len(value))
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """(value, expires_at) or None; expired entries are returned for the caller to drop"""
+        digest, set_index = self._locate(key)
+        with self._locked(set_index, exclusive=False):
+            offset, _ = self._find(digest, set_index)
+            entry = self._read(offset) if offset is not None else None
+        self._count("hits" if entry is not None else "misses")
+        return entry
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        data = value.encode('utf-8')
+        if len(data) > self.max_value_bytes:
+            self._count("tooLarge")
+            return
+        digest, set_index = self._locate(key)
+        with self._locked(set_index, exclusive=True):
+            offset, target = self._find(digest, set_index)
+            if offset is None and _SLOT.unpack_from(self._map, target)[1] > time.time():
+                self._count("overwrites")
+            self._write(target, digest, data, expires_at)
+        self._count("sets")
+
+    def update(self, key: str, fn: Callable[[Optional[str]], Tuple[str, float]]) -> str:
+        """Atomically replace a value with fn(current value or None) -> (new value, expires_at)"""
+        digest, set_index = self._locate(key)
+        with self._locked(set_index, exclusive=True):
+            offset, target = self._find(digest, set_index)
+            current = None
+            if offset is not None:
+                value, expires_at = self._read(offset)
+                current = value if expires_at > time.time() else None
+            value, expires_at = fn(current)
+            data = value.encode('utf-8')
+            if len(data) <= self.max_value_bytes:
+                self._write(target, digest, data, expires_at)
+        return value
+
+    def delete(self, key: str) -> None:
+        digest, set_index = self._locate(key)
+        with self._locked(set_index, exclusive=True):
+            offset, _ = self._find(digest, set_index)
+            if offset is not None:
+                _SLOT.pack_into(self._map, offset, b'\0' * 32, 0.0, 0)
+
+    def clear(self) -> None:
+        for set_index in range(self.sets):
+            with self._locked(set_index, exclusive=True):
+                base = _HEADER_BYTES + set_index * WAYS * self.slot_bytes
+                for way in range(WAYS):
+                    _SLOT.pack_into(self._map, base + way * self.slot_bytes, b'\0' * 32, 0.0, 0)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(backend=self.backend, path=self.path, slots=self.slots, slotBytes=self.slot_bytes)
+        return stats
+
+
+class RedisCacheStore:
+    """The shared tier in Redis, for workers on several hosts (fails open if Redis is down)"""
+
+    backend = 'redis'
+
+    def __init__(self, url: str, prefix: str = 'layza:cache:'):
+        import redis  # Optional dependency, only needed for multi-host deployments
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.05)
+        self._errors = (redis.RedisError,)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "sets": 0, "backendErrors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            raw = self._redis.get(self.prefix + key)
+        except self._errors as e:
+            logger.error(f"Shared cache unavailable: {e}")
+            self._count("backendErrors")
+            return None
+        if raw is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        expires_at, _, value = raw.decode('utf-8').partition('\x1f')
+        return value, float(expires_at)
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        try:
+            self._redis.set(self.prefix + key, f"{expires_at}\x1f{value}".encode('utf-8'), px=ttl_ms)
+        except self._errors as e:
+            logger.error(f"Shared cache unavailable: {e}")
+            self._count("backendErrors")
+            return
+        self._count("sets")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._redis.delete(self.prefix + key)
+        except self._errors as e:
+            logger.error(f"Shared cache unavailable: {e}")
+            self._count("backendErrors")
+
+    def clear(self) -> None:
+        try:
+            keys = list(self._redis.scan_iter(match=self.prefix + '*', count=1000))
+            if keys:
+                self._redis.delete(*keys)
+        except self._errors as e:
+            logger.error(f"Shared cache unavailable: {e}")
+            self._count("backendErrors")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["backend"] = self.backend
+        return stats
+
+
+def _default_mmap_path(name: str) -> str:
+    # /dev/shm is RAM-backed on Linux; elsewhere the page cache does the same job
+    if os.path.isdir('/dev/shm'):
+        return f'/dev/shm/layza-{name}'
+    return os.path.join('var', f'shared-{name}.mmap')
+
+
+def shared_store_from_env(name: str = 'responses', size_bytes: Optional[int] = None,
+                          slot_bytes: Optional[int] = None):
+    """The shared tier named `name` from LAYZA_SHARED_CACHE (off, mmap or redis).
+
+    Each name gets its own table (file or key prefix), so e.g. small rate-limit
+    buckets never evict cached answers. None when off or unavailable.
+    """
+    backend = os.environ.get('LAYZA_SHARED_CACHE', 'off').lower()
+    try:
+        if backend == 'mmap':
+            directory = os.environ.get('LAYZA_SHARED_CACHE_DIR')
+            store = MmapCacheStore(
+                os.path.join(directory, f'layza-{name}') if directory else _default_mmap_path(name),
+                size_bytes=size_bytes or int(os.environ.get('LAYZA_SHARED_CACHE_BYTES', 64 * 1024 * 1024)),
+                slot_bytes=slot_bytes or int(os.environ.get('LAYZA_SHARED_CACHE_SLOT_BYTES', 8192)),
+            )
+        elif backend == 'redis':
+            store = RedisCacheStore(os.environ.get('LAYZA_SHARED_CACHE_URL', 'redis://localhost:6379/0'),
+                                    prefix=f'layza:{name}:')
+        else:
+            return None
+    except (OSError, ImportError) as e:
+        logger.error(f"Shared {name} cache ({backend}) unavailable, keeping it per worker: {e}")
+        return None
+    logger.info(f"Shared {name} cache enabled ({backend})")
+    return store
@@ -0,0 +1,126 @@
+"""Single-flight coalescing of identical concurrent calls.
+
+When a teacher projects a question, dozens of students send the same text at
+once. The first caller for a key runs the function; everyone who arrives while
+it is still running waits for that result instead of starting their own call.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class SingleFlightTimeout(Exception):
+    """A waiter gave up before the in-flight call finished"""
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls that share a key"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._counters = {"leaders": 0, "shared": 0, "timeouts": 0}
+
+    def do(self, key: str, fn: Callable[[], Any],
+           timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Run fn once per key among concurrent callers.
+
+        Returns (value, shared) where shared is True for callers that reused
+        another caller's result. Waiters raise SingleFlightTimeout after
+        `timeout` seconds; exceptions raised by fn reach every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._counters["leaders"] += 1
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call")
+            with self._lock:
+                self._counters["shared"] += 1
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["inFlight"] = len(self._calls)
+            stats["waiting"] = sum(call.waiters for call in self._calls.values())
+        return stats
+
+
+class AsyncSingleFlight:
+    """asyncio flavour of SingleFlight for the async serving mode"""
+
+    def __init__(self):
+        self._calls: Dict[str, 'asyncio.Future'] = {}
+        self._counters = {"leaders": 0, "shared": 0, "timeouts": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Await fn once per key among concurrent callers; see SingleFlight.do"""
+        future = self._calls.get(key)
+        if future is not None:
+            try:
+                # shield: a waiter timing out must not cancel the leader's call
+                value = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                self._counters["timeouts"] += 1
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call")
+            self._counters["shared"] += 1
+            return value, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._counters["leaders"] += 1
+        try:
+            value = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Avoid "exception was never retrieved" when nobody was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            del self._calls[key]
+        return value, False
+
+    def stats(self) -> Dict:
+        stats = dict(self._counters)
+        stats["inFlight"] = len(self._calls)
+        return stats
@@ -6,7 +6,7 @@ import ChatFeedback from './ChatFeedback';
 import { useStore } from '../../store';
 import { Subject } from '../../types';
 import { getRandomLoadingMessage, getSubjectName } from '../../utils/helpers';
-import { sendMessage } from '../../services/api';
+import { streamMessage } from '../../services/api';
 import { Sparkle } from 'lucide-react';
 import { motion } from 'framer-motion';
 
@@ -89,12 +89,21 @@ const ChatContainer: React.FC = () => {
     });
     
     try {
-      // Send to API
-      const response = await sendMessage(message, subject);
+      // Send to API, showing tokens as they arrive
+      let streamed = '';
+      const response = await streamMessage(message, subject, (token) => {
+        streamed += token;
+        updateMessage(loadingMessageId, {
+          content: streamed,
+          isLoading: false,
+        });
+      }, activeConversationId);
       
-      // Update the loading message with the real response
+      // Update the loading message with the real response (a stream cut short
+      // keeps what already arrived, followed by the error)
+      const content = response.response || 'Desculpe, não consegui processar sua mensagem.';
       updateMessage(loadingMessageId, {
-        content: response.response || 'Desculpe, não consegui processar sua mensagem.',
+        content: response.error && response.message ? `${content}\n\n_${response.message}_` : content,
         isLoading: false,
       });
       
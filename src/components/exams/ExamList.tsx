@@ -1,94 +1,112 @@
 import React, { useState, useEffect } from 'react';
 import { CalendarDays, FileText, Download, CheckCircle } from 'lucide-react';
 import Button from '../ui/Button';
-import { getExamPapers } from '../../services/api';
+import { getExamFacets, getExamPapers } from '../../services/api';
 import { ExamPaper, Subject } from '../../types';
 import { getSubjectName } from '../../utils/helpers';
 
+// Shown when the API can't be reached
+const fallbackPapers: ExamPaper[] = [
+  {
+    id: '1',
+    year: 2023,
+    day: 1,
+    color: 'azul',
+    subjects: ['portuguese'],
+    fileUrl: '#',
+    answersUrl: '#',
+  },
+  {
+    id: '2',
+    year: 2023,
+    day: 2,
+    color: 'azul',
+    subjects: ['math', 'science'],
+    fileUrl: '#',
+    answersUrl: '#',
+  },
+  {
+    id: '3',
+    year: 2022,
+    day: 1,
+    color: 'azul',
+    subjects: ['portuguese'],
+    fileUrl: '#',
+    answersUrl: '#',
+  },
+  {
+    id: '4',
+    year: 2022,
+    day: 2,
+    color: 'azul',
+    subjects: ['math', 'science'],
+    fileUrl: '#',
+    answersUrl: '#',
+  },
+];
+
 const ExamList: React.FC = () => {
   const [examPapers, setExamPapers] = useState<ExamPaper[]>([]);
+  const [years, setYears] = useState<number[]>([]);
+  const [offline, setOffline] = useState(false);
   const [loading, setLoading] = useState(true);
   const [activeYear, setActiveYear] = useState<number | null>(null);
   const [activeSubject, setActiveSubject] = useState<Subject | null>(null);
   
-  // Fetch exam papers on component mount
+  // Fetch the available years on component mount
+  useEffect(() => {
+    const fetchFacets = async () => {
+      const facets = await getExamFacets();
+      if (facets && facets.total > 0) {
+        const available = facets.years.map(facet => facet.value);
+        setYears(available);
+        // Set initial active year to the most recent
+        setActiveYear(available[0]);
+      } else {
+        setOffline(true);
+        setYears([...new Set(fallbackPapers.map(paper => paper.year))].sort((a, b) => b - a));
+        setActiveYear(2023);
+      }
+    };
+    
+    fetchFacets();
+  }, []);
+  
+  // The server filters by year and subject and answers repeat requests with 304
   useEffect(() => {
+    if (years.length === 0) return;
+    if (offline) {
+      setExamPapers(fallbackPapers);
+      setLoading(false);
+      return;
+    }
+    
+    let cancelled = false;
     const fetchExamPapers = async () => {
       try {
-        const data = await getExamPapers();
-        setExamPapers(data);
-        
-        // Set initial active year to the most recent
-        if (data.length > 0) {
-          const years = [...new Set(data.map(paper => paper.year))];
-          const latestYear = Math.max(...years);
-          setActiveYear(latestYear);
-        }
+        const data = await getExamPapers({ year: activeYear, subject: activeSubject });
+        if (!cancelled) setExamPapers(data);
       } catch (error) {
         console.error('Error fetching exam papers:', error);
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
     };
     
     fetchExamPapers();
-  }, []);
-  
-  // Get unique years from exam papers
-  const years = [...new Set(examPapers.map(paper => paper.year))].sort((a, b) => b - a);
-  
-  // Filter exam papers by active year and subject
-  const filteredPapers = examPapers.filter(paper => {
-    if (activeYear && paper.year !== activeYear) return false;
-    if (activeSubject && !paper.subjects.includes(activeSubject)) return false;
-    return true;
-  });
+    return () => {
+      cancelled = true;
+    };
+  }, [years, offline, activeYear, activeSubject]);
   
-  // Mocked data for demonstration
-  if (examPapers.length === 0 && !loading) {
-    // Mock data if API doesn't return any papers
-    const mockPapers: ExamPaper[] = [
-      {
-        id: '1',
-        year: 2023,
-        day: 1,
-        color: 'azul',
-        subjects: ['portuguese'],
-        fileUrl: '#',
-        answersUrl: '#',
-      },
-      {
-        id: '2',
-        year: 2023,
-        day: 2,
-        color: 'azul',
-        subjects: ['math', 'science'],
-        fileUrl: '#',
-        answersUrl: '#',
-      },
-      {
-        id: '3',
-        year: 2022,
-        day: 1,
-        color: 'azul',
-        subjects: ['portuguese'],
-        fileUrl: '#',
-        answersUrl: '#',
-      },
-      {
-        id: '4',
-        year: 2022,
-        day: 2,
-        color: 'azul',
-        subjects: ['math', 'science'],
-        fileUrl: '#',
-        answersUrl: '#',
-      },
-    ];
-    
-    setExamPapers(mockPapers);
-    setActiveYear(2023);
-  }
+  // Only the offline fallback list still needs filtering here
+  const filteredPapers = offline
+    ? examPapers.filter(paper => {
+        if (activeYear && paper.year !== activeYear) return false;
+        if (activeSubject && !paper.subjects.includes(activeSubject)) return false;
+        return true;
+      })
+    : examPapers;
   
   if (loading) {
     return (
@@ -103,7 +121,7 @@ const ExamList: React.FC = () => {
       <div className="mb-8">
         <h1 className="text-2xl font-bold text-gray-800 mb-2">Provas Oficiais do ENEM</h1>
         <p className="text-gray-600">
-          Acesse as provas oficiais do ENEM de 2019 a 2024. Baixe os PDFs e pratique com questões reais!
+          Acesse as provas oficiais do ENEM{years.length > 1 && ` de ${years[years.length - 1]} a ${years[0]}`}. Baixe os PDFs e pratique com questões reais!
         </p>
       </div>
       
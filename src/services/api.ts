@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { YoutubeRecommendation } from '../types';
+import { ExamFacets, ExamPaperFilters, UploadJob, YoutubeRecommendation } from '../types';
 
 const API_URL = 'http://localhost:5000/api';
 
@@ -11,11 +11,12 @@ const api = axios.create({
   },
 });
 
-export async function sendMessage(message: string, subject: string) {
+export async function sendMessage(message: string, subject: string, conversationId?: string) {
   try {
     const response = await api.post('/chat', {
       message,
       subject,
+      conversationId,
     });
     return response.data;
   } catch (error) {
@@ -28,6 +29,71 @@ export async function sendMessage(message: string, subject: string) {
   }
 }
 
+// Streams the answer token by token from /chat/stream (Server-Sent Events).
+// Resolves with the full text. If streaming fails before the first token it
+// falls back to sendMessage; after that the partial answer is kept and comes
+// back with error: true and a message, instead of asking the question again.
+export async function streamMessage(
+  message: string,
+  subject: string,
+  onToken: (token: string, fallback: boolean) => void,
+  conversationId?: string,
+) {
+  let text = '';
+  let received = false;
+  try {
+    const response = await fetch(`${API_URL}/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Accept: 'text/event-stream',
+      },
+      body: JSON.stringify({ message, subject, conversationId }),
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Stream request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      const events = buffer.split('\n\n');
+      buffer = events.pop() ?? '';
+      for (const event of events) {
+        const dataLine = event.split('\n').find((line) => line.startsWith('data:'));
+        if (!dataLine) continue;
+        const data = JSON.parse(dataLine.slice(5));
+        if (event.startsWith('event: error')) {
+          throw new Error(data.response);
+        }
+        if (typeof data.token === 'string') {
+          received = true;
+          text += data.token;
+          onToken(data.token, Boolean(data.fallback));
+        }
+      }
+    }
+
+    return { response: text, error: false };
+  } catch (error) {
+    console.error('Error streaming message:', error);
+    if (!received) {
+      return sendMessage(message, subject, conversationId);
+    }
+    return {
+      response: text,
+      error: true,
+      message: 'A resposta foi interrompida no meio. Pode pedir para eu continuar ou tentar de novo.',
+    };
+  }
+}
+
 export async function uploadImage(file: File) {
   const formData = new FormData();
   formData.append('image', file);
@@ -48,17 +114,51 @@ export async function uploadImage(file: File) {
   }
 }
 
-export async function uploadAudio(blob: Blob) {
-  const formData = new FormData();
-  formData.append('audio', blob, 'audio.mp3');
-  
+// OCR and transcription run in the background: poll with the jobId from uploadImage/uploadAudio
+export async function getJob(jobId: string, waitSeconds = 0): Promise<UploadJob | null> {
   try {
-    const response = await api.post('/upload-audio', formData, {
-      headers: {
-        'Content-Type': 'multipart/form-data',
-      },
-    });
+    // With waitSeconds the server answers as soon as the job finishes (or when the wait runs out)
+    const response = await api.get(`/jobs/${jobId}`, { params: waitSeconds ? { wait: waitSeconds } : {} });
     return response.data;
+  } catch (error) {
+    console.error('Error getting job status:', error);
+    return null;
+  }
+}
+
+// Audio goes up in chunks through a resumable session: after a network error
+// the upload continues from the offset the server already has instead of starting over
+export async function uploadAudio(blob: Blob, maxRetries = 3) {
+  try {
+    const { data: session } = await api.post('/upload-audio/sessions', {
+      size: blob.size,
+      filename: 'audio.mp3',
+    });
+    let offset = 0;
+    let retries = 0;
+    let result = session;
+    while (offset < blob.size) {
+      try {
+        const response = await api.patch(
+          `/upload-audio/sessions/${session.uploadId}`,
+          blob.slice(offset, offset + session.chunkSize),
+          {
+            headers: {
+              'Content-Type': 'application/offset+octet-stream',
+              'Upload-Offset': String(offset),
+            },
+          }
+        );
+        result = response.data;
+        offset = result.offset;
+      } catch (error) {
+        if (++retries > maxRetries) throw error;
+        const { data: status } = await api.get(`/upload-audio/sessions/${session.uploadId}`);
+        offset = status.offset;
+      }
+    }
+    // Once the last chunk is in: { url, audioId, jobId, status, transcription }
+    return result;
   } catch (error) {
     console.error('Error uploading audio:', error);
     return {
@@ -68,10 +168,13 @@ export async function uploadAudio(blob: Blob) {
   }
 }
 
-export async function getYoutubeRecommendations(query: string): Promise<YoutubeRecommendation[]> {
+export async function getYoutubeRecommendations(
+  query: string,
+  subject?: string
+): Promise<YoutubeRecommendation[]> {
   try {
     const response = await api.get('/youtube-recommendations', {
-      params: { query },
+      params: { query, subject },
     });
     return response.data;
   } catch (error) {
@@ -94,9 +197,49 @@ export async function getYoutubeRecommendations(query: string): Promise<YoutubeR
   }
 }
 
-export async function getExamPapers() {
+// URL of the PNG/SVG graph of a function, for an <img src>; the server caches it by expression and range
+export function getPlotUrl(
+  expression: string,
+  options: { xMin?: number; xMax?: number; format?: 'png' | 'svg' } = {}
+): string {
+  const params = new URLSearchParams({ expression });
+  if (options.xMin !== undefined) params.set('xmin', String(options.xMin));
+  if (options.xMax !== undefined) params.set('xmax', String(options.xMax));
+  if (options.format) params.set('format', options.format);
+  return `${API_URL}/plot?${params}`;
+}
+
+// Molar mass and composition of several formulas in one request (one pool call on the server)
+export async function getChemFormulas(formulas: string[]) {
   try {
-    const response = await api.get('/exam-papers');
+    const response = await api.post('/chem/formulas', { formulas });
+    return response.data.compounds;
+  } catch (error) {
+    console.error('Error getting chemical formulas:', error);
+    return [];
+  }
+}
+
+export async function balanceEquation(equation: string, given?: Record<string, number>) {
+  try {
+    const response = await api.post('/chem/balance', { equation, given });
+    return response.data;
+  } catch (error) {
+    console.error('Error balancing equation:', error);
+    return {
+      error: true,
+      message: 'Não foi possível balancear a equação. Confira as fórmulas e tente novamente.',
+    };
+  }
+}
+
+export async function getExamPapers(filters: ExamPaperFilters = {}) {
+  // Only send the filters that are set: the server caches one response per combination
+  const params = Object.fromEntries(
+    Object.entries(filters).filter(([, value]) => value !== null && value !== undefined)
+  );
+  try {
+    const response = await api.get('/exam-papers', { params });
     return response.data;
   } catch (error) {
     console.error('Error getting exam papers:', error);
@@ -105,6 +248,16 @@ export async function getExamPapers() {
   }
 }
 
+export async function getExamFacets(): Promise<ExamFacets | null> {
+  try {
+    const response = await api.get('/exam-papers/facets');
+    return response.data;
+  } catch (error) {
+    console.error('Error getting exam facets:', error);
+    return null;
+  }
+}
+
 export async function sendFeedback(rating: number, conversationId: string) {
   try {
     const response = await api.post('/feedback', {
@@ -35,11 +35,43 @@ export interface ExamPaper {
   answersUrl: string;
 }
 
+export interface ExamFacet<T> {
+  value: T;
+  count: number;
+}
+
+export interface ExamFacets {
+  total: number;
+  years: ExamFacet<number>[];
+  days: ExamFacet<1 | 2>[];
+  subjects: ExamFacet<Subject>[];
+  colors: ExamFacet<ExamPaper['color']>[];
+}
+
+export interface ExamPaperFilters {
+  year?: number | null;
+  day?: 1 | 2 | null;
+  subject?: Subject | null;
+  color?: ExamPaper['color'] | null;
+}
+
+export interface UploadJob {
+  id: string;
+  kind: 'ocr' | 'transcribe';
+  status: 'queued' | 'running' | 'done' | 'failed';
+  result: { text: string; engine: string; [key: string]: unknown } | null;
+  error: string | null;
+}
+
 export interface YoutubeRecommendation {
   id: string;
   title: string;
   url: string;
   thumbnailUrl: string;
+  channel?: string;
+  subject?: string;
+  durationSeconds?: number;
+  score?: number;
 }
 
 export interface FeedbackRating {
@@ -0,0 +1,213 @@
+"""Logging setup for the request hot path.
+
+configure_logging() replaces the old basicConfig(level=DEBUG):
+
+- handlers never block a request: records go through a bounded queue to a
+  QueueListener thread that does the formatting and the writing, and are
+  dropped (and counted) when the queue is full
+- each line is a JSON object carrying the id of the request that logged it
+  (X-Request-ID, or a generated one)
+- levels come from LAYZA_LOG_LEVEL, with per-logger overrides in
+  LAYZA_LOG_LEVELS ("upstream_client=DEBUG,werkzeug=WARNING")
+- INFO and DEBUG lines are kept for a LAYZA_LOG_SAMPLE_RATE fraction of
+  requests, all lines of a sampled request together; warnings always pass
+- redact() hides message bodies unless LAYZA_LOG_BODIES=1
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+import zlib
+from typing import Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+request_id_var: 'contextvars.ContextVar[Optional[str]]' = contextvars.ContextVar('layza_request_id', default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+_log_bodies = False
+_state: Dict = {}
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Bind a request id to the current context: the caller's if it looks sane, else a new one"""
+    if incoming and len(incoming) <= 64 and incoming.isprintable():
+        request_id = incoming
+    else:
+        request_id = uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def redact(text: Optional[str]) -> str:
+    """What to log instead of a user message or model answer"""
+    if text is None:
+        return ''
+    if _log_bodies:
+        return text
+    return f"<{len(text)} chars>"
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id (runs on the thread that logs)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or '-'
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep INFO and DEBUG records for `rate` of the requests; WARNING and up always pass"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self._threshold = int(rate * 0xFFFFFFFF)
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        request_id = getattr(record, 'request_id', '-')
+        if request_id == '-':
+            return True  # Startup and background lines are rare
+        # Decided by the request id, so a request's lines are kept or dropped together
+        if zlib.crc32(request_id.encode('utf-8')) <= self._threshold:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including fields passed through `extra`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', '-')
+        if request_id != '-':
+            entry["requestId"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full"""
+
+    _exception_formatter = logging.Formatter()
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here; formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parse "name=LEVEL,name=LEVEL" into logger levels"""
+    levels = {}
+    for item in spec.split(','):
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            continue
+        value = logging.getLevelName(level.strip().upper())
+        if isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+
+def _after_fork_in_child() -> None:
+    # The listener thread does not survive fork (CPU pool workers): write directly
+    handler = _state.get('handler')
+    target = _state.get('target')
+    if not isinstance(handler, NonBlockingQueueHandler):
+        return
+    root = logging.getLogger()
+    root.removeHandler(handler)
+    for log_filter in handler.filters:
+        target.addFilter(log_filter)
+    root.addHandler(target)
+    _state['handler'] = target
+
+
+def configure_logging() -> None:
+    """Set up the root logger from LAYZA_LOG_* variables (once per process)"""
+    global _log_bodies
+    if _state:
+        return
+    _log_bodies = os.environ.get('LAYZA_LOG_BODIES', '0').lower() in ('1', 'true', 'yes', 'on')
+
+    log_file = os.environ.get('LAYZA_LOG_FILE')
+    target = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stderr)
+    if os.environ.get('LAYZA_LOG_FORMAT', 'json').lower() == 'text':
+        target.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        target.setFormatter(JsonFormatter())
+
+    sampler = SamplingFilter(float(os.environ.get('LAYZA_LOG_SAMPLE_RATE', 1.0)))
+    if os.environ.get('LAYZA_LOG_ASYNC', '1').lower() in ('0', 'false', 'no', 'off'):
+        handler = target
+    else:
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.environ.get('LAYZA_LOG_QUEUE_SIZE', 10000))))
+        listener = logging.handlers.QueueListener(handler.queue, target, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _state['listener'] = listener
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(sampler)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.environ.get('LAYZA_LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(os.environ.get('LAYZA_LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _state.update(handler=handler, target=target, sampler=sampler)
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def logging_stats() -> Dict:
+    handler = _state.get('handler')
+    sampler = _state.get('sampler')
+    return {
+        "async": isinstance(handler, NonBlockingQueueHandler),
+        "queued": handler.queue.qsize() if isinstance(handler, NonBlockingQueueHandler) else 0,
+        "dropped": getattr(handler, 'dropped', 0),
+        "sampledOut": sampler.dropped if sampler is not None else 0,
+        "sampleRate": sampler.rate if sampler is not None else 1.0,
+    }
@@ -0,0 +1,173 @@
+"""Local subject classifier for chat messages sent without a valid subject.
+
+The frontend does not always send "math", "science" or "portuguese", and
+without one the question gets the generic system prompt. This guesses the
+subject from the message itself, with no upstream call: content words and
+their character 4-5-grams (accent-insensitive, so "equacao" still matches
+"equação") are hashed into a fixed number of columns, and a multinomial
+Naive Bayes model trained on the small labelled corpus in
+data/subject_corpus.json scores each subject. A classification only reads
+the message's own columns, so it takes tens of microseconds.
+
+Scores are the average log-likelihood per feature, so long and short
+messages are comparable, turned into confidences with a softmax. Below
+`min_confidence` no subject is returned and the request keeps the generic
+prompt; greetings and off-topic questions land there.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Dict, List, Optional
+
+from library_registry import get_library
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'subject_corpus.json')
+
+_WORD_RE = re.compile(r'[a-z]+|\d+')
+# Symbols that say "math" on their own; mapped to words before tokenizing
+_SYMBOLS = {'+': ' opmais ', '-': ' opmenos ', '*': ' opvezes ', '×': ' opvezes ', '/': ' opdiv ',
+            '÷': ' opdiv ', '=': ' opigual ', '^': ' oppot ', '²': ' oppot ', '³': ' oppot ',
+            '√': ' opraiz ', '%': ' oppct '}
+_SYMBOL_RE = re.compile('|'.join(re.escape(symbol) for symbol in _SYMBOLS))
+# Words in questions of every subject ("como", "o que é", "explique") and greetings, folded
+_STOPWORDS = frozenset("""
+a o e as os um uma uns umas de do da dos das em no na nos nas num numa por pelo pela para pra com sem
+que qual quais quanto quantos quanta quantas como onde quando porque se eu me mim meu minha voce
+ele ela isso esse essa este esta isto ao aos sobre entre sao ser foi tem ter faz fazer
+diferenca funciona funcionam explique explica fale ajuda ajude pode posso ou mais muito
+oi ola bom boa dia tarde noite tudo bem obrigado obrigada valeu seu sua nome layza
+""".split())
+# Sharpness of the softmax over per-feature log-likelihoods
+_TEMPERATURE = 2.0
+
+
+def _fold(text: str) -> str:
+    """Lowercase without accents: users often type "funcao" for "função" """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def features(text: str, dimensions: int) -> List[int]:
+    """Hashed feature columns of a text: content words, digit runs (as one token), char 4-5-grams"""
+    folded = _SYMBOL_RE.sub(lambda match: _SYMBOLS[match.group()], _fold(text))
+    columns = []
+    for word in _WORD_RE.findall(folded):
+        if word in _STOPWORDS:
+            continue
+        if word[0].isdigit():
+            word = '0'
+        columns.append(zlib.crc32(f"w:{word}".encode('utf-8')) % dimensions)
+        padded = f" {word} "
+        for size in (4, 5):
+            for start in range(len(padded) - size + 1):
+                columns.append(zlib.crc32(padded[start:start + size].encode('utf-8')) % dimensions)
+    return columns
+
+
+class SubjectClassifier:
+    """Multinomial Naive Bayes over hashed n-grams (NumPy)"""
+
+    def __init__(self, corpus: Dict[str, List[str]], dimensions: int = 2 ** 15,
+                 min_confidence: float = 0.6, smoothing: float = 0.1):
+        self.corpus = corpus
+        self.subjects = sorted(corpus)
+        self.dimensions = dimensions
+        self.min_confidence = min_confidence
+        self.smoothing = smoothing
+        self._np = None
+        self._log_probs = None
+        self._train_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._counters = {"classified": 0, "confident": 0, "uncertain": 0}
+        self._total_seconds = 0.0
+        self.train_seconds: Optional[float] = None
+
+    def train(self) -> None:
+        """Per-subject log-probabilities of every column (once; NumPy is imported on first use)"""
+        if self._log_probs is not None:
+            return
+        with self._train_lock:
+            if self._log_probs is not None:
+                return
+            started = time.perf_counter()
+            np = self._np = get_library('numpy')
+            counts = np.full((len(self.subjects), self.dimensions), self.smoothing)
+            for row, subject in enumerate(self.subjects):
+                for text in self.corpus[subject]:
+                    np.add.at(counts[row], features(text, self.dimensions), 1)
+            # Transposed so a message's columns are contiguous rows
+            self._log_probs = np.ascontiguousarray(np.log(counts / counts.sum(axis=1, keepdims=True)).T)
+            self.train_seconds = time.perf_counter() - started
+            logger.info(f"Subject classifier trained on {sum(len(texts) for texts in self.corpus.values())} "
+                        f"examples in {self.train_seconds * 1000:.1f} ms")
+
+    def warm_up(self) -> threading.Thread:
+        """Train in a daemon thread so the first chat request doesn't pay for it"""
+        thread = threading.Thread(target=self.train, name='subject-classifier', daemon=True)
+        thread.start()
+        return thread
+
+    def classify(self, message: str) -> Dict:
+        """{"subject": best subject or None if unsure, "confidence", "scores": {subject: confidence}}"""
+        self.train()
+        started = time.perf_counter()
+        np = self._np
+        columns = features(message or '', self.dimensions)
+        if columns:
+            likelihoods = self._log_probs[columns].mean(axis=0)
+            exponents = np.exp((likelihoods - likelihoods.max()) * _TEMPERATURE)
+            confidences = exponents / exponents.sum()
+        else:
+            confidences = np.full(len(self.subjects), 1 / len(self.subjects))
+        best = int(confidences.argmax())
+        confident = bool(confidences[best] >= self.min_confidence)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._counters["classified"] += 1
+            self._counters["confident" if confident else "uncertain"] += 1
+            self._total_seconds += elapsed
+        return {
+            "subject": self.subjects[best] if confident else None,
+            "confidence": round(float(confidences[best]), 3),
+            "scores": {subject: round(float(confidence), 3) for subject, confidence in zip(self.subjects, confidences)},
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            classified = stats["classified"]
+            stats["avgMicros"] = round(self._total_seconds / classified * 1e6, 1) if classified else 0.0
+        stats.update(
+            trained=self._log_probs is not None,
+            trainMs=round(self.train_seconds * 1000, 2) if self.train_seconds is not None else None,
+            examples=sum(len(texts) for texts in self.corpus.values()),
+            minConfidence=self.min_confidence,
+        )
+        return stats
+
+
+def subject_classifier_from_env() -> Optional[SubjectClassifier]:
+    """Classifier over LAYZA_SUBJECT_CORPUS_PATH, trained in the background
+    (None when LAYZA_SUBJECT_CLASSIFIER_ENABLED=0 or the corpus can't be read)"""
+    if os.environ.get('LAYZA_SUBJECT_CLASSIFIER_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    path = os.environ.get('LAYZA_SUBJECT_CORPUS_PATH', DEFAULT_CORPUS_PATH)
+    try:
+        with open(path, encoding='utf-8') as f:
+            corpus = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not load the subject corpus from {path}: {e}")
+        return None
+    classifier = SubjectClassifier(
+        corpus,
+        min_confidence=float(os.environ.get('LAYZA_SUBJECT_MIN_CONFIDENCE', 0.6)),
+    )
+    classifier.warm_up()
+    return classifier
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_deepseek import MockDeepSeekServer  # noqa: E402
+
+
+@pytest.fixture
+def mock_deepseek():
+    """Start MockDeepSeekServer instances on free ports; all are stopped after the test"""
+    servers = []
+
+    def start(**options) -> MockDeepSeekServer:
+        server = MockDeepSeekServer(port=0, **options).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,28 @@
+"""normalize_expression: numbers joined without an operator are refused."""
+import pytest
+
+from function_plot import PlotError, normalize_expression
+
+
+@pytest.mark.parametrize("expression", [
+    "x^2-5x 6",  # ?f=x^2-5x+6 with the '+' left unencoded in the query string
+    "2 3",
+    "x2",
+    "(x+1)2",
+    "2.5.3",
+])
+def test_numbers_without_an_operator_are_rejected(expression):
+    with pytest.raises(PlotError):
+        normalize_expression(expression)
+
+
+@pytest.mark.parametrize("expression, normalized", [
+    ("x^2-5x+6", "x ^ 2 - 5 x + 6"),
+    ("y = 2x", "2 x"),
+    ("3(x+1)", "3 ( x + 1 )"),
+    ("0,5x + 1", "0.5 x + 1"),
+    ("2 x", "2 x"),
+    ("sen(x)²", "sen ( x ) ^ 2"),
+])
+def test_implicit_multiplication_by_a_number_still_works(expression, normalized):
+    assert normalize_expression(expression) == normalized
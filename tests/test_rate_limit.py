@@ -0,0 +1,36 @@
+"""ClientIdentity: nothing a caller can make up mints a new rate-limit bucket."""
+from rate_limit import ClientIdentity, TokenBucketLimiter
+
+
+def test_rotating_conversation_ids_share_the_callers_buckets():
+    identity = ClientIdentity(conversations_per_ip=2)
+    clients = {identity({}, {"conversationId": f"conversa-{i}"}, '203.0.113.7') for i in range(80)}
+    assert len(clients) <= 2
+    assert all(client.startswith('conv:203.0.113.7#') for client in clients)
+
+    limiter = TokenBucketLimiter(rate=1e-6, burst=10)
+    allowed = sum(limiter.allow(identity({}, {"conversationId": f"conversa-{i}"}, '203.0.113.7'))[0]
+                  for i in range(80))
+    assert allowed <= 20
+
+
+def test_unknown_api_keys_are_ignored():
+    identity = ClientIdentity(api_keys=['escola-a'])
+    assert identity({'X-API-Key': 'inventada'}, None, '203.0.113.7') == 'ip:203.0.113.7'
+
+
+def test_api_key_clients_are_a_hash_of_the_key():
+    identity = ClientIdentity(api_keys=['escola-a'])
+    client = identity({'X-API-Key': 'escola-a'}, None, '203.0.113.7')
+    assert client.startswith('key:') and len(client) == len('key:') + 16
+    assert 'escola-a' not in client
+    assert identity({'X-API-Key': 'escola-a'}, None, '198.51.100.1') == client
+
+
+def test_forwarded_for_only_counts_behind_a_trusted_proxy():
+    identity = ClientIdentity(trusted_proxies=['10.0.0.0/8'])
+    headers = {'X-Forwarded-For': '1.2.3.4, 203.0.113.7'}
+    assert identity(headers, None, '198.51.100.1') == 'ip:198.51.100.1'
+    assert identity(headers, None, '10.0.0.2') == 'ip:203.0.113.7'
+    # The last hop not added by a trusted proxy, whatever the client prepended
+    assert identity({'X-Forwarded-For': '1.2.3.4, 203.0.113.7, 10.0.0.3'}, None, '10.0.0.2') == 'ip:203.0.113.7'
@@ -0,0 +1,44 @@
+"""ResumableUploads: a client retrying the last chunk of a finished upload."""
+import pytest
+
+from resumable_upload import OffsetMismatch, ResumableUploads
+from upload_store import AUDIO_TYPES, ContentStore
+
+AUDIO = b'ID3' + b'\0' * 2000
+
+
+def finished_upload(uploads):
+    session = uploads.create(len(AUDIO))
+    result = uploads.append(session["uploadId"], 0, [AUDIO[:1000], AUDIO[1000:]])
+    return session["uploadId"], result
+
+
+def test_retried_last_chunk_gets_the_same_result(tmp_path):
+    uploads = ResumableUploads(ContentStore(str(tmp_path)), AUDIO_TYPES, 10_000)
+    upload_id, result = finished_upload(uploads)
+    assert result["offset"] == len(AUDIO)
+    assert result["stored"].content_type == 'audio/mpeg'
+
+    # The part and meta files are gone: this used to fail with FileNotFoundError
+    replay = uploads.append(upload_id, len(AUDIO), [b''])
+    assert replay["stored"] == result["stored"]
+    assert uploads.status(upload_id) == {"uploadId": upload_id, "offset": len(AUDIO), "size": len(AUDIO)}
+    assert uploads.stats()["replayed"] == 1
+    assert uploads.stats()["completed"] == 1
+
+
+def test_finished_upload_rejects_other_offsets(tmp_path):
+    uploads = ResumableUploads(ContentStore(str(tmp_path)), AUDIO_TYPES, 10_000)
+    upload_id, _ = finished_upload(uploads)
+
+    with pytest.raises(OffsetMismatch) as raised:
+        uploads.append(upload_id, 0, [AUDIO])
+    assert raised.value.expected == len(AUDIO)
+
+
+def test_another_worker_replays_from_the_receipt(tmp_path):
+    store = ContentStore(str(tmp_path))
+    upload_id, result = finished_upload(ResumableUploads(store, AUDIO_TYPES, 10_000))
+
+    replay = ResumableUploads(store, AUDIO_TYPES, 10_000).append(upload_id, len(AUDIO), [])
+    assert replay["stored"] == result["stored"]
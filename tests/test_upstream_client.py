@@ -0,0 +1,209 @@
+"""DeepSeekClient and AsyncDeepSeekClient against MockDeepSeekServer: retries,
+Retry-After, the circuit breaker and hedging."""
+import asyncio
+import time
+
+import pytest
+
+from upstream_client import (AsyncDeepSeekClient, CircuitBreaker, CircuitOpenError, DeepSeekClient,
+                             UpstreamError)
+
+PAYLOAD = {"model": "deepseek-ai/deepseek-v3", "messages": [{"role": "user", "content": "Quanto é 2 + 2?"}]}
+API_KEY = "test"
+
+
+def gaps(times):
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_retries_transient_errors_then_succeeds(mock_deepseek):
+    server = mock_deepseek(fail_first=2, error_status=503, reply="4")
+    client = DeepSeekClient(server.url, max_retries=2, backoff_base=0.01, backoff_max=0.05)
+
+    assert client.complete(PAYLOAD, API_KEY) == "4"
+    assert len(server.request_times) == 3
+    stats = client.stats()
+    assert stats["retries"] == 2
+    assert stats["statusCodes"] == {"503": 2, "200": 1}
+    assert stats["breaker"]["state"] == CircuitBreaker.CLOSED
+
+
+def test_waits_at_least_retry_after(mock_deepseek):
+    server = mock_deepseek(fail_first=2, error_status=429, retry_after=0.3)
+    client = DeepSeekClient(server.url, max_retries=2, backoff_base=0.001, backoff_max=1.0)
+
+    client.complete(PAYLOAD, API_KEY)
+    assert len(server.request_times) == 3
+    assert all(gap >= 0.3 for gap in gaps(server.request_times))
+
+
+def test_gives_up_when_retry_after_is_longer_than_backoff_max(mock_deepseek):
+    server = mock_deepseek(fail_first=1, error_status=503, retry_after=30)
+    client = DeepSeekClient(server.url, max_retries=2, backoff_base=0.001, backoff_max=1.0)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamError) as raised:
+        client.complete(PAYLOAD, API_KEY)
+    assert raised.value.status_code == 503
+    assert time.monotonic() - started < 1.0
+    assert len(server.request_times) == 1
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_client_errors_are_not_retried(mock_deepseek, status):
+    server = mock_deepseek(fail_first=1, error_status=status)
+    client = DeepSeekClient(server.url, max_retries=3, backoff_base=0.01, backoff_max=0.05)
+
+    with pytest.raises(UpstreamError) as raised:
+        client.complete(PAYLOAD, API_KEY)
+    assert raised.value.status_code == status
+    assert len(server.request_times) == 1
+    assert client.stats()["retries"] == 0
+    # Our mistake, not an unhealthy upstream
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_then_half_opens_then_closes(mock_deepseek):
+    server = mock_deepseek(fail_first=2, error_status=503, reply="ok")
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.3)
+    client = DeepSeekClient(server.url, max_retries=0, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.complete(PAYLOAD, API_KEY)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Open: calls fail without reaching the upstream
+    with pytest.raises(CircuitOpenError):
+        client.complete(PAYLOAD, API_KEY)
+    assert len(server.request_times) == 2
+    assert breaker.stats()["rejected"] == 1
+
+    time.sleep(0.35)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # The probe succeeds (the server only failed its first two requests)
+    assert client.complete(PAYLOAD, API_KEY) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert len(server.request_times) == 3
+
+
+def test_failed_half_open_probe_reopens_the_breaker(mock_deepseek):
+    server = mock_deepseek(fail_first=3, error_status=503)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    client = DeepSeekClient(server.url, max_retries=0, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.complete(PAYLOAD, API_KEY)
+    time.sleep(0.25)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(UpstreamError):
+        client.complete(PAYLOAD, API_KEY)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+def test_hedge_answers_from_the_faster_endpoint(mock_deepseek):
+    primary = mock_deepseek(latency=2.0, reply="primária")
+    secondary = mock_deepseek(reply="secundária")
+    client = DeepSeekClient(primary.url, secondary_url=secondary.url, hedge_after=0.1)
+
+    started = time.monotonic()
+    assert client.complete(PAYLOAD, API_KEY) == "secundária"
+    assert time.monotonic() - started < 1.0
+    stats = client.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedgeWins"] == 1
+
+
+def test_no_hedge_when_the_primary_is_fast(mock_deepseek):
+    primary = mock_deepseek(reply="primária")
+    secondary = mock_deepseek(reply="secundária")
+    client = DeepSeekClient(primary.url, secondary_url=secondary.url, hedge_after=0.5)
+
+    assert client.complete(PAYLOAD, API_KEY) == "primária"
+    assert client.stats()["hedges"] == 0
+    assert secondary.request_times == []
+
+
+def test_async_hedge_cancels_the_slower_call(mock_deepseek):
+    primary = mock_deepseek(latency=2.0, reply="primária")
+    secondary = mock_deepseek(reply="secundária")
+
+    async def scenario():
+        client = AsyncDeepSeekClient(primary.url, secondary_url=secondary.url, hedge_after=0.1)
+        try:
+            started = time.monotonic()
+            answer = await client.complete(PAYLOAD, API_KEY)
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(0)  # Let the cancellation of the loser run
+            leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            return answer, elapsed, leftover, client.stats()
+        finally:
+            await client.aclose()
+
+    answer, elapsed, leftover, stats = asyncio.run(scenario())
+    assert answer == "secundária"
+    assert elapsed < 1.0
+    # The primary request still waiting on the slow server was cancelled, not left running
+    assert leftover == []
+    assert stats["hedgeWins"] == 1
+    assert len(primary.request_times) == 1
+
+
+def test_async_client_errors_are_not_retried(mock_deepseek):
+    server = mock_deepseek(fail_first=1, error_status=400)
+
+    async def scenario():
+        client = AsyncDeepSeekClient(server.url, max_retries=3, backoff_base=0.01, backoff_max=0.05)
+        try:
+            with pytest.raises(UpstreamError) as raised:
+                await client.complete(PAYLOAD, API_KEY)
+            return raised.value.status_code
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) == 400
+    assert len(server.request_times) == 1
+
+
+def test_read_timeouts_are_not_retried(mock_deepseek):
+    server = mock_deepseek(latency=1.0)
+    client = DeepSeekClient(server.url, read_timeout=0.2, max_retries=2, backoff_base=0.01, backoff_max=0.05)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamError):
+        client.complete(PAYLOAD, API_KEY)
+    # One read_timeout, not one per attempt: the completion may be running upstream
+    assert time.monotonic() - started < 0.8
+    assert len(server.request_times) == 1
+    assert client.stats()["statusCodes"] == {"timeout": 1}
+
+
+def test_connection_errors_are_retried(mock_deepseek):
+    server = mock_deepseek()
+    url = server.url
+    server.stop()  # Nothing listens on the port any more
+    client = DeepSeekClient(url, max_retries=2, backoff_base=0.01, backoff_max=0.05)
+
+    with pytest.raises(UpstreamError):
+        client.complete(PAYLOAD, API_KEY)
+    assert client.stats()["retries"] == 2
+
+
+def test_async_read_timeouts_are_not_retried(mock_deepseek):
+    server = mock_deepseek(latency=1.0)
+
+    async def scenario():
+        client = AsyncDeepSeekClient(server.url, read_timeout=0.2, max_retries=2, backoff_base=0.01,
+                                     backoff_max=0.05)
+        try:
+            with pytest.raises(UpstreamError):
+                await client.complete(PAYLOAD, API_KEY)
+            return client.stats()
+        finally:
+            await client.aclose()
+
+    stats = asyncio.run(scenario())
+    assert stats["retries"] == 0
+    assert len(server.request_times) == 1
@@ -0,0 +1,175 @@
+"""Essay (redação) statistics for /api/text-analysis: tokens, sentences,
+lexical diversity, stopword ratio and sentiment.
+
+The work runs in the cpu_pool.py workers. Each worker builds its Portuguese
+spaCy pipeline (tokenizer + sentencizer) once and keeps it, and a batch of
+essays goes through nlp.pipe in a single pool call. With parallel=True a
+batch is split across the pool workers instead (spaCy's own n_process can't
+be used there: the workers are daemonic and may not start children).
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import wait
+from typing import Any, Dict, List, Optional
+
+from cpu_pool import CpuPool
+from library_registry import get_library
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_LENGTH = 20000
+PIPE_BATCH_SIZE = 16
+
+# Per worker process: built on first use and kept
+_nlp: Any = None
+_sentiment: Any = None
+_sentiment_checked = False
+
+
+class TextAnalysisError(ValueError):
+    """Input that can't be analyzed; the message is shown to the student"""
+
+
+def pipeline():
+    """The blank Portuguese spaCy pipeline with a sentencizer, built once per process"""
+    global _nlp
+    if _nlp is None:
+        spacy = get_library('spacy')
+        nlp = spacy.blank('pt')
+        nlp.add_pipe('sentencizer')
+        _nlp = nlp
+    return _nlp
+
+
+def _sentiment_analyzer():
+    """TextBlobPT, or None when textblob_apt isn't installed (sentiment is then left out)"""
+    global _sentiment, _sentiment_checked
+    if not _sentiment_checked:
+        try:
+            _sentiment = get_library('textblob_pt')
+        except Exception:
+            _sentiment = None  # Already logged by the registry
+        _sentiment_checked = True
+    return _sentiment
+
+
+def load_pipeline() -> bool:
+    """Build the pipeline (and import TextBlobPT) in the calling worker"""
+    pipeline()
+    return _sentiment_analyzer() is not None
+
+
+def _describe(doc, text: str, sentiment_analyzer, include_tokens: bool) -> Dict:
+    words = [token.lower_ for token in doc if token.is_alpha]
+    stopwords = sum(1 for token in doc if token.is_alpha and token.is_stop)
+    sentences = sum(1 for sentence in doc.sents if any(not token.is_punct and not token.is_space
+                                                       for token in sentence))
+    tokens = [token.text for token in doc if not token.is_space]
+    result = {
+        "tokenCount": len(tokens),
+        "words": len(words),
+        "sentences": sentences,
+        "paragraphs": sum(1 for paragraph in text.splitlines() if paragraph.strip()),
+        "avgSentenceLength": round(len(words) / sentences, 2) if sentences else 0.0,
+        "lexicalDiversity": round(len(set(words)) / len(words), 4) if words else 0.0,
+        "stopwordRatio": round(stopwords / len(words), 4) if words else 0.0,
+        "sentiment": None,
+    }
+    if sentiment_analyzer is not None and words:
+        polarity, subjectivity = sentiment_analyzer(text).sentiment[:2]
+        result["sentiment"] = {"polarity": round(polarity, 4), "subjectivity": round(subjectivity, 4)}
+    if include_tokens:
+        result["tokens"] = tokens
+    return result
+
+
+def analyze_texts(texts: List[str], include_tokens: bool = False) -> List[Dict]:
+    """Statistics of each text, in order, from one nlp.pipe pass"""
+    nlp = pipeline()
+    sentiment_analyzer = _sentiment_analyzer()
+    return [_describe(doc, text, sentiment_analyzer, include_tokens)
+            for doc, text in zip(nlp.pipe(texts, batch_size=PIPE_BATCH_SIZE), texts)]
+
+
+# ---------------------------------------------------------------------------
+
+class TextAnalyzer:
+    """Batched essay analysis on the CPU pool, optionally spread over all its workers"""
+
+    def __init__(self, pool: CpuPool, timeout: float = 10.0, max_length: int = MAX_TEXT_LENGTH):
+        self.pool = pool
+        self.timeout = timeout
+        self.max_length = max_length
+        self._lock = threading.Lock()
+        self._counters = {"texts": 0, "batches": 0, "parallelBatches": 0, "poolCalls": 0}
+        self._pool_seconds = 0.0
+
+    def warm_up(self) -> threading.Thread:
+        """Load the pipeline in every worker, in a daemon thread"""
+        def load_everywhere():
+            # One task per worker, all at once: each holds its worker until done
+            futures = [self.pool.submit(load_pipeline, timeout=max(self.timeout, 30.0))
+                       for _ in range(self.pool.workers)]
+            try:
+                sentiment = all(future.result() for future in futures)
+                logger.info(f"Text analysis pipelines ready (sentiment {'on' if sentiment else 'off'})")
+            except Exception as e:
+                logger.warning(f"Could not load the text analysis pipelines: {e}")
+        thread = threading.Thread(target=load_everywhere, name='text-analysis-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def analyze(self, texts: List[str], parallel: bool = False, include_tokens: bool = False) -> List[Dict]:
+        """One result per text, in order; raises CpuTaskError when the pool fails"""
+        for text in texts:
+            if not isinstance(text, str) or not text.strip():
+                raise TextAnalysisError("Envie o texto da redação")
+            if len(text) > self.max_length:
+                raise TextAnalysisError(f"Texto longo demais (máximo de {self.max_length} caracteres)")
+        chunks = 1
+        if parallel:
+            chunks = max(1, min(self.pool.workers, len(texts)))
+        size = -(-len(texts) // chunks)
+        started = time.perf_counter()
+        try:
+            if chunks == 1:
+                results = self.pool.run(analyze_texts, texts, include_tokens, timeout=self.timeout)
+            else:
+                futures = [self.pool.submit(analyze_texts, texts[start:start + size], include_tokens,
+                                            timeout=self.timeout)
+                           for start in range(0, len(texts), size)]
+                wait(futures)
+                results = [result for future in futures for result in future.result()]
+        finally:
+            with self._lock:
+                self._counters["texts"] += len(texts)
+                self._counters["batches"] += 1
+                self._counters["parallelBatches"] += chunks > 1
+                self._counters["poolCalls"] += chunks
+                self._pool_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["avgBatchMs"] = round(self._pool_seconds / stats["batches"] * 1000, 3) if stats["batches"] else 0.0
+            stats["avgTextMs"] = round(self._pool_seconds / stats["texts"] * 1000, 3) if stats["texts"] else 0.0
+        stats["maxLength"] = self.max_length
+        return stats
+
+
+def text_analyzer_from_env(pool: CpuPool, warm_up: bool = True) -> Optional[TextAnalyzer]:
+    """Analyzer from LAYZA_TEXT_ANALYSIS_* variables, with the pipelines loaded in the
+    background if `warm_up` (None when LAYZA_TEXT_ANALYSIS_ENABLED=0)"""
+    if os.environ.get('LAYZA_TEXT_ANALYSIS_ENABLED', '1').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    analyzer = TextAnalyzer(
+        pool,
+        timeout=float(os.environ.get('LAYZA_TEXT_ANALYSIS_TIMEOUT', 10.0)),
+        max_length=int(os.environ.get('LAYZA_TEXT_ANALYSIS_MAX_LENGTH', MAX_TEXT_LENGTH)),
+    )
+    if warm_up:
+        analyzer.warm_up()
+    return analyzer
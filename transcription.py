@@ -0,0 +1,52 @@
+"""Speech-to-text engines for uploaded audio.
+
+Like the OCR backends, an engine is a module-level function taking the audio
+path and returning a dict with at least "text". It runs in the dedicated
+transcription process pool, never on a request thread.
+LAYZA_TRANSCRIBE_ENGINE picks one:
+
+    stub       (default) reads what it can about the file and returns placeholder text
+    whisper    faster-whisper (model in LAYZA_WHISPER_MODEL, default "small"), if installed
+    pkg.mod:fn any other function with the same signature
+"""
+import contextlib
+import os
+import wave
+from typing import Callable, Dict
+
+from job_queue import resolve_handler
+
+# Loaded once per worker process: a Whisper model takes seconds to load
+_whisper_model = None
+
+
+def stub_transcribe(path: str) -> Dict:
+    """Local stand-in for a speech-to-text engine"""
+    info = {"bytes": os.path.getsize(path)}
+    if path.endswith('.wav'):
+        with contextlib.suppress(wave.Error, EOFError), wave.open(path, 'rb') as audio:
+            info["durationSeconds"] = round(audio.getnframes() / audio.getframerate(), 3)
+    return {"engine": "stub", "text": "Texto transcrito do áudio enviado", **info}
+
+
+def whisper_transcribe(path: str) -> Dict:
+    """Transcription with faster-whisper on the CPU (int8), in Portuguese"""
+    global _whisper_model
+    if _whisper_model is None:
+        from faster_whisper import WhisperModel
+        _whisper_model = WhisperModel(os.environ.get('LAYZA_WHISPER_MODEL', 'small'),
+                                      device='cpu', compute_type='int8')
+    segments, info = _whisper_model.transcribe(path, language=os.environ.get('LAYZA_TRANSCRIBE_LANG', 'pt'))
+    text = ' '.join(segment.text.strip() for segment in segments)
+    return {"engine": "whisper", "text": text, "durationSeconds": round(info.duration, 3)}
+
+
+ENGINES = {
+    'stub': stub_transcribe,
+    'whisper': whisper_transcribe,
+}
+
+
+def transcriber_from_env() -> Callable[[str], Dict]:
+    """The function named by LAYZA_TRANSCRIBE_ENGINE (the stub if it can't be loaded)"""
+    return resolve_handler(os.environ.get('LAYZA_TRANSCRIBE_ENGINE', 'stub'), ENGINES, stub_transcribe)
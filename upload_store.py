@@ -0,0 +1,304 @@
+"""Content-addressed storage for uploaded files.
+
+Request bodies are parsed incrementally (werkzeug's sans-IO multipart
+decoder), so a phone photo goes to disk in chunks as it arrives instead of
+being buffered in memory. The file part is hashed while it is written and,
+once complete, moved to objects/<sha[:2]>/<sha[2:4]>/<sha><ext>; a file that
+is already there is kept and the new copy dropped, so identical uploads share
+one object. Size and type limits are checked while receiving: the type is
+sniffed from the first bytes, not taken from the client's Content-Type.
+
+    upload = MultipartUpload(store, request.content_type, 'image', IMAGE_TYPES, max_bytes)
+    for chunk in chunks:
+        upload.feed(chunk)
+    stored = upload.finish()
+
+Job results for an object (OCR, transcription...) are kept next to it as
+<sha>.<kind>.json so they survive restarts.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the request per step
+CHUNK_SIZE = 64 * 1024
+
+# Sniffed type -> stored extension
+IMAGE_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+    'image/heic': '.heic',
+}
+
+AUDIO_TYPES = {
+    'audio/webm': '.webm',  # MediaRecorder in Chrome and Firefox
+    'audio/ogg': '.ogg',
+    'audio/mpeg': '.mp3',
+    'audio/wav': '.wav',
+    'audio/mp4': '.m4a',  # MediaRecorder in Safari
+    'audio/flac': '.flac',
+}
+
+_OBJECT_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,8}$')
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """The upload was refused; `status` is the HTTP status to answer with"""
+    status = 400
+
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+
+class UnsupportedUpload(UploadError):
+    status = 415
+
+
+class MissingUpload(UploadError):
+    """The expected form field was not in the body"""
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """Media type from the first bytes of a file (None when not recognized)"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[4:8] == b'ftyp':
+        return 'image/heic' if head[8:12] in (b'heic', b'heix', b'mif1', b'msf1') else 'audio/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'audio/webm'
+    if head.startswith(b'OggS'):
+        return 'audio/ogg'
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xff and head[1] & 0xe0 == 0xe0):
+        return 'audio/mpeg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head.startswith(b'fLaC'):
+        return 'audio/flac'
+    return None
+
+
+class StoredObject(NamedTuple):
+    """A file in the content store"""
+    digest: str
+    name: str  # <digest><ext>, used in URLs
+    path: str
+    size: int
+    content_type: str
+    created: bool  # False when an identical file was already stored
+
+
+class ContentStore:
+    """Files stored under their SHA-256, with per-object job results"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._counters = {"stored": 0, "deduplicated": 0, "rejected": 0, "bytesStored": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _object_dir(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:4])
+
+    def temp_file(self):
+        """Open a temporary file on the same filesystem as the objects (for os.replace)"""
+        return tempfile.NamedTemporaryFile(dir=self.tmp_dir, prefix='upload-', delete=False)
+
+    def commit(self, temp_path: str, digest: str, ext: str, size: int, content_type: str) -> StoredObject:
+        """Move a fully written temporary file into place (or drop it if already stored)"""
+        directory = self._object_dir(digest)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{digest}{ext}"
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+            self._count("deduplicated")
+            return StoredObject(digest, name, path, size, content_type, False)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._counters["stored"] += 1
+            self._counters["bytesStored"] += size
+        return StoredObject(digest, name, path, size, content_type, True)
+
+    def path_for(self, name: str) -> Optional[str]:
+        """Path of a stored object from its URL name, or None"""
+        if not _OBJECT_NAME.match(name):
+            return None
+        path = os.path.join(self._object_dir(name[:64]), name)
+        return path if os.path.isfile(path) else None
+
+    def _result_path(self, digest: str, kind: str) -> str:
+        return os.path.join(self._object_dir(digest), f"{digest}.{kind}.json")
+
+    def load_result(self, digest: str, kind: str) -> Optional[Dict]:
+        """Stored job result for an object, or None"""
+        if not _DIGEST.match(digest):
+            return None
+        try:
+            with open(self._result_path(digest, kind), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable {kind} result for {digest[:12]}: {e}")
+            return None
+
+    def save_result(self, digest: str, kind: str, result: Dict) -> None:
+        path = self._result_path(digest, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["root"] = self.root
+        return stats
+
+
+class MultipartUpload:
+    """Receives one file field of a multipart/form-data body into the store.
+
+    Feed the raw body in chunks as it arrives; other fields are skipped.
+    Raises UploadTooLarge, UnsupportedUpload or MissingUpload (and removes
+    the partial file) as soon as the body breaks a limit.
+    """
+
+    def __init__(self, store: ContentStore, content_type: Optional[str], field: str,
+                 allowed_types: Dict[str, str], max_bytes: int):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise MissingUpload("Expected a multipart/form-data body")
+        self.store = store
+        self.field = field
+        self.allowed_types = allowed_types
+        self.max_bytes = max_bytes
+        self.filename: Optional[str] = None
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=64 * 1024)
+        self._in_field = False
+        self._done = False
+        self._file = None
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self._head = b''
+        self._content_type: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> None:
+        try:
+            self._receive(chunk)
+        except UploadError:
+            self.abort()
+            raise
+
+    def _receive(self, chunk: Optional[bytes]) -> None:
+        try:
+            self._decoder.receive_data(chunk)
+            self._drain()
+        except RequestEntityTooLarge:
+            raise UploadTooLarge("Multipart headers are too large")
+        except ValueError as e:
+            raise MissingUpload(f"Malformed multipart body: {e}")
+
+    def _drain(self) -> None:
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, (NeedData, Epilogue)):
+                return
+            if isinstance(event, File):
+                self._in_field = event.name == self.field and not self._done
+                if self._in_field:
+                    self.filename = event.filename
+                    self._file = self.store.temp_file()
+            elif isinstance(event, Data) and self._in_field:
+                self._write(event.data)
+                if not event.more_data:
+                    self._in_field = False
+                    self._done = True
+            elif not isinstance(event, Data):
+                self._in_field = False
+
+    def _write(self, data: bytes) -> None:
+        if not data:
+            return
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            raise UploadTooLarge(f"File is larger than {self.max_bytes} bytes")
+        if self._content_type is None:
+            self._head += data[:32 - len(self._head)]
+            if len(self._head) >= 32:
+                self._check_type()
+        self._hash.update(data)
+        self._file.write(data)
+
+    def _check_type(self) -> None:
+        content_type = sniff_type(self._head)
+        if content_type not in self.allowed_types:
+            raise UnsupportedUpload(f"Unsupported file type ({content_type or 'unknown'})")
+        self._content_type = content_type
+
+    def finish(self) -> StoredObject:
+        """Close the body and move the file into the store"""
+        try:
+            self._receive(None)
+            if not self._done or self._size == 0:
+                raise MissingUpload(f"No '{self.field}' file in the body")
+            if self._content_type is None:
+                self._check_type()
+        except UploadError:
+            self.abort()
+            raise
+        self._file.close()
+        stored = self.store.commit(self._file.name, self._hash.hexdigest(),
+                                   self.allowed_types[self._content_type], self._size, self._content_type)
+        self._file = None
+        return stored
+
+    def abort(self) -> None:
+        """Remove the partial file, if any"""
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+            self.store._count("rejected")
+
+
+def upload_store_from_env() -> Optional[ContentStore]:
+    """Open the store at LAYZA_UPLOAD_DIR (None if it can't be created)"""
+    root = os.environ.get('LAYZA_UPLOAD_DIR', os.path.join('var', 'uploads'))
+    try:
+        return ContentStore(root)
+    except OSError as e:
+        logger.error(f"Uploads disabled, could not create {root}: {e}")
+        return None
@@ -0,0 +1,541 @@
+"""HTTP client for the DeepSeek API: pooled sessions, retries, circuit breaker and hedging.
+
+A single DeepSeekClient is shared by every request so connections (and TLS
+sessions) are reused. Transient failures (429/5xx, failures to connect) are
+retried with jittered exponential backoff that honours Retry-After; a read
+timeout is not, since the completion may already be running upstream and each
+attempt could wait out another read_timeout. After repeated failures the
+circuit breaker opens and calls fail immediately, so the server answers with
+fallback_response instead of waiting on a degraded upstream. Optionally a hedged request is sent to a secondary endpoint/key
+when the primary is slower than a latency threshold.
+"""
+import asyncio
+import email.utils
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """The upstream call failed (after retries)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(UpstreamError):
+    """The circuit breaker is open; the upstream was not called"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, base: float, cap: float,
+                  retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff; Retry-After is used as a lower bound"""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe after a cool-down"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._counters = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        # Caller holds self._lock
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream right now"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._counters["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._counters["opened"] += 1
+                    logger.warning(f"Circuit breaker opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutiveFailures": self._failures,
+                **self._counters,
+            }
+
+
+class _DeepSeekClientBase:
+    """Configuration, counters and breaker bookkeeping shared by both clients"""
+
+    def __init__(self, url: str, secondary_url: Optional[str] = None,
+                 secondary_api_key: Optional[str] = None, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, max_retries: int = 2, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, hedge_after: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.url = url
+        self.secondary_url = secondary_url
+        self.secondary_api_key = secondary_api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.hedging = hedge_after is not None and bool(secondary_url or secondary_api_key)
+
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "retries": 0, "failures": 0, "hedges": 0, "hedgeWins": 0}
+        # Per HTTP attempt (retries included): status code, "timeout" or "error"
+        self._statuses: Dict[str, int] = {}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _count_status(self, status) -> None:
+        with self._lock:
+            self._statuses[str(status)] = self._statuses.get(str(status), 0) + 1
+
+    def _headers(self, api_key: str, stream: bool = False) -> Dict:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        if stream:
+            headers["Accept"] = "text/event-stream"
+        return headers
+
+    def _start_call(self) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenError("DeepSeek circuit breaker is open")
+        self._count("calls")
+
+    def _record_failure(self, error: Optional[UpstreamError]) -> None:
+        self._count("failures")
+        # Client errors such as 401/400 are our fault, not a sign of an unhealthy upstream
+        status = error.status_code if error is not None else None
+        if status is None or status in RETRYABLE_STATUS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _retry_delay(self, attempt: int, error: UpstreamError,
+                     retry_after: Optional[float]) -> Optional[float]:
+        """Seconds to sleep before the next attempt, or None to give up"""
+        if attempt >= self.max_retries:
+            return None
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+        if delay > self.backoff_max:
+            # Retry-After asks for more than we are willing to wait
+            return None
+        logger.warning(f"{error}; retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+        self._count("retries")
+        return delay
+
+    def _secondary(self, api_key: str) -> Tuple[str, str]:
+        return self.secondary_url or self.url, self.secondary_api_key or api_key
+
+    @staticmethod
+    def _parse_stream_line(line: str) -> Tuple[bool, Optional[str]]:
+        """(done, token) for one line of the upstream SSE stream"""
+        if not line or not line.startswith('data:'):
+            return False, None
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return True, None
+        chunk = json.loads(data)
+        return False, chunk['choices'][0].get('delta', {}).get('content') or None
+
+    @staticmethod
+    def _content(data: Dict) -> str:
+        try:
+            return data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError) as e:
+            raise UpstreamError(f"Unexpected DeepSeek response: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["statusCodes"] = dict(self._statuses)
+        stats["breaker"] = self.breaker.stats()
+        stats["hedging"] = self.hedging
+        return stats
+
+
+class DeepSeekClient(_DeepSeekClientBase):
+    """Shared blocking client for the DeepSeek chat completions API"""
+
+    def __init__(self, url: str, pool_size: int = 32, **kwargs):
+        super().__init__(url, **kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        if self.hedging:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=pool_size * 2,
+                                                  thread_name_prefix='deepseek-hedge')
+
+    def complete(self, payload: Dict, api_key: str) -> str:
+        """Return the assistant message for a non-streaming payload"""
+        self._start_call()
+        try:
+            if self._hedge_pool is not None:
+                data = self._hedged_post(payload, api_key)
+            else:
+                data = self._post_with_retries(self.url, api_key, payload)
+            content = self._content(data)
+        except UpstreamError as e:
+            self._record_failure(e)
+            raise
+
+        self.breaker.record_success()
+        return content
+
+    def probe(self) -> int:
+        """Open a pooled connection to the API (DNS, TLS) and return the HTTP
+        status of a HEAD request; any status means the upstream is reachable"""
+        try:
+            response = self.session.head(self.url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise UpstreamError(f"DeepSeek API unreachable: {e}") from None
+        response.close()
+        return response.status_code
+
+    def stream(self, payload: Dict, api_key: str) -> Iterator[str]:
+        """Yield content tokens from a streaming payload"""
+        self._start_call()
+        try:
+            with self.session.post(self.url, headers=self._headers(api_key, stream=True),
+                                   json=payload, stream=True, timeout=self.timeout) as response:
+                self._count_status(response.status_code)
+                if response.status_code != 200:
+                    raise UpstreamError(
+                        f"DeepSeek API error: {response.status_code}, {response.text}",
+                        status_code=response.status_code
+                    )
+                for line in response.iter_lines(decode_unicode=True):
+                    done, token = self._parse_stream_line(line)
+                    if done:
+                        self.breaker.record_success()
+                        return
+                    if token:
+                        yield token
+            raise UpstreamError("DeepSeek stream ended without [DONE] marker")
+        except GeneratorExit:
+            # The consumer stopped reading; the upstream itself was healthy
+            self.breaker.record_success()
+            raise
+        except UpstreamError as e:
+            self._record_failure(e)
+            raise
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            if isinstance(e, requests.exceptions.RequestException):
+                self._count_status('timeout' if isinstance(e, requests.exceptions.Timeout) else 'error')
+            self._record_failure(None)
+            raise UpstreamError(f"Error streaming from DeepSeek API: {e}")
+
+    def _post_with_retries(self, url: str, api_key: str, payload: Dict) -> Dict:
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.session.post(url, headers=self._headers(api_key),
+                                             json=payload, timeout=self.timeout)
+                self._count_status(response.status_code)
+                if response.status_code == 200:
+                    return response.json()
+                error = UpstreamError(
+                    f"DeepSeek API error: {response.status_code}, {response.text[:200]}",
+                    status_code=response.status_code
+                )
+                if response.status_code not in RETRYABLE_STATUS:
+                    raise error
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except requests.exceptions.RequestException as e:
+                self._count_status('timeout' if isinstance(e, requests.exceptions.Timeout) else 'error')
+                error = UpstreamError(f"Request error to DeepSeek API: {e}")
+                # ConnectTimeout is a ConnectionError too; ReadTimeout is not
+                if not isinstance(e, requests.exceptions.ConnectionError):
+                    raise error
+
+            delay = self._retry_delay(attempt, error, retry_after)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    def _hedged_post(self, payload: Dict, api_key: str) -> Dict:
+        """Send to the primary; if it is slower than hedge_after, race a secondary request"""
+        primary = self._hedge_pool.submit(self._post_with_retries, self.url, api_key, payload)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        secondary = self._hedge_pool.submit(self._post_with_retries, *self._secondary(api_key), payload)
+        pending = {primary, secondary}
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except UpstreamError as e:
+                    last_error = e
+                    continue
+                if future is secondary:
+                    self._count("hedgeWins")
+                return result
+        raise last_error
+
+
+class AsyncDeepSeekClient(_DeepSeekClientBase):
+    """Non-blocking client (aiohttp) for the async serving mode.
+
+    A single event loop can keep thousands of upstream calls pending; the
+    connection limit is the only cap. Create it inside the running loop and
+    pass the blocking client's breaker to share upstream health between modes.
+    """
+
+    def __init__(self, url: str, max_connections: int = 1000, **kwargs):
+        super().__init__(url, **kwargs)
+        import aiohttp  # Optional dependency, only needed by async_server.py
+
+        self._aiohttp = aiohttp
+        self._transport_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        # Newer aiohttp raises ConnectionTimeoutError for sock_connect; older
+        # versions a bare asyncio.TimeoutError (a read timeout is a ServerTimeoutError)
+        self._connect_errors = (aiohttp.ClientConnectorError,) + (
+            (aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, 'ConnectionTimeoutError') else ())
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout,
+                                          sock_read=self.read_timeout),
+        )
+
+    async def complete(self, payload: Dict, api_key: str) -> str:
+        """Return the assistant message for a non-streaming payload"""
+        self._start_call()
+        try:
+            if self.hedging:
+                data = await self._hedged_post(payload, api_key)
+            else:
+                data = await self._post_with_retries(self.url, api_key, payload)
+            content = self._content(data)
+        except UpstreamError as e:
+            self._record_failure(e)
+            raise
+
+        self.breaker.record_success()
+        return content
+
+    async def stream(self, payload: Dict, api_key: str) -> AsyncIterator[str]:
+        """Yield content tokens from a streaming payload"""
+        self._start_call()
+        try:
+            async with self.http.post(self.url, headers=self._headers(api_key, stream=True),
+                                      json=payload) as response:
+                self._count_status(response.status)
+                if response.status != 200:
+                    raise UpstreamError(
+                        f"DeepSeek API error: {response.status}, {await response.text()}",
+                        status_code=response.status
+                    )
+                async for raw_line in response.content:
+                    done, token = self._parse_stream_line(raw_line.decode('utf-8').strip())
+                    if done:
+                        self.breaker.record_success()
+                        return
+                    if token:
+                        yield token
+            raise UpstreamError("DeepSeek stream ended without [DONE] marker")
+        except (GeneratorExit, asyncio.CancelledError):
+            # The consumer stopped reading; the upstream itself was healthy
+            self.breaker.record_success()
+            raise
+        except UpstreamError as e:
+            self._record_failure(e)
+            raise
+        except self._transport_errors + (KeyError, IndexError, ValueError) as e:
+            if isinstance(e, self._transport_errors):
+                self._count_status('timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+            self._record_failure(None)
+            raise UpstreamError(f"Error streaming from DeepSeek API: {e}")
+
+    async def _post_with_retries(self, url: str, api_key: str, payload: Dict) -> Dict:
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self.http.post(url, headers=self._headers(api_key), json=payload) as response:
+                    self._count_status(response.status)
+                    if response.status == 200:
+                        return await response.json(content_type=None)
+                    error = UpstreamError(
+                        f"DeepSeek API error: {response.status}, {(await response.text())[:200]}",
+                        status_code=response.status
+                    )
+                    if response.status not in RETRYABLE_STATUS:
+                        raise error
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except self._transport_errors as e:
+                self._count_status('timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+                error = UpstreamError(f"Request error to DeepSeek API: {e!r}")
+                if not self._retryable_transport_error(e):
+                    raise error
+
+            delay = self._retry_delay(attempt, error, retry_after)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _retryable_transport_error(self, error: BaseException) -> bool:
+        """Only failures to connect: the request never reached the upstream"""
+        if isinstance(error, self._connect_errors):
+            return True
+        return isinstance(error, asyncio.TimeoutError) and not isinstance(error, self._aiohttp.ServerTimeoutError)
+
+    async def _hedged_post(self, payload: Dict, api_key: str) -> Dict:
+        """Send to the primary; if it is slower than hedge_after, race a secondary request"""
+        primary = asyncio.ensure_future(self._post_with_retries(self.url, api_key, payload))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        secondary = asyncio.ensure_future(self._post_with_retries(*self._secondary(api_key), payload))
+        pending = {primary, secondary}
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if task is secondary:
+                        self._count("hedgeWins")
+                    return task.result()
+        finally:
+            # Unlike threads, the losing request can actually be cancelled
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    async def aclose(self) -> None:
+        await self.http.close()
+
+
+def _optional_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def _client_options_from_env() -> Dict:
+    return dict(
+        secondary_url=os.environ.get('DEEPSEEK_SECONDARY_API_URL') or None,
+        secondary_api_key=os.environ.get('DEEPSEEK_SECONDARY_API_KEY') or None,
+        connect_timeout=float(os.environ.get('DEEPSEEK_CONNECT_TIMEOUT', 5)),
+        read_timeout=float(os.environ.get('DEEPSEEK_READ_TIMEOUT', 30)),
+        max_retries=int(os.environ.get('DEEPSEEK_MAX_RETRIES', 2)),
+        backoff_base=float(os.environ.get('DEEPSEEK_BACKOFF_BASE', 0.5)),
+        backoff_max=float(os.environ.get('DEEPSEEK_BACKOFF_MAX', 8)),
+        hedge_after=_optional_float('DEEPSEEK_HEDGE_AFTER'),
+    )
+
+
+def client_from_env(url: str) -> DeepSeekClient:
+    """Build the shared DeepSeek client from DEEPSEEK_* variables"""
+    return DeepSeekClient(
+        url,
+        pool_size=int(os.environ.get('DEEPSEEK_POOL_SIZE', 32)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get('DEEPSEEK_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.environ.get('DEEPSEEK_BREAKER_RESET', 30)),
+        ),
+        **_client_options_from_env(),
+    )
+
+
+def async_client_from_env(url: str, breaker: Optional[CircuitBreaker] = None) -> AsyncDeepSeekClient:
+    """Build the async DeepSeek client from DEEPSEEK_* variables"""
+    return AsyncDeepSeekClient(
+        url,
+        max_connections=int(os.environ.get('DEEPSEEK_ASYNC_MAX_CONNECTIONS', 1000)),
+        breaker=breaker,
+        **_client_options_from_env(),
+    )
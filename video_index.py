@@ -0,0 +1,392 @@
+"""Search over the catalog of ENEM lesson videos for /api/youtube-recommendations.
+
+The catalog (data/videos.json) is compiled into a single binary file: an
+inverted index of accent-folded, lightly stemmed Portuguese terms with the
+postings of each term, plus per-video lengths, subjects and the JSON shown
+to the client. The file is memory-mapped and its arrays are read in place
+with NumPy, so loading is O(1) whatever the catalog size, worker processes
+share the same pages, and a lookup only touches the postings of the query's
+terms. Results are ranked with BM25, optionally restricted to one subject.
+
+Scores are computed when the index is built: each posting stores its BM25
+weight (idf times the saturated term frequency) quantized to 16 bits. Long
+posting lists are split in two tiers, the HIGH_TIER_POSTINGS heaviest
+postings and the rest, and every tier records its largest weight. A query
+adds the high tiers of its terms, then the low ones (heaviest first), into a dense per-search score array; once
+the k-th best candidate already beats everything the remaining tiers could
+add, those are only looked up for the candidates (the MaxScore strategy), so
+a word found in a third of the catalog ("exercícios", "função") costs about
+as much as a rare one.
+
+Layout (little-endian, every section 4-byte aligned):
+
+    header           magic, counts, average video length, weight scale, catalog size/mtime
+    doc_subjects     uint8 per video (index in SUBJECTS + 1, 0 = none)
+    doc_meta         uint32 offsets into the JSON blob (videos + 1)
+    term_offsets     uint32 offsets into the term blob (terms + 1), terms sorted
+    term_postings    uint32 first posting of each term (terms + 1)
+    term_split       uint32 first posting of each term's low tier (its end if there is none)
+    term_max         uint16 largest weight of each term's high tier
+    term_low_max     uint16 largest weight of each term's low tier (0 if there is none)
+    posting_docs     uint32 video numbers, ascending within each tier
+    posting_weights  uint16 quantized BM25 weight per posting
+    term blob, JSON blob
+
+The index is rebuilt at startup whenever the catalog's size or mtime differ
+from the ones recorded in the header.
+"""
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from library_registry import get_library
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CATALOG_PATH = os.path.join(ROOT, 'data', 'videos.json')
+
+SUBJECTS = ('math', 'science', 'portuguese')
+# Fields shown to the client, kept in the index next to the postings
+PUBLIC_FIELDS = ('id', 'title', 'channel', 'subject', 'url', 'thumbnailUrl', 'durationSeconds')
+# A term in the title says more about a video than the same term in its tags
+FIELD_WEIGHTS = (('title', 3), ('tags', 2), ('channel', 1))
+
+# magic, videos, terms, postings, avg length, weight scale, catalog size, catalog mtime_ns
+_HEADER = struct.Struct('<4sIIIddQQ')
+_HEADER_BYTES = 64
+_MAGIC = b'LZV3'
+
+# BM25 parameters (the usual defaults), applied at build time
+K1 = 1.2
+B = 0.75
+# Postings kept in a term's high tier: enough for any subject to have a few
+HIGH_TIER_POSTINGS = 1024
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_STOPWORDS = frozenset("""
+a o e as os um uma uns umas de do da dos das em no na nos nas num numa por pelo pela para pra com sem
+que qual quais como onde quando se eu me meu minha voce ao aos sobre entre ou mais muito enem aula aulas
+video videos
+""".split())
+# Plural and gender endings, applied longest first to folded words of 4+ letters
+_SUFFIXES = (('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('ois', 'ol'), ('ns', 'm'), ('s', ''))
+
+
+def _fold(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _stem(word: str) -> str:
+    if len(word) < 4 or word.isdigit():
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix):
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def analyze(text: str) -> List[str]:
+    """Index terms of a text: accent-folded, lowercase, without stopwords, plural-stripped
+    ("Equações" -> "equacao", "funcoes" -> "funcao")"""
+    return [_stem(word) for word in _TOKEN_RE.findall(_fold(text)) if word not in _STOPWORDS]
+
+
+def _aligned(size: int) -> int:
+    return (size + 3) & ~3
+
+
+def build_index(videos: Iterable[Dict], path: str, catalog_size: int = 0, catalog_mtime_ns: int = 0) -> None:
+    """Compile `videos` into an index file at `path` (written atomically)"""
+    np = get_library('numpy')
+    postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+    lengths, subjects, metas = [], [], []
+    for number, video in enumerate(videos):
+        length = 0
+        for field, weight in FIELD_WEIGHTS:
+            value = video.get(field) or ''
+            text = ' '.join(value) if isinstance(value, list) else str(value)
+            for term in analyze(text):
+                postings[term][number] = postings[term].get(number, 0) + weight
+                length += weight
+        lengths.append(length)
+        subject = video.get('subject')
+        subjects.append(SUBJECTS.index(subject) + 1 if subject in SUBJECTS else 0)
+        metas.append(json.dumps({field: video.get(field) for field in PUBLIC_FIELDS},
+                                ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    count = len(lengths)
+    terms = sorted(postings, key=lambda term: term.encode('utf-8'))
+    term_blob = b''.join(term.encode('utf-8') for term in terms)
+    term_offsets = np.cumsum([0] + [len(term.encode('utf-8')) for term in terms])
+    term_postings = np.cumsum([0] + [len(postings[term]) for term in terms])
+    posting_docs = np.fromiter((number for term in terms for number in sorted(postings[term])),
+                               dtype=np.uint32, count=int(term_postings[-1]))
+    tfs = np.fromiter((postings[term][number] for term in terms for number in sorted(postings[term])),
+                      dtype=np.float64, count=len(posting_docs))
+    frequencies = np.diff(term_postings)
+    idf = np.log(1 + (count - frequencies + 0.5) / (frequencies + 0.5))
+    avg_length = sum(lengths) / count if count else 0.0
+    norms = K1 * (1 - B + B * np.array(lengths, dtype=np.float64)[posting_docs] / (avg_length or 1))
+    weights = np.repeat(idf, frequencies) * tfs * (K1 + 1) / (tfs + norms)
+    scale = float(weights.max()) / 0xFFFF if len(weights) else 1.0
+    quantized = np.maximum(1, np.rint(weights / scale)).astype(np.uint16)
+
+    term_split = term_postings[1:].copy()
+    for index in np.flatnonzero(frequencies > HIGH_TIER_POSTINGS):
+        first, end = term_postings[index], term_postings[index + 1]
+        docs, term_weights = posting_docs[first:end], quantized[first:end]
+        # Heaviest postings first, catalog order between equal weights; each tier by video number
+        order = np.lexsort((docs, -term_weights.astype(np.int32)))
+        high = np.sort(order[:HIGH_TIER_POSTINGS])
+        low = np.sort(order[HIGH_TIER_POSTINGS:])
+        posting_docs[first:end] = np.concatenate((docs[high], docs[low]))
+        quantized[first:end] = np.concatenate((term_weights[high], term_weights[low]))
+        term_split[index] = first + HIGH_TIER_POSTINGS
+
+    def tier_max(starts, ends):
+        return np.array([quantized[a:b].max() if b > a else 0 for a, b in zip(starts, ends)], dtype=np.uint16)
+
+    term_max = tier_max(term_postings[:-1], term_split)
+    term_low_max = tier_max(term_split, term_postings[1:])
+    meta_offsets = np.cumsum([0] + [len(meta) for meta in metas])
+
+    def section(values, dtype) -> bytes:
+        data = np.asarray(values, dtype=dtype).tobytes()
+        return data + b'\0' * (_aligned(len(data)) - len(data))
+
+    header = _HEADER.pack(_MAGIC, count, len(terms), len(posting_docs), avg_length, scale,
+                          catalog_size, catalog_mtime_ns)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(header.ljust(_HEADER_BYTES, b'\0'))
+        f.write(section(subjects, '<u1'))
+        f.write(section(meta_offsets, '<u4'))
+        f.write(section(term_offsets, '<u4'))
+        f.write(section(term_postings, '<u4'))
+        f.write(section(term_split, '<u4'))
+        f.write(section(term_max, '<u2'))
+        f.write(section(term_low_max, '<u2'))
+        f.write(section(posting_docs, '<u4'))
+        f.write(section(quantized, '<u2'))
+        f.write(term_blob)
+        f.write(b''.join(metas))
+    # Other workers may be building the same file: the last rename wins, all are identical
+    os.replace(temporary, path)
+
+
+class VideoIndex:
+    """Read-only BM25 index over a memory-mapped index file"""
+
+    def __init__(self, path: str):
+        np = self._np = get_library('numpy')
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.doc_count, self.term_count, self.posting_count, self.avg_length, self.scale,
+         self.catalog_size, self.catalog_mtime_ns) = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a video index (or an older format)")
+        offset = _HEADER_BYTES
+
+        def array(dtype, count: int):
+            nonlocal offset
+            view = np.frombuffer(self._map, dtype=dtype, count=count, offset=offset)
+            offset += _aligned(view.nbytes)
+            return view
+
+        self._subjects = array('u1', self.doc_count)
+        self._meta_offsets = array('<u4', self.doc_count + 1)
+        # A plain memoryview for the binary search: indexing it is cheaper than NumPy scalars
+        self._term_offsets = memoryview(array('<u4', self.term_count + 1)).cast('B').cast('I')
+        self._term_postings = array('<u4', self.term_count + 1)
+        self._term_split = array('<u4', self.term_count)
+        self._term_max = array('<u2', self.term_count)
+        self._term_low_max = array('<u2', self.term_count)
+        self._posting_docs = array('<u4', self.posting_count)
+        self._posting_weights = array('<u2', self.posting_count)
+        self._terms_start = offset
+        self._metas_start = offset + self._term_offsets[self.term_count]
+        # Dense score arrays, reused between searches (one per concurrent search)
+        self._accumulators = []
+        self._lock = threading.Lock()
+        self._counters = {"searches": 0, "empty": 0, "prunedTiers": 0}
+        self._total_seconds = 0.0
+
+    def _postings(self, term: str) -> List[Tuple[int, int, int]]:
+        """(first, end, largest weight) of each tier of a term's postings, by binary search over the sorted terms"""
+        key = term.encode('utf-8')
+        offsets, blob = self._term_offsets, self._terms_start
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self._map[blob + offsets[middle]:blob + offsets[middle + 1]]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                first, split, end = (int(self._term_postings[middle]), int(self._term_split[middle]),
+                                     int(self._term_postings[middle + 1]))
+                tiers = [(first, split, int(self._term_max[middle]))]
+                if split < end:
+                    tiers.append((split, end, int(self._term_low_max[middle])))
+                return tiers
+        return []
+
+    def video(self, number: int) -> Dict:
+        start = self._metas_start + int(self._meta_offsets[number])
+        end = self._metas_start + int(self._meta_offsets[number + 1])
+        return json.loads(self._map[start:end])
+
+    def _matched(self, scores, touched: List):
+        """Sorted, distinct video numbers in `touched` (weights are >= 1, so they are the
+        non-zero scores; scanning the accumulator beats sorting once the lists are long)"""
+        np = self._np
+        if sum(len(docs) for docs in touched) > self.doc_count // 16:
+            return np.flatnonzero(scores).astype(np.uint32)
+        # np.unique would do, but its first call imports numpy.ma (~15 ms)
+        merged = np.sort(np.concatenate(touched))
+        distinct = np.ones(len(merged), dtype=bool)
+        np.not_equal(merged[1:], merged[:-1], out=distinct[1:])
+        return merged[distinct]
+
+    def _rank(self, tiers: List[List[Tuple[int, int, int]]], subject_code: Optional[int], limit: int):
+        """(video numbers, quantized scores) of the best `limit` matches among the
+        postings `tiers` of each query term, best first"""
+        np = self._np
+        with self._lock:
+            scores = self._accumulators.pop() if self._accumulators else np.zeros(self.doc_count, np.float32)
+        try:
+            # Every term's high tier (heaviest first), then the low tiers: the videos
+            # that score well on several terms are found before the long tails are read.
+            # `remaining[i]` bounds what tiers i.. can still add to any video
+            spans = (sorted((term[0] for term in tiers), key=lambda span: -span[2])
+                     + sorted((span for term in tiers for span in term[1:]), key=lambda span: -span[2]))
+            remaining = [sum(span[2] for span in spans[i:]) for i in range(len(spans))]
+            touched, pruned_from = [], len(spans)
+            for i, (first, end, _) in enumerate(spans):
+                if touched:
+                    candidates = touched[0] if len(touched) == 1 else self._matched(scores, touched)
+                    touched = [candidates]
+                    if len(candidates) >= limit and np.partition(scores[candidates], -limit)[-limit] >= remaining[i]:
+                        # A video none of the earlier tiers matched can no longer reach the top `limit`
+                        pruned_from = i
+                        break
+                docs = self._posting_docs[first:end]
+                weights = self._posting_weights[first:end]
+                if subject_code is not None:
+                    keep = self._subjects[docs] == subject_code
+                    docs, weights = docs[keep], weights[keep]
+                scores[docs] += weights
+                touched.append(docs)
+            candidates = touched[0] if len(touched) == 1 else self._matched(scores, touched)
+            for first, end, _ in spans[pruned_from:]:
+                docs = self._posting_docs[first:end]
+                positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                found = docs[positions] == candidates
+                scores[candidates[found]] += self._posting_weights[first:end][positions[found]]
+            found_scores = scores[candidates]
+            scores[candidates] = 0
+        finally:
+            with self._lock:
+                self._accumulators.append(scores)
+        if len(spans) > pruned_from:
+            with self._lock:
+                self._counters["prunedTiers"] += len(spans) - pruned_from
+        if len(candidates) > limit:
+            best = np.argpartition(-found_scores, limit)[:limit]
+            candidates, found_scores = candidates[best], found_scores[best]
+        # Highest score first, catalog order between equal scores
+        order = np.lexsort((candidates, -found_scores))
+        return candidates[order], found_scores[order]
+
+    def search(self, query: str, subject: Optional[str] = None, limit: int = 3) -> List[Dict]:
+        """The `limit` best videos for `query` (BM25), only from `subject` if given;
+        with no usable query terms, the first videos of the subject"""
+        started = time.perf_counter()
+        np = self._np
+        subject_code = SUBJECTS.index(subject) + 1 if subject in SUBJECTS else None
+        terms = list(dict.fromkeys(analyze(query or '')))
+        results = []
+        if terms:
+            tiers = [postings for postings in map(self._postings, terms) if postings]
+            if tiers:
+                for number, score in zip(*self._rank(tiers, subject_code, limit)):
+                    video = self.video(int(number))
+                    video["score"] = round(float(score) * self.scale, 3)
+                    results.append(video)
+        else:
+            numbers = (np.flatnonzero(self._subjects == subject_code)[:limit] if subject_code is not None
+                       else range(min(limit, self.doc_count)))
+            results = [self.video(int(number)) for number in numbers]
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._counters["searches"] += 1
+            self._counters["empty"] += not results
+            self._total_seconds += elapsed
+        return results
+
+    def close(self) -> None:
+        # The NumPy views export the map's buffer: drop them before closing it
+        self._term_offsets.release()
+        self._subjects = self._meta_offsets = self._term_postings = self._term_split = None
+        self._term_max = self._term_low_max = None
+        self._posting_docs = self._posting_weights = None
+        self._map.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            searches = stats["searches"]
+            stats["avgMicros"] = round(self._total_seconds / searches * 1e6, 1) if searches else 0.0
+        stats.update(videos=self.doc_count, terms=self.term_count, postings=self.posting_count,
+                     indexBytes=len(self._map))
+        return stats
+
+
+def open_index(catalog_path: str, index_path: str) -> VideoIndex:
+    """Load the index for a catalog, (re)building it first if it is missing or stale"""
+    status = os.stat(catalog_path)
+    try:
+        with open(index_path, 'rb') as f:
+            header = f.read(_HEADER.size)
+        magic, *_, size, mtime_ns = _HEADER.unpack(header)
+        fresh = magic == _MAGIC and (size, mtime_ns) == (status.st_size, status.st_mtime_ns)
+    except (OSError, struct.error):
+        fresh = False
+    if not fresh:
+        started = time.perf_counter()
+        with open(catalog_path, encoding='utf-8') as f:
+            videos = json.load(f)
+        build_index(videos, index_path, status.st_size, status.st_mtime_ns)
+        logger.info(f"Video index built from {len(videos)} videos in {time.perf_counter() - started:.2f}s")
+    return VideoIndex(index_path)
+
+
+def video_index_from_env() -> Optional[VideoIndex]:
+    """Index of LAYZA_VIDEO_CATALOG_PATH stored at LAYZA_VIDEO_INDEX_PATH (None if it can't be built)"""
+    catalog_path = os.environ.get('LAYZA_VIDEO_CATALOG_PATH', DEFAULT_CATALOG_PATH)
+    index_path = os.environ.get('LAYZA_VIDEO_INDEX_PATH', os.path.join('var', 'video-index.bin'))
+    try:
+        index = open_index(catalog_path, index_path)
+    except Exception as e:
+        logger.error(f"Could not load the video index for {catalog_path}: {e}")
+        return None
+    if index.doc_count:
+        # Page in the tables and NumPy's code paths before the first user's request
+        index.search(index.video(0)["title"])
+    logger.info(f"Video index loaded: {index.doc_count} videos, {index.term_count} terms from {index_path}")
+    return index